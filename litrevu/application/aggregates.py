@@ -0,0 +1,104 @@
+from django.db.models import Count, F, Max, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce, Greatest
+from application.cache import bump_feed_versions
+from application.feed import ticket_readers
+from application.models import Review, Ticket
+
+RECONCILE_BATCH_SIZE = 1000
+
+
+def review_added(ticket_id, rating, time_created):
+    """
+    Ajoute une critique aux agrégats de son ticket, par une seule requête
+    UPDATE calculée par la base (expressions F) : deux critiques
+    simultanées ne peuvent pas écraser le décompte l'une de l'autre.
+    """
+    Ticket.objects.filter(id=ticket_id).update(
+        review_count=F('review_count') + 1,
+        rating_sum=F('rating_sum') + rating,
+        last_reviewed_at=Greatest(
+            Coalesce('last_reviewed_at', time_created), time_created))
+
+
+def _last_review_time():
+    return Subquery(Review.objects.filter(ticket=OuterRef('pk')).order_by(
+        '-time_created').values('time_created')[:1])
+
+
+def review_removed(ticket_id, rating):
+    """
+    Retire une critique des agrégats de son ticket. La date de la dernière
+    critique est relue sur l'index (ticket, -time_created) des critiques
+    restantes.
+    """
+    Ticket.objects.filter(id=ticket_id).update(
+        review_count=F('review_count') - 1,
+        rating_sum=F('rating_sum') - rating,
+        last_reviewed_at=_last_review_time())
+
+
+def review_changed(ticket_id, rating, old_rating):
+    """
+    Reporte le changement de note d'une critique sur son ticket.
+    """
+    if rating != old_rating:
+        Ticket.objects.filter(id=ticket_id).update(
+            rating_sum=F('rating_sum') + rating - old_rating)
+
+
+def _actual(ticket_ids):
+    """
+    Calcule les agrégats exacts des tickets donnés, en une requête groupée.
+    """
+    rows = Review.objects.filter(ticket__in=ticket_ids).order_by().values(
+        'ticket').annotate(count=Count('id'), total=Sum('rating'),
+                           last=Max('time_created')).values_list(
+        'ticket', 'count', 'total', 'last')
+    return {ticket: (count, total, last)
+            for ticket, count, total, last in rows}
+
+
+def _aggregate(function):
+    return Coalesce(Subquery(Review.objects.filter(
+        ticket=OuterRef('pk')).order_by().values('ticket').annotate(
+        value=function).values('value')), 0)
+
+
+def reconcile(batch_size=RECONCILE_BATCH_SIZE, dry_run=False):
+    """
+    Recalcule les agrégats de tous les tickets et corrige ceux qui ont
+    dérivé (écritures faites sans signaux, comme bulk_create, ou
+    interrompues).
+
+    Les tickets sont parcourus par lots de `batch_size`, dans l'ordre des
+    identifiants : deux requêtes de lecture par lot, puis une requête
+    UPDATE pour les seuls tickets à corriger. Les nouvelles valeurs y sont
+    recalculées par des sous-requêtes : une critique écrite entre la
+    lecture et la correction est comptée. UPDATE n'émettant aucun signal,
+    les flux des lecteurs des tickets corrigés sont invalidés ici.
+
+    Returns:
+        int: Le nombre de tickets corrigés (ou à corriger si `dry_run`).
+    """
+    repaired = 0
+    last_id = 0
+    while True:
+        tickets = list(Ticket.objects.filter(id__gt=last_id).order_by(
+            'id').values_list('id', 'review_count', 'rating_sum',
+                              'last_reviewed_at')[:batch_size])
+        if not tickets:
+            return repaired
+        last_id = tickets[-1][0]
+        actual = _actual([ticket[0] for ticket in tickets])
+        drifted = [id for id, *stored in tickets
+                   if tuple(stored) != actual.get(id, (0, 0, None))]
+        repaired += len(drifted)
+        if drifted and not dry_run:
+            Ticket.objects.filter(id__in=drifted).update(
+                review_count=_aggregate(Count('id')),
+                rating_sum=_aggregate(Sum('rating')),
+                last_reviewed_at=_last_review_time())
+            readers = set()
+            for id in drifted:
+                readers |= ticket_readers(id)
+            bump_feed_versions(readers)
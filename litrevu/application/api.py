@@ -0,0 +1,170 @@
+import json
+from datetime import datetime
+from functools import partial
+from django.core.exceptions import BadRequest
+from django.core.files.storage import default_storage
+from application.feed import FEED_PAGE_SIZE, REVIEW, TICKET, paginate
+from application.feed import timeline_entries
+from application.models import Review, Ticket
+from litrevu.storage import content_addressed_storage
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+API_MAX_PAGE_SIZE = 100
+
+
+def _image_url(name):
+    return content_addressed_storage().url(name) if name else None
+
+
+def _thumbnail_urls(thumbnails):
+    return {extension: [[width, default_storage.url(name)]
+                        for width, name in sizes]
+            for extension, sizes in thumbnails.items()}
+
+
+def _average(rating_sum, review_count):
+    return rating_sum / review_count if review_count else None
+
+
+# Champs exposés par type d'élément : le nom dans l'API, le chemin passé à
+# values() (ou les chemins, pour un champ calculé) et, au besoin, la
+# conversion des valeurs lues.
+TICKET_FIELDS = {
+    'id': ('id', None),
+    'time_created': ('time_created', None),
+    'user': ('user__username', None),
+    'title': ('title', None),
+    'description': ('description', None),
+    'image': ('image', _image_url),
+    'thumbnails': ('thumbnails', _thumbnail_urls),
+    'has_review': ('review_count', bool),
+    'review_count': ('review_count', None),
+    'average_rating': (('rating_sum', 'review_count'), _average),
+    'last_reviewed_at': ('last_reviewed_at', None),
+}
+REVIEW_FIELDS = {
+    'id': ('id', None),
+    'time_created': ('time_created', None),
+    'user': ('user__username', None),
+    'ticket': ('ticket_id', None),
+    'ticket_title': ('ticket__title', None),
+    'ticket_user': ('ticket__user__username', None),
+    'rating': ('rating', None),
+    'headline': ('headline', None),
+    'body': ('body', None),
+}
+FIELDS = {TICKET: TICKET_FIELDS, REVIEW: REVIEW_FIELDS}
+
+
+def parse_fields(value):
+    """
+    Lit le paramètre 'fields' : une liste de champs séparés par des
+    virgules. Chaque champ s'applique aux types d'éléments qui l'ont ;
+    'kind' et 'id' sont toujours renvoyés.
+
+    Returns:
+        set: Les champs demandés, ou tous les champs si `value` est vide.
+
+    Raises:
+        BadRequest: Si un champ est inconnu.
+    """
+    known = set(TICKET_FIELDS) | set(REVIEW_FIELDS)
+    if not value:
+        return known
+    fields = {field.strip() for field in value.split(',') if field.strip()}
+    unknown = fields - known
+    if unknown:
+        raise BadRequest('Champs inconnus : {}.'.format(
+            ', '.join(sorted(unknown))))
+    return fields | {'id'}
+
+
+def _rows(kind, ids, fields):
+    """
+    Lit les champs demandés des éléments d'un type par une requête
+    values() : aucune instance de modèle n'est construite.
+    """
+    spec = {}
+    for name, (paths, convert) in FIELDS[kind].items():
+        if name in fields:
+            spec[name] = ((paths,) if isinstance(paths, str) else paths,
+                          convert)
+    queryset = Ticket.objects if kind == TICKET else Review.objects
+    rows = {}
+    for values in queryset.filter(id__in=ids).values(
+            *{path for paths, _ in spec.values() for path in paths}):
+        row = {'kind': kind}
+        for name, (paths, convert) in spec.items():
+            if convert:
+                row[name] = convert(*[values[path] for path in paths])
+            else:
+                row[name] = values[paths[0]]
+        rows[row['id']] = row
+    return rows
+
+
+def project(entries, fields):
+    """
+    Équivalent de application.feed.hydrate pour l'API : charge les champs
+    demandés des entrées du flux, en une requête par type, et renvoie des
+    dictionnaires dans l'ordre des entrées.
+    """
+    rows = {}
+    for kind in (TICKET, REVIEW):
+        ids = [entry['id'] for entry in entries if entry['kind'] == kind]
+        rows[kind] = _rows(kind, ids, fields) if ids else {}
+    return [rows[entry['kind']][entry['id']] for entry in entries
+            if entry['id'] in rows[entry['kind']]]
+
+
+def feed_items_page(user, fields, before=None, after=None,
+                    limit=FEED_PAGE_SIZE):
+    """
+    Retourne une page du flux de l'utilisateur sous forme de
+    dictionnaires, pour l'API JSON (voir application.feed.feed_page).
+    """
+    return paginate(partial(timeline_entries, user), before=before,
+                    after=after, limit=limit,
+                    load=partial(project, fields=fields))
+
+
+def parse_limit(value):
+    """
+    Lit le paramètre 'limit' (taille de page), FEED_PAGE_SIZE par défaut.
+
+    Raises:
+        BadRequest: Si `value` n'est pas un entier entre 1 et
+        API_MAX_PAGE_SIZE.
+    """
+    if not value:
+        return FEED_PAGE_SIZE
+    try:
+        limit = int(value)
+    except ValueError:
+        limit = 0
+    if not 1 <= limit <= API_MAX_PAGE_SIZE:
+        raise BadRequest('limit doit être compris entre 1 et {}.'.format(
+            API_MAX_PAGE_SIZE))
+    return limit
+
+
+def _default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(type(value).__name__)
+
+
+def dumps(data):
+    """
+    Sérialise `data` en JSON compact (bytes). orjson est utilisé s'il est
+    installé, le module json sinon ; les dates sont écrites en ISO 8601
+    dans les deux cas.
+    """
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':'),
+                      default=_default).encode()
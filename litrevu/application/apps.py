@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class ApplicationConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'application'
+
+    def ready(self):
+        from application import signals  # noqa: F401
+        from litrevu import database  # noqa: F401
@@ -0,0 +1,273 @@
+import json
+import random
+import statistics
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import timedelta
+from django.core.cache import cache
+from django.db import connection, reset_queries
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.test.utils import setup_test_environment
+from django.test.utils import teardown_test_environment
+from django.urls import reverse
+from django.utils import timezone
+from application.aggregates import reconcile
+from application.feed import feed_page, rebuild_feed
+from application.models import Review, Ticket, UserBlock, UserFollows
+from application.search import search_backend
+from authentication.models import User
+
+BENCHMARK_BATCH_SIZE = 1000
+USERNAME_PREFIX = 'bench'
+
+DEFAULT_SCALE = {
+    'users': 200,
+    'follows': 20,
+    'blocks': 1,
+    'tickets': 5,
+    'reviews': 3,
+}
+
+# Marges tolérées par rapport à la référence avant de considérer une
+# mesure comme une régression. Le nombre de requêtes, déterministe, ne
+# tolère aucune hausse.
+DEFAULT_TOLERANCE = {'p50_ms': 0.25, 'p95_ms': 0.5, 'peak_kib': 0.25}
+
+
+@contextmanager
+def throwaway_database():
+    """
+    Crée une base de test jetable et un cache privé au processus, détruits
+    à la sortie : les mesures n'écrivent ni dans la base (sessions,
+    publications) ni dans le cache (flux, limitation du débit) du site.
+    """
+    setup_test_environment(debug=False)
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True,
+                                       serialize=False)
+    try:
+        with override_settings(CACHES={'default': {
+                'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                'LOCATION': 'benchmark'}}):
+            yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+
+
+def _bulk_create(model, objects, **kwargs):
+    for start in range(0, len(objects), BENCHMARK_BATCH_SIZE):
+        model.objects.bulk_create(
+            objects[start:start + BENCHMARK_BATCH_SIZE], **kwargs)
+
+
+def _spread_dates(model, rng, now):
+    """
+    Répartit les dates de création des lignes sur l'année écoulée :
+    auto_now_add les a toutes fixées à l'instant de l'insertion.
+    """
+    instances = list(model.objects.only('id'))
+    for instance in instances:
+        instance.time_created = now - timedelta(
+            seconds=rng.randrange(365 * 24 * 3600))
+    model.objects.bulk_update(instances, ['time_created'],
+                              batch_size=BENCHMARK_BATCH_SIZE)
+
+
+def _others(rng, ids, user_id, count):
+    sample = rng.sample(ids, min(count + 1, len(ids)))
+    return [other for other in sample if other != user_id][:count]
+
+
+def seed(users, follows, blocks, tickets, reviews, seed=0):
+    """
+    Remplit la base avec un graphe social synthétique et reproductible :
+    `users` utilisateurs, chacun suivant `follows` utilisateurs et en
+    bloquant `blocks`, publiant `tickets` tickets et `reviews` critiques
+    de tickets tirés au hasard. Les lignes sont insérées par bulk_create,
+    puis les flux matérialisés, l'index de recherche et les agrégats des
+    tickets sont reconstruits.
+
+    Returns:
+        list: Les identifiants des utilisateurs créés.
+    """
+    rng = random.Random(seed)
+    now = timezone.now()
+    _bulk_create(User, [
+        User(username='{}{:07d}'.format(USERNAME_PREFIX, index),
+             password='!')
+        for index in range(users)])
+    ids = list(User.objects.filter(
+        username__startswith=USERNAME_PREFIX).order_by('id').values_list(
+        'id', flat=True))
+
+    _bulk_create(UserFollows, [
+        UserFollows(user_id=user_id, followed_user_id=other)
+        for user_id in ids for other in _others(rng, ids, user_id, follows)],
+        ignore_conflicts=True)
+    _bulk_create(UserBlock, [
+        UserBlock(user_id=user_id, blocked_user_id=other)
+        for user_id in ids for other in _others(rng, ids, user_id, blocks)],
+        ignore_conflicts=True)
+    _bulk_create(Ticket, [
+        Ticket(user_id=user_id, title='Livre {} de {}'.format(index, user_id),
+               description='Description du livre {}'.format(index))
+        for user_id in ids for index in range(tickets)])
+    _spread_dates(Ticket, rng, now)
+    ticket_ids = list(Ticket.objects.values_list('id', flat=True))
+    _bulk_create(Review, [
+        Review(user_id=user_id, ticket_id=rng.choice(ticket_ids),
+               rating=rng.randrange(6), headline='Critique {}'.format(index),
+               body='Texte de la critique')
+        for user_id in ids for index in range(reviews)])
+    _spread_dates(Review, rng, now)
+
+    for user in User.objects.filter(id__in=ids).iterator():
+        rebuild_feed(user)
+    search_backend().rebuild()
+    reconcile()
+    cache.clear()
+    return ids
+
+
+def scenarios(user):
+    """
+    Retourne les scénarios mesurés pour l'utilisateur donné : un nom, une
+    méthode HTTP, l'URL et une fonction donnant les données du formulaire
+    pour la i-ème requête (None pour un GET).
+    """
+    older = feed_page(user)['older']
+    followed = set(UserFollows.objects.filter(user=user).values_list(
+        'followed_user_id', flat=True))
+    candidates = list(User.objects.exclude(id__in=followed | {user.id})
+                      .order_by('id').values_list('username', flat=True))
+    ticket_id = Ticket.objects.exclude(user=user).values_list(
+        'id', flat=True).first()
+    review = {'rating': 4, 'headline': 'Critique', 'body': 'Texte'}
+    return [
+        ('flux', 'get', reverse('flux'), None),
+        ('flux_page_2', 'get', '{}?before={}'.format(reverse('flux'), older)
+         if older else reverse('flux'), None),
+        ('flux_api', 'get', reverse('fluxapi'), None),
+        ('fluxperso', 'get', reverse('fluxperso'), None),
+        ('follow_page', 'get', reverse('followUsers'), None),
+        ('follow_user', 'post', reverse('followUsers'),
+         lambda i: {'username': candidates[i % len(candidates)]}),
+        ('ticket_creation', 'post', reverse('ticketcreation'),
+         lambda i: {'title': 'Ticket {}'.format(i), 'description': 'x'}),
+        ('ticket_review_creation', 'post', reverse('ticketreviewcreation'),
+         lambda i: {'title': 'Ticket {}'.format(i), 'description': 'x',
+                    **review}),
+        ('review_creation', 'post',
+         reverse('createreview', args=[ticket_id]), lambda i: review),
+    ]
+
+
+def _percentile(values, percent):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100))]
+
+
+def measure(user, requests=20, warm=False):
+    """
+    Mesure chaque scénario par `requests` requêtes du client de test
+    Django, connecté en tant que `user`.
+
+    Le cache est vidé avant chaque requête, pour mesurer le chemin complet
+    (base et rendu), sauf si `warm` est vrai. Le pic de
+    mémoire est mesuré par tracemalloc sur une requête supplémentaire, à
+    part, pour ne pas fausser les temps.
+
+    Returns:
+        dict: Par scénario, le nombre de requêtes SQL (maximum observé),
+        les temps p50, p95 et p99 en millisecondes et le pic de mémoire en
+        Kio.
+    """
+    client = Client()
+    client.force_login(user)
+    # Les scénarios d'écriture dépassent volontairement les budgets de
+    # litrevu.ratelimit : la limitation est désactivée pendant la mesure.
+    with override_settings(RATE_LIMITS={}):
+        return _measure(client, user, requests, warm)
+
+
+def _measure(client, user, requests, warm):
+    results = {}
+    for name, method, url, data in scenarios(user):
+        def call(index):
+            if not warm:
+                cache.clear()
+            if method == 'get':
+                response = client.get(url)
+            else:
+                response = client.post(url, data(index))
+            if response.status_code >= 400:
+                raise RuntimeError('{} : réponse {}'.format(
+                    name, response.status_code))
+
+        durations, query_counts = [], []
+        for index in range(requests):
+            # Le client vide le journal des requêtes au début de chaque
+            # requête HTTP (request_started) : il doit l'être aussi avant
+            # la capture pour que le décompte parte de zéro.
+            reset_queries()
+            with CaptureQueriesContext(connection) as queries:
+                start = time.perf_counter()
+                call(index)
+                durations.append(time.perf_counter() - start)
+            query_counts.append(len(queries))
+        tracemalloc.start()
+        try:
+            call(requests)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        results[name] = {
+            'queries': max(query_counts),
+            'p50_ms': round(statistics.median(durations) * 1000, 2),
+            'p95_ms': round(_percentile(durations, 95) * 1000, 2),
+            'p99_ms': round(_percentile(durations, 99) * 1000, 2),
+            'peak_kib': round(peak / 1024, 1),
+        }
+    return results
+
+
+def regressions(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """
+    Compare des mesures à une référence.
+
+    Returns:
+        list: Les messages décrivant chaque régression : hausse du nombre
+        de requêtes SQL, ou dépassement de la marge tolérée sur les temps
+        et la mémoire. Un scénario absent de la référence est ignoré.
+    """
+    problems = []
+    for name, result in results.items():
+        reference = baseline.get(name)
+        if reference is None:
+            continue
+        if result['queries'] > reference['queries']:
+            problems.append('{} : {} requêtes SQL au lieu de {}'.format(
+                name, result['queries'], reference['queries']))
+        for metric, margin in tolerance.items():
+            limit = reference[metric] * (1 + margin)
+            if result[metric] > limit:
+                problems.append('{} : {} = {} au-delà de {:.2f} '
+                                '(référence {} + {:.0%})'.format(
+                                    name, metric, result[metric], limit,
+                                    reference[metric], margin))
+    return problems
+
+
+def load_baseline(path):
+    with open(path, encoding='utf-8') as file:
+        return json.load(file)['results']
+
+
+def save_baseline(path, results, scale):
+    with open(path, 'w', encoding='utf-8') as file:
+        json.dump({'scale': scale, 'results': results}, file, indent=2,
+                  sort_keys=True)
+        file.write('\n')
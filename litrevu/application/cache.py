@@ -0,0 +1,249 @@
+import hashlib
+import time
+from datetime import datetime, timezone
+from django.conf import settings
+from django.core.cache import cache
+from django.template.loader import get_template, render_to_string
+from django.templatetags.static import static
+from django.utils.safestring import mark_safe
+from asgiref.sync import sync_to_async
+from application.models import Review, Ticket
+
+FEED_VERSION_KEY = 'feed-version:{}'
+FEED_FRAGMENT_KEY = 'feed-fragment:{}:{}:{}:{}:{}'
+FEED_CARD_KEY = 'feed-card:{}:{}:{}'
+CARD_TEMPLATES = {Ticket.kind: 'ticketcard.html',
+                  Review.kind: 'reviewcard.html'}
+
+
+def feed_version(user_id):
+    """
+    Retourne la version courante du flux de l'utilisateur.
+
+    La version est un horodatage en nanosecondes, remplacé à chaque
+    modification du flux (voir bump_feed_versions). Si la clé a été évincée
+    ou a expiré, une nouvelle version est créée, ce qui invalide simplement
+    les fragments existants.
+
+    Toute écriture qui change ce que l'utilisateur voit doit changer la
+    version : les signaux pour les écritures unitaires, et explicitement les
+    traitements en masse, qui n'en émettent pas (feed.rebuild_feed,
+    aggregates.reconcile, thumbnails.generate_thumbnails,
+    migrate_media_to_cas). La version expire au bout de
+    FEED_VERSION_TIMEOUT secondes : un oubli ne peut servir un état périmé
+    (fragment ou réponse 304) que pendant cette durée.
+    """
+    return cache.get_or_set(FEED_VERSION_KEY.format(user_id), time.time_ns,
+                            timeout=settings.FEED_VERSION_TIMEOUT)
+
+
+async def afeed_version(user_id):
+    """
+    Version asynchrone de feed_version.
+    """
+    return await cache.aget_or_set(FEED_VERSION_KEY.format(user_id),
+                                   time.time_ns,
+                                   timeout=settings.FEED_VERSION_TIMEOUT)
+
+
+def bump_feed_versions(user_ids):
+    """
+    Change la version du flux de chacun des utilisateurs donnés, rendant
+    obsolètes tous les fragments mis en cache pour eux.
+    """
+    version = time.time_ns()
+    cache.set_many({FEED_VERSION_KEY.format(user_id): version
+                    for user_id in user_ids},
+                   timeout=settings.FEED_VERSION_TIMEOUT)
+
+
+def cached_feed_fragment(request, name, template, fetch_page):
+    """
+    Retourne le rendu HTML d'une page de flux, depuis le cache si la version
+    du flux de l'utilisateur n'a pas changé depuis le dernier rendu.
+
+    Seule la liste des éléments et la pagination sont mises en cache : le
+    reste de la page (navigation, jeton CSRF) est rendu à chaque requête.
+
+    Args:
+        request (HttpRequest): La requête ; les paramètres GET 'before' et
+        'after' font partie de la clé.
+        name (str): Le nom du flux ('flux' ou 'fluxperso').
+        template (str): Le template des éléments du flux.
+        fetch_page (callable): Fonction (user, before, after) renvoyant la
+        page, comme feed_page ou posts_page.
+
+    Returns:
+        SafeString: Le fragment HTML.
+    """
+    user_id = request.user.id
+    before = request.GET.get('before')
+    after = request.GET.get('after')
+    key = FEED_FRAGMENT_KEY.format(name, user_id, feed_version(user_id),
+                                   before or '', after or '')
+    fragment = cache.get(key)
+    if fragment is None:
+        page = fetch_page(request.user, before=before, after=after)
+        fragment = render_to_string(template, {'page': page},
+                                    request=request)
+        cache.set(key, fragment, settings.FEED_CACHE_TIMEOUT)
+    return fragment
+
+
+async def acached_feed_fragment(request, name, template, afetch_page):
+    """
+    Version asynchrone de cached_feed_fragment : la page est lue par
+    `afetch_page` (comme afeed_page) et seul le rendu du template passe par
+    un thread.
+    """
+    user_id = request.user.id
+    before = request.GET.get('before')
+    after = request.GET.get('after')
+    key = FEED_FRAGMENT_KEY.format(name, user_id, await afeed_version(user_id),
+                                   before or '', after or '')
+    fragment = await cache.aget(key)
+    if fragment is None:
+        page = await afetch_page(request.user, before=before, after=after)
+        fragment = await sync_to_async(render_to_string)(
+            template, {'page': page}, request=request)
+        await cache.aset(key, fragment, settings.FEED_CACHE_TIMEOUT)
+    return fragment
+
+
+def _ticket_state(ticket):
+    return (ticket.id, ticket.title, ticket.description, ticket.image.name,
+            ticket.thumbnails, ticket.time_created, ticket.user_id,
+            ticket.user.username, bool(ticket.user.profile_photo),
+            ticket.review_count, ticket.rating_sum)
+
+
+def _card_state(item):
+    """
+    Rassemble tout ce que la carte d'un élément affiche : deux éléments de
+    même état ont le même rendu.
+    """
+    if item.kind == Ticket.kind:
+        return _ticket_state(item)
+    return (item.id, item.headline, item.body, item.rating,
+            item.time_created, item.user_id, item.user.username,
+            bool(item.user.profile_photo), _ticket_state(item.ticket))
+
+
+def _card_key(item, user_id, variant):
+    # Le rendu dépend aussi du lecteur, mais seulement de savoir s'il est
+    # l'auteur de l'élément ou du ticket critiqué : une carte reste ainsi
+    # partagée entre tous les autres lecteurs.
+    ticket = item if item.kind == Ticket.kind else item.ticket
+    state = hashlib.sha1(repr(_card_state(item)).encode()).hexdigest()
+    return FEED_CARD_KEY.format(
+        variant, '{:d}{:d}'.format(item.user_id == user_id,
+                                   ticket.user_id == user_id), state)
+
+
+def _icons():
+    return {name: static('img/{}.png'.format(name))
+            for name in ('user', 'interdit', 'star', 'star1')}
+
+
+def feed_cards(items, user, variant):
+    """
+    Retourne le rendu HTML de chaque ticket ou critique d'une page de flux.
+
+    Chaque carte est mise en cache sous une clé calculée à partir de son
+    contenu (voir _card_state) : toute modification de l'élément, de son
+    auteur ou du ticket critiqué donne une nouvelle clé, sans invalidation.
+    Quand le fragment d'une page est à refaire (voir cached_feed_fragment),
+    seuls les éléments nouveaux ou modifiés sont donc rendus ; les cartes
+    sont lues puis enregistrées en une opération de cache chacune.
+
+    Les templates des cartes sont compilés une fois par processus (chargeur
+    mis en cache) et les URL des icônes calculées une fois par page.
+
+    Args:
+        items (list): Les tickets et critiques, chargés par feed.hydrate.
+        user (User): Le lecteur.
+        variant (str): 'flux' (lien de blocage, bouton de critique) ou
+        'posts' (boutons de modification et de suppression).
+
+    Returns:
+        list: Les fragments HTML (SafeString), dans l'ordre des éléments.
+    """
+    keys = [_card_key(item, user.id, variant) for item in items]
+    cards = cache.get_many(keys)
+    missing = {}
+    icons = None
+    for item, key in zip(items, keys):
+        if key in cards:
+            continue
+        if icons is None:
+            icons = _icons()
+        context = {'element': item, 'variant': variant, 'icons': icons,
+                   'own': item.user_id == user.id}
+        if item.kind == Review.kind:
+            context['own_ticket'] = item.ticket.user_id == user.id
+            # Une note nulle n'affiche aucune étoile.
+            context['stars'] = ([icons['star']] * item.rating
+                                + [icons['star1']] * (5 - item.rating)
+                                if item.rating else [])
+        missing[key] = get_template(CARD_TEMPLATES[item.kind]).render(
+            context)
+    if missing:
+        cache.set_many(missing, settings.FEED_CARD_CACHE_TIMEOUT)
+        cards.update(missing)
+    return [mark_safe(cards[key]) for key in keys]
+
+
+def feed_changed_recently(request):
+    """
+    Indique si le flux de l'utilisateur a changé depuis moins de
+    REPLICA_STICKY_SECONDS secondes : une réplique en retard pourrait alors
+    en servir un état antérieur, mis en cache et marqué (ETag) sous la
+    nouvelle version. Les vues du flux lisent alors 'default' (voir
+    litrevu.database.replica_reads).
+    """
+    version = feed_version(request.user.id)
+    return time.time_ns() - version < settings.REPLICA_STICKY_SECONDS * 1e9
+
+
+def _etag(request, version):
+    fingerprint = '{}:{}:{}:{}'.format(
+        request.user.id, version, request.get_full_path(),
+        request.COOKIES.get(settings.CSRF_COOKIE_NAME, ''))
+    return hashlib.sha1(fingerprint.encode()).hexdigest()
+
+
+def _last_modified(version):
+    return datetime.fromtimestamp(version / 1e9, tz=timezone.utc)
+
+
+def feed_etag(request, *args, **kwargs):
+    """
+    Calcule l'ETag d'une page de flux sans requête SQL.
+
+    La version du flux change à chaque création, modification ou
+    suppression visible par l'utilisateur ainsi qu'à chaque abonnement ou
+    blocage : elle résume à elle seule l'état de l'ensemble visible. Le
+    chemin (avec les curseurs) et le cookie CSRF, dont dépend le formulaire
+    de déconnexion de la page, complètent l'empreinte.
+    """
+    return _etag(request, feed_version(request.user.id))
+
+
+def feed_last_modified(request, *args, **kwargs):
+    """
+    Retourne la date de dernière modification du flux de l'utilisateur,
+    déduite de la version de son flux.
+    """
+    return _last_modified(feed_version(request.user.id))
+
+
+async def afeed_validators(request):
+    """
+    Version asynchrone de feed_etag et feed_last_modified : la version du
+    flux est lue une seule fois, sans bloquer la boucle d'événements.
+
+    Returns:
+        tuple: L'ETag et la date de dernière modification.
+    """
+    version = await afeed_version(request.user.id)
+    return _etag(request, version), _last_modified(version)
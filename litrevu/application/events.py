@@ -0,0 +1,122 @@
+import asyncio
+import json
+import threading
+from contextlib import asynccontextmanager
+from functools import cache
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+FEED_CHANNEL = 'feed:{}'
+
+
+class LocalBroker:
+    """
+    Diffusion de messages entre les requêtes d'un même processus.
+
+    Chaque abonnement a sa file asyncio, alimentée depuis n'importe quel
+    thread par publish (les signaux tournent dans le thread de la vue).
+    Une file pleine ignore les nouveaux messages : ils annoncent du contenu
+    nouveau, et l'abonné averti une fois n'a besoin de rien de plus.
+
+    Avec plusieurs processus serveur, un abonné ne reçoit que les messages
+    publiés par son propre processus : un courtier partagé (Redis, par
+    exemple) doit alors le remplacer, avec la même interface (publish et
+    subscribe), via EVENTS_BROKER.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = {}
+
+    def publish(self, channel, message):
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, ()))
+        for loop, queue in subscribers:
+            try:
+                loop.call_soon_threadsafe(self._put, queue, message)
+            except RuntimeError:
+                # Boucle d'événements fermée : l'abonné est parti.
+                pass
+
+    @staticmethod
+    def _put(queue, message):
+        try:
+            queue.put_nowait(message)
+        except asyncio.QueueFull:
+            pass
+
+    @asynccontextmanager
+    async def subscribe(self, channel):
+        """
+        Abonne la tâche courante au canal pour la durée du bloc `async
+        with`, qui reçoit la file asyncio des messages.
+        """
+        subscriber = (asyncio.get_running_loop(),
+                      asyncio.Queue(settings.EVENTS_QUEUE_SIZE))
+        with self._lock:
+            self._subscribers.setdefault(channel, set()).add(subscriber)
+        try:
+            yield subscriber[1]
+        finally:
+            with self._lock:
+                self._subscribers[channel].discard(subscriber)
+                if not self._subscribers[channel]:
+                    del self._subscribers[channel]
+
+
+@cache
+def _broker(path):
+    return import_string(path)()
+
+
+def broker():
+    """
+    Retourne le courtier configuré par EVENTS_BROKER, partagé par tout le
+    processus.
+    """
+    return _broker(settings.EVENTS_BROKER)
+
+
+def notify_new_item(kind, item_id, author_id, user_ids):
+    """
+    Annonce aux utilisateurs donnés qu'un élément est arrivé dans leur
+    flux.
+    """
+    message = {'kind': kind, 'id': item_id, 'user': author_id}
+    for user_id in user_ids:
+        broker().publish(FEED_CHANNEL.format(user_id), message)
+
+
+def format_event(event, data):
+    """
+    Met un message au format Server-Sent Events.
+    """
+    return 'event: {}\ndata: {}\n\n'.format(
+        event, json.dumps(data, separators=(',', ':'))).encode()
+
+
+async def feed_event_stream(user_id):
+    """
+    Produit le flux SSE des nouveaux éléments du flux de l'utilisateur :
+    un événement 'item' par élément, un commentaire toutes les
+    EVENTS_HEARTBEAT_SECONDS secondes pour garder la connexion ouverte, et
+    la fin du flux au bout de EVENTS_MAX_SECONDS secondes. Le navigateur
+    (EventSource) se reconnecte alors de lui-même, ce qui borne la durée de
+    vie d'une connexion abandonnée.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + settings.EVENTS_MAX_SECONDS
+    async with broker().subscribe(FEED_CHANNEL.format(user_id)) as queue:
+        yield 'retry: {}\n\n'.format(
+            settings.EVENTS_RETRY_SECONDS * 1000).encode()
+        while True:
+            timeout = min(settings.EVENTS_HEARTBEAT_SECONDS,
+                          deadline - loop.time())
+            if timeout <= 0:
+                return
+            try:
+                message = await asyncio.wait_for(queue.get(), timeout)
+            except asyncio.TimeoutError:
+                yield b': keepalive\n\n'
+            else:
+                yield format_event('item', message)
@@ -0,0 +1,487 @@
+import base64
+from datetime import datetime
+from functools import partial
+from django.core.exceptions import BadRequest
+from django.db import transaction
+from django.db.models import CharField, Q, Value
+from application import graph
+from application.cache import bump_feed_versions
+from application.models import FeedEntry, Ticket, Review
+
+FEED_PAGE_SIZE = 20
+FEED_BATCH_SIZE = 1000
+
+TICKET = Ticket.kind
+REVIEW = Review.kind
+
+
+def visible_tickets(user):
+    """
+    Retourne les tickets visibles dans le flux de l'utilisateur : les siens
+    et ceux des utilisateurs suivis, hors utilisateurs bloqués.
+
+    Les abonnements et les blocages sont lus dans la base (voir
+    application.graph.load), le résultat servant à écrire le flux
+    matérialisé, et passés à la requête sous forme de listes d'identifiants
+    plutôt que de sous-requêtes.
+    """
+    following, blocking = graph.load(user.id, graph.FOLLOWING,
+                                     graph.BLOCKING)
+    return Ticket.objects.filter(
+        Q(user__in=list(following)) | Q(user=user)
+    ).exclude(user__in=list(blocking))
+
+
+def visible_reviews(user):
+    """
+    Retourne les critiques visibles dans le flux de l'utilisateur : les
+    siennes, celles des utilisateurs suivis et celles répondant à un ticket
+    visible, hors utilisateurs bloqués.
+    """
+    following, blocking = graph.load(user.id, graph.FOLLOWING,
+                                     graph.BLOCKING)
+    return Review.objects.filter(
+        Q(ticket__in=visible_tickets(user)) |
+        Q(user__in=list(following)) | Q(user=user)
+    ).exclude(user__in=list(blocking))
+
+
+def feed_tickets():
+    """
+    Queryset des tickets tels qu'affichés dans le flux : auteur joint. Le
+    nombre de critiques et la note moyenne sont des colonnes du ticket
+    (voir application.aggregates).
+    """
+    return Ticket.objects.select_related('user')
+
+
+def feed_reviews():
+    """
+    Queryset des critiques telles qu'affichées dans le flux : auteur, ticket
+    et auteur du ticket joints.
+    """
+    return Review.objects.select_related('user', 'ticket__user')
+
+
+def _entries(queryset, kind):
+    """
+    Projette un queryset de tickets ou de critiques sur la forme commune
+    (kind, id, time_created) utilisée par l'UNION du flux.
+    """
+    return queryset.order_by().annotate(
+        kind=Value(kind, output_field=CharField())
+    ).values('kind', 'id', 'time_created')
+
+
+def encode_cursor(entry):
+    """
+    Encode la position (time_created, kind, id) d'une entrée du flux en un
+    jeton opaque utilisable dans une URL.
+    """
+    raw = '{}|{}|{}'.format(entry['time_created'].isoformat(),
+                            entry['kind'], entry['id'])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """
+    Décode un jeton produit par encode_cursor.
+
+    Raises:
+        BadRequest: Si le jeton est invalide.
+    """
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        time_created, kind, id = raw.decode().split('|')
+        if kind not in (TICKET, REVIEW):
+            raise ValueError(kind)
+        return datetime.fromisoformat(time_created), kind, int(id)
+    except ValueError:
+        raise BadRequest('Curseur de pagination invalide.')
+
+
+def _older_than(cursor, kind):
+    """
+    Condition « strictement plus ancien que le curseur » pour les lignes
+    d'un type donné, selon l'ordre (time_created, kind, id) décroissant.
+    """
+    time_created, cursor_kind, id = cursor
+    condition = Q(time_created__lt=time_created)
+    if kind < cursor_kind:
+        condition |= Q(time_created=time_created)
+    elif kind == cursor_kind:
+        condition |= Q(time_created=time_created, id__lt=id)
+    return condition
+
+
+def _newer_than(cursor, kind):
+    """
+    Condition « strictement plus récent que le curseur », symétrique de
+    _older_than.
+    """
+    time_created, cursor_kind, id = cursor
+    condition = Q(time_created__gt=time_created)
+    if kind > cursor_kind:
+        condition |= Q(time_created=time_created)
+    elif kind == cursor_kind:
+        condition |= Q(time_created=time_created, id__gt=id)
+    return condition
+
+
+def merged_queryset(tickets, reviews, before=None, after=None):
+    """
+    Construit l'UNION ordonnée des tickets et des critiques.
+
+    La pagination par clé (keyset) sur (time_created, kind, id) filtre
+    chaque branche de l'UNION, si bien que le coût d'une page ne dépend pas
+    de sa profondeur.
+
+    Args:
+        before (tuple, optionnel): Curseur décodé ; ne garde que les
+        entrées plus anciennes, de la plus récente à la plus ancienne.
+        after (tuple, optionnel): Curseur décodé ; ne garde que les
+        entrées plus récentes, de la plus ancienne à la plus récente.
+    """
+    if before is not None:
+        tickets = tickets.filter(_older_than(before, TICKET))
+        reviews = reviews.filter(_older_than(before, REVIEW))
+    if after is not None:
+        tickets = tickets.filter(_newer_than(after, TICKET))
+        reviews = reviews.filter(_newer_than(after, REVIEW))
+    union = _entries(tickets, TICKET).union(
+        _entries(reviews, REVIEW), all=True)
+    if after is not None:
+        return union.order_by('time_created', 'kind', 'id')
+    return union.order_by('-time_created', '-kind', '-id')
+
+
+def merged_entries(tickets, reviews, limit=FEED_PAGE_SIZE, before=None,
+                   after=None):
+    """
+    Fusionne tickets et critiques dans la base de données.
+
+    L'UNION, le tri et la limite sont exécutés en une seule requête SQL
+    (voir merged_queryset) : seules les `limit` lignes demandées remontent
+    en Python, quelle que soit la taille de l'historique.
+
+    Returns:
+        list: Des dictionnaires {'kind', 'id', 'time_created'}, du plus
+        récent au plus ancien.
+    """
+    entries = list(merged_queryset(tickets, reviews, before=before,
+                                   after=after)[:limit])
+    return entries[::-1] if after is not None else entries
+
+
+def _split_ids(entries):
+    return ([entry['id'] for entry in entries if entry['kind'] == TICKET],
+            [entry['id'] for entry in entries if entry['kind'] == REVIEW])
+
+
+def _in_order(entries, tickets, reviews):
+    instances = {TICKET: tickets, REVIEW: reviews}
+    return [instances[entry['kind']][entry['id']] for entry in entries
+            if entry['id'] in instances[entry['kind']]]
+
+
+def hydrate(entries):
+    """
+    Charge les instances correspondant aux entrées du flux, en une requête
+    par type, et les renvoie dans l'ordre des entrées.
+
+    Tout ce que les templates du flux lisent est chargé ici : les auteurs
+    (et leur photo de profil), le ticket et l'auteur du ticket de chaque
+    critique ; les agrégats des critiques d'un ticket sont des colonnes du
+    ticket. Le rendu ne déclenche ainsi aucune requête par élément.
+    """
+    ticket_ids, review_ids = _split_ids(entries)
+    tickets = feed_tickets().in_bulk(ticket_ids) if ticket_ids else {}
+    reviews = feed_reviews().in_bulk(review_ids) if review_ids else {}
+    return _in_order(entries, tickets, reviews)
+
+
+async def _ain_bulk(queryset, ids):
+    return await queryset.ain_bulk(ids) if ids else {}
+
+
+async def ahydrate(entries):
+    """
+    Version asynchrone de hydrate : les tickets puis les critiques sont
+    chargés par deux requêtes. Sous Django 4.2, l'ORM asynchrone exécute
+    les requêtes l'une après l'autre dans un même thread ; la boucle
+    d'événements reste libre pendant l'attente.
+    """
+    ticket_ids, review_ids = _split_ids(entries)
+    tickets = await _ain_bulk(feed_tickets(), ticket_ids)
+    reviews = await _ain_bulk(feed_reviews(), review_ids)
+    return _in_order(entries, tickets, reviews)
+
+
+def timeline_queryset(user, before=None, after=None):
+    """
+    Construit la lecture ordonnée du flux matérialisé (FeedEntry) de
+    l'utilisateur, bornée par les curseurs comme merged_queryset.
+
+    Contrairement à merged_queryset, aucune condition d'abonnement ou de
+    blocage n'est réévaluée : la lecture est une simple plage de l'index
+    (owner, time_created, item_type, item_id).
+    """
+    entries = FeedEntry.objects.filter(owner=user)
+    if before is not None:
+        time_created, kind, id = before
+        entries = entries.filter(
+            Q(time_created__lt=time_created) |
+            Q(time_created=time_created, item_type__lt=kind) |
+            Q(time_created=time_created, item_type=kind, item_id__lt=id))
+    if after is not None:
+        time_created, kind, id = after
+        entries = entries.filter(
+            Q(time_created__gt=time_created) |
+            Q(time_created=time_created, item_type__gt=kind) |
+            Q(time_created=time_created, item_type=kind, item_id__gt=id))
+    order = ('time_created', 'item_type', 'item_id')
+    if after is None:
+        order = tuple('-' + field for field in order)
+    return entries.order_by(*order).values_list(
+        'item_type', 'item_id', 'time_created')
+
+
+def timeline_entries(user, limit=FEED_PAGE_SIZE, before=None, after=None):
+    """
+    Lit une plage du flux matérialisé de l'utilisateur (voir
+    timeline_queryset).
+
+    Returns:
+        list: Des dictionnaires {'kind', 'id', 'time_created'}, du plus
+        récent au plus ancien.
+    """
+    rows = timeline_queryset(user, before=before, after=after)[:limit]
+    entries = [{'kind': kind, 'id': id, 'time_created': time_created}
+               for kind, id, time_created in rows]
+    return entries[::-1] if after is not None else entries
+
+
+async def atimeline_entries(user, limit=FEED_PAGE_SIZE, before=None,
+                            after=None):
+    """
+    Version asynchrone de timeline_entries.
+    """
+    rows = timeline_queryset(user, before=before, after=after)[:limit]
+    entries = [{'kind': kind, 'id': id, 'time_created': time_created}
+               async for kind, id, time_created in rows]
+    return entries[::-1] if after is not None else entries
+
+
+def _slice_page(entries, before, after, limit):
+    """
+    Réduit les `limit` + 1 entrées lues à la page demandée et calcule les
+    jetons des pages voisines.
+    """
+    if after is not None:
+        has_newer = len(entries) > limit
+        entries = entries[-limit:]
+        has_older = True
+    else:
+        has_older = len(entries) > limit
+        entries = entries[:limit]
+        has_newer = before is not None
+    older = encode_cursor(entries[-1]) if has_older and entries else None
+    newer = encode_cursor(entries[0]) if has_newer and entries else None
+    return entries, older, newer
+
+
+def paginate(fetch_entries, before=None, after=None, limit=FEED_PAGE_SIZE,
+             load=hydrate):
+    """
+    Construit une page du flux à partir des jetons « plus ancien que »
+    (before) et « plus récent que » (after).
+
+    Une entrée supplémentaire est demandée à la base pour savoir s'il reste
+    une page suivante sans requête de comptage.
+
+    Args:
+        fetch_entries (callable): Fonction (limit, before, after) renvoyant
+        les entrées du flux, comme merged_entries ou timeline_entries.
+        load (callable): Fonction chargeant les éléments des entrées de la
+        page : hydrate (instances) ou application.api.project
+        (dictionnaires).
+
+    Returns:
+        dict: 'items' (list) les éléments de la page, par défaut les
+        instances de Ticket et de Review,
+        'older' (str ou None) le jeton de la page plus ancienne et 'newer'
+        (str ou None) celui de la page plus récente.
+    """
+    before = decode_cursor(before) if before else None
+    after = decode_cursor(after) if after else None
+    entries = fetch_entries(limit + 1, before=before, after=after)
+    entries, older, newer = _slice_page(entries, before, after, limit)
+    return {'items': load(entries), 'older': older, 'newer': newer}
+
+
+def feed_page(user, before=None, after=None, limit=FEED_PAGE_SIZE):
+    """
+    Retourne une page du flux de l'utilisateur, lue dans le flux matérialisé
+    (voir paginate).
+    """
+    return paginate(partial(timeline_entries, user),
+                    before=before, after=after, limit=limit)
+
+
+def posts_page(user, before=None, after=None, limit=FEED_PAGE_SIZE):
+    """
+    Retourne une page des tickets et critiques publiés par l'utilisateur
+    (voir paginate).
+    """
+    return paginate(partial(merged_entries, Ticket.objects.filter(user=user),
+                            Review.objects.filter(user=user)),
+                    before=before, after=after, limit=limit)
+
+
+async def afeed_page(user, before=None, after=None, limit=FEED_PAGE_SIZE):
+    """
+    Version asynchrone de feed_page, pour les vues servies en ASGI.
+    """
+    before = decode_cursor(before) if before else None
+    after = decode_cursor(after) if after else None
+    entries = await atimeline_entries(user, limit + 1, before=before,
+                                      after=after)
+    entries, older, newer = _slice_page(entries, before, after, limit)
+    return {'items': await ahydrate(entries), 'older': older,
+            'newer': newer}
+
+
+def ticket_audience(ticket):
+    """
+    Retourne les identifiants des utilisateurs dont le flux contient le
+    ticket : son auteur et ses abonnés qui ne l'ont pas bloqué.
+
+    Les relations sont lues dans la base, pas dans le cache du graphe (voir
+    application.graph.load).
+    """
+    author = ticket.user_id
+    followers, blocked_by = graph.load(author, graph.FOLLOWERS,
+                                       graph.BLOCKED_BY)
+    return ({author} | set(followers)) - set(blocked_by)
+
+
+def review_audience(review):
+    """
+    Retourne les identifiants des utilisateurs dont le flux contient la
+    critique : son auteur, ses abonnés, ainsi que l'auteur du ticket et ses
+    abonnés, hors utilisateurs ayant bloqué l'auteur de la critique (ou,
+    pour le second groupe, l'auteur du ticket). Les relations sont lues
+    dans la base, comme pour ticket_audience.
+    """
+    author = review.user_id
+    ticket_author = Ticket.objects.filter(
+        id=review.ticket_id).values_list('user_id', flat=True).get()
+    followers, blocked_by = graph.load(author, graph.FOLLOWERS,
+                                       graph.BLOCKED_BY)
+    ticket_followers, ticket_blocked_by = graph.load(
+        ticket_author, graph.FOLLOWERS, graph.BLOCKED_BY)
+    audience = {author} | set(followers)
+    audience |= (({ticket_author} | set(ticket_followers)) -
+                 set(ticket_blocked_by))
+    return audience - set(blocked_by)
+
+
+def _write_entries(owner_ids, entries):
+    """
+    Insère par lots les entrées données dans le flux de chaque propriétaire,
+    en ignorant celles qui y figurent déjà.
+    """
+    batch = []
+    for owner_id in owner_ids:
+        for entry in entries:
+            batch.append(FeedEntry(owner_id=owner_id, item_type=entry['kind'],
+                                   item_id=entry['id'],
+                                   time_created=entry['time_created']))
+            if len(batch) >= FEED_BATCH_SIZE:
+                FeedEntry.objects.bulk_create(batch, ignore_conflicts=True)
+                batch = []
+    if batch:
+        FeedEntry.objects.bulk_create(batch, ignore_conflicts=True)
+
+
+def fan_out(item, kind):
+    """
+    Ajoute un ticket ou une critique nouvellement créé au flux matérialisé
+    de chaque utilisateur qui doit le voir.
+
+    Returns:
+        set: Les identifiants des propriétaires des flux modifiés.
+    """
+    audience = (ticket_audience(item) if kind == TICKET
+                else review_audience(item))
+    _write_entries(audience, [{'kind': kind, 'id': item.id,
+                               'time_created': item.time_created}])
+    return audience
+
+
+def remove_item(kind, id):
+    """
+    Retire un ticket ou une critique supprimé de tous les flux matérialisés.
+
+    Returns:
+        set: Les identifiants des propriétaires des flux modifiés.
+    """
+    entries = FeedEntry.objects.filter(item_type=kind, item_id=id)
+    owner_ids = set(entries.values_list('owner_id', flat=True))
+    entries.delete()
+    return owner_ids
+
+
+def ticket_readers(ticket_id):
+    """
+    Retourne les identifiants des utilisateurs dont le flux affiche le
+    ticket, directement ou au travers d'une critique qui y répond.
+    """
+    review_ids = Review.objects.filter(ticket_id=ticket_id).values('id')
+    return set(FeedEntry.objects.filter(
+        Q(item_type=TICKET, item_id=ticket_id) |
+        Q(item_type=REVIEW, item_id__in=review_ids)
+    ).values_list('owner_id', flat=True))
+
+
+def _iter_entries(tickets, reviews):
+    union = _entries(tickets, TICKET).union(
+        _entries(reviews, REVIEW), all=True)
+    batch = []
+    for entry in union.iterator(chunk_size=FEED_BATCH_SIZE):
+        batch.append(entry)
+        if len(batch) >= FEED_BATCH_SIZE:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def add_followed_items(user, followed_user):
+    """
+    Ajoute au flux matérialisé de l'utilisateur les éléments qu'un nouvel
+    abonnement rend visibles : les tickets et critiques de l'utilisateur
+    suivi, et les critiques répondant à ses tickets.
+    """
+    tickets = visible_tickets(user).filter(user=followed_user)
+    reviews = visible_reviews(user).filter(
+        Q(user=followed_user) | Q(ticket__user=followed_user))
+    for batch in _iter_entries(tickets, reviews):
+        _write_entries([user.id], batch)
+
+
+def rebuild_feed(user):
+    """
+    Reconstruit entièrement le flux matérialisé de l'utilisateur à partir
+    des règles d'abonnement et de blocage (visible_tickets et
+    visible_reviews).
+
+    Le flux est remplacé en une transaction, puis sa version change (voir
+    application.cache) : les fragments et ETag antérieurs sont abandonnés.
+    """
+    with transaction.atomic():
+        transaction.on_commit(lambda: bump_feed_versions([user.id]))
+        FeedEntry.objects.filter(owner=user).delete()
+        for batch in _iter_entries(visible_tickets(user),
+                                   visible_reviews(user)):
+            _write_entries([user.id], batch)
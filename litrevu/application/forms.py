@@ -1,4 +1,5 @@
 from application.models import Ticket, Review
+from application.thumbnails import schedule_thumbnails
 from django import forms
 from authentication.models import User
 
@@ -24,8 +25,12 @@ class TicketForm(forms.ModelForm):
         ticket = super().save(commit=False)
         if self.user:
             ticket.user = self.user
+        if 'image' in self.changed_data:
+            ticket.thumbnails = {}
         if commit:
             ticket.save()
+            if 'image' in self.changed_data:
+                schedule_thumbnails(ticket)
         return ticket
 
 
@@ -36,15 +41,18 @@ class NewReview(forms.ModelForm):
 
 
 class FollowUserForm(forms.Form):
-    username = forms.CharField(label='Nom d\'utilisateur')
+    username = forms.CharField(label='Nom d\'utilisateur', max_length=150)
 
     def clean_username(self):
+        """
+        Résout le nom saisi en utilisateur : cleaned_data['username'] est
+        l'instance de User, que la vue utilise sans la relire.
+        """
         username = self.cleaned_data['username']
         try:
-            User.objects.get(username=username)
+            return User.objects.get(username=username)
         except User.DoesNotExist:
             raise forms.ValidationError("Cet utilisateur n'existe pas.")
-        return username
 
 
 class SearchUserForm(forms.Form):
@@ -72,6 +80,7 @@ class TicketAndReviewForm(forms.ModelForm):
         ticket = super().save(commit=False)
         ticket.user = self.user
         ticket.save()
+        schedule_thumbnails(ticket)
         review = Review.objects.create(
             ticket=ticket,
             rating=self.cleaned_data['rating'],
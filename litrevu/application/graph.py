@@ -0,0 +1,138 @@
+from array import array
+from bisect import bisect_left
+from django.conf import settings
+from django.core.cache import cache
+from django.db import router, transaction
+from application.models import UserBlock, UserFollows
+
+GRAPH_KEY = 'graph:{}:{}'
+
+FOLLOWING = 'following'
+FOLLOWERS = 'followers'
+BLOCKING = 'blocking'
+BLOCKED_BY = 'blocked_by'
+
+# Pour chaque relation : le modèle, le champ qui désigne l'utilisateur et
+# celui qui désigne ses voisins. Chaque lecture suit l'un des index de
+# UserFollows ou de UserBlock (unique_together ou index inverse).
+_RELATIONS = {
+    FOLLOWING: (UserFollows, 'user_id', 'followed_user_id'),
+    FOLLOWERS: (UserFollows, 'followed_user_id', 'user_id'),
+    BLOCKING: (UserBlock, 'user_id', 'blocked_user_id'),
+    BLOCKED_BY: (UserBlock, 'blocked_user_id', 'user_id'),
+}
+
+
+def _key(relation, user_id):
+    return GRAPH_KEY.format(relation, user_id)
+
+
+def _load(relation, user_id):
+    # Lu sur la base d'écriture, même pendant une vue replica_reads : le
+    # résultat reste en cache jusqu'à la prochaine invalidation.
+    model, source, target = _RELATIONS[relation]
+    return array('q', model.objects.using(router.db_for_write(model)).filter(
+        **{source: user_id}).order_by(target).values_list(target, flat=True))
+
+
+def load(user_id, *relations):
+    """
+    Lit les relations demandées dans la base, sans passer par le cache,
+    sous la même forme que neighbours.
+
+    À utiliser pour les écritures dérivées du graphe (flux matérialisés) :
+    le cache local d'un autre processus peut ignorer un abonnement récent
+    jusqu'à GRAPH_CACHE_TIMEOUT secondes, et une entrée manquée dans un flux
+    le resterait.
+    """
+    return [_load(relation, user_id) for relation in relations]
+
+
+def neighbours(user_id, *relations):
+    """
+    Retourne les voisins de l'utilisateur pour chacune des relations
+    demandées, sous forme de tableaux d'entiers triés (array('q')).
+
+    Les tableaux sont lus dans le cache en un seul aller-retour ; seuls les
+    absents sont chargés depuis la base puis mis en cache pour
+    GRAPH_CACHE_TIMEOUT secondes.
+
+    Returns:
+        list: Un tableau par relation, dans l'ordre des relations.
+    """
+    keys = [_key(relation, user_id) for relation in relations]
+    cached = cache.get_many(keys)
+    missing = {}
+    for relation, key in zip(relations, keys):
+        if key not in cached:
+            missing[key] = cached[key] = _load(relation, user_id)
+    if missing:
+        cache.set_many(missing, settings.GRAPH_CACHE_TIMEOUT)
+    return [cached[key] for key in keys]
+
+
+def following(user_id):
+    return neighbours(user_id, FOLLOWING)[0]
+
+
+def followers(user_id):
+    return neighbours(user_id, FOLLOWERS)[0]
+
+
+def blocking(user_id):
+    return neighbours(user_id, BLOCKING)[0]
+
+
+def blocked_by(user_id):
+    return neighbours(user_id, BLOCKED_BY)[0]
+
+
+def _contains(ids, value):
+    index = bisect_left(ids, value)
+    return index < len(ids) and ids[index] == value
+
+
+def is_following(user_id, other_id):
+    """
+    Indique si l'utilisateur suit l'autre utilisateur.
+    """
+    return _contains(following(user_id), other_id)
+
+
+def is_mutual(user_id, other_id):
+    """
+    Indique si les deux utilisateurs se suivent l'un l'autre.
+    """
+    following_ids, follower_ids = neighbours(user_id, FOLLOWING, FOLLOWERS)
+    return (_contains(following_ids, other_id) and
+            _contains(follower_ids, other_id))
+
+
+def is_blocked(user_id, other_id):
+    """
+    Indique si l'un des deux utilisateurs a bloqué l'autre.
+    """
+    blocking_ids, blocked_by_ids = neighbours(user_id, BLOCKING, BLOCKED_BY)
+    return (_contains(blocking_ids, other_id) or
+            _contains(blocked_by_ids, other_id))
+
+
+def degree(user_id):
+    """
+    Retourne le nombre d'abonnements ('following') et d'abonnés
+    ('followers') de l'utilisateur.
+    """
+    following_ids, follower_ids = neighbours(user_id, FOLLOWING, FOLLOWERS)
+    return {'following': len(following_ids), 'followers': len(follower_ids)}
+
+
+def invalidate(user_ids):
+    """
+    Retire du cache les relations des utilisateurs donnés, une fois la
+    transaction validée : une lecture faite avant la validation ne peut pas
+    y laisser des relations qu'une annulation ferait disparaître. Les
+    écritures de la transaction lisent la base (voir load).
+    """
+    keys = [_key(relation, user_id)
+            for user_id in set(user_ids) for relation in _RELATIONS]
+    transaction.on_commit(lambda: cache.delete_many(keys))
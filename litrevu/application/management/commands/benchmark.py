@@ -0,0 +1,52 @@
+from django.core.management.base import BaseCommand, CommandError
+from application import benchmark
+from authentication.models import User
+
+
+class Command(BaseCommand):
+    help = ("Mesure les vues principales (flux, posts, abonnements, "
+            "créations) sur un graphe social synthétique généré dans une "
+            "base de test jetable : requêtes SQL, temps (p50, p95, p99) et "
+            "pic de mémoire. Avec --baseline, échoue si une mesure régresse "
+            "par rapport à la référence.")
+
+    def add_arguments(self, parser):
+        for name, default in benchmark.DEFAULT_SCALE.items():
+            parser.add_argument('--' + name, type=int, default=default)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--requests', type=int, default=20,
+                            help="Nombre de requêtes mesurées par scénario.")
+        parser.add_argument('--warm', action='store_true',
+                            help="Garde le cache entre les requêtes.")
+        parser.add_argument('--baseline',
+                            help="Fichier JSON de référence à comparer.")
+        parser.add_argument('--save-baseline',
+                            help="Enregistre les mesures comme référence.")
+
+    def handle(self, *args, **options):
+        scale = {name: options[name] for name in benchmark.DEFAULT_SCALE}
+        baseline = (benchmark.load_baseline(options['baseline'])
+                    if options['baseline'] else None)
+
+        with benchmark.throwaway_database():
+            ids = benchmark.seed(seed=options['seed'], **scale)
+            results = benchmark.measure(User.objects.get(id=ids[0]),
+                                        requests=options['requests'],
+                                        warm=options['warm'])
+
+        self.stdout.write('{:<24}{:>9}{:>10}{:>10}{:>10}{:>11}'.format(
+            'scénario', 'requêtes', 'p50 ms', 'p95 ms', 'p99 ms', 'pic Kio'))
+        for name, result in results.items():
+            self.stdout.write('{:<24}{queries:>9}{p50_ms:>10}{p95_ms:>10}'
+                              '{p99_ms:>10}{peak_kib:>11}'.format(
+                                  name, **result))
+        if options['save_baseline']:
+            benchmark.save_baseline(options['save_baseline'], results, scale)
+            self.stdout.write('Référence enregistrée dans {}.'.format(
+                options['save_baseline']))
+        if baseline is not None:
+            problems = benchmark.regressions(results, baseline)
+            if problems:
+                raise CommandError('Régressions :\n' + '\n'.join(problems))
+            self.stdout.write(self.style.SUCCESS(
+                'Aucune régression par rapport à la référence.'))
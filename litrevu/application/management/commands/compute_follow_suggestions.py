@@ -0,0 +1,28 @@
+import time
+from django.core.management.base import BaseCommand
+from application.models import StaleFollowSuggestions
+from application.suggestions import compute_suggestions
+
+
+class Command(BaseCommand):
+    help = ("Calcule les suggestions d'abonnement (amis d'amis). Par défaut, "
+            "seuls les utilisateurs dont les abonnements ont changé depuis "
+            "le dernier calcul sont traités ; --all recalcule tout, ce qui "
+            "rafraîchit aussi le critère d'activité.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true',
+                            help="Recalcule les suggestions de tous les "
+                                 "utilisateurs.")
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        if options['all']:
+            total = compute_suggestions()
+        else:
+            total = compute_suggestions(
+                StaleFollowSuggestions.objects.values_list('user_id',
+                                                           flat=True))
+        self.stdout.write(self.style.SUCCESS(
+            'Suggestions calculées pour {} utilisateurs en {:.1f} s.'.format(
+                total, time.perf_counter() - start)))
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+from application.transfer import Progress, detect_format, export_records
+
+
+class Command(BaseCommand):
+    help = ("Exporte tous les tickets puis toutes les critiques au format "
+            "JSON Lines ou CSV, en lisant la base au fil de l'eau.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('output',
+                            help="Fichier de sortie (.jsonl ou .csv), ou - "
+                                 "pour la sortie standard.")
+        parser.add_argument('--format', choices=('jsonl', 'csv'))
+
+    def handle(self, *args, **options):
+        path = options['output']
+        try:
+            format = detect_format(path, options['format'])
+        except ValueError as error:
+            raise CommandError(error)
+        # La progression va sur la sortie d'erreur pour ne pas se mêler à
+        # un export sur la sortie standard.
+        progress = Progress(self.stderr, 'Export')
+        if path == '-':
+            export_records(self.stdout, format, progress)
+        else:
+            with open(path, 'w', encoding='utf-8', newline='') as output:
+                export_records(output, format, progress)
+        progress.report()
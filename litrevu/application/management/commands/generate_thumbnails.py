@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+from application.models import Ticket
+from application.thumbnails import generate_thumbnails
+
+
+class Command(BaseCommand):
+    help = ("Génère les vignettes des images de tickets qui n'en ont pas "
+            "encore (ou de toutes avec --all).")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true',
+                            help="Régénère aussi les vignettes existantes.")
+
+    def handle(self, *args, **options):
+        tickets = Ticket.objects.exclude(image='').exclude(image=None)
+        if not options['all']:
+            tickets = tickets.filter(thumbnails={})
+        done = failed = 0
+        for id, name in tickets.values_list('id', 'image').iterator():
+            try:
+                generate_thumbnails(id, name)
+                done += 1
+            except (OSError, ValueError) as error:
+                failed += 1
+                self.stderr.write('Ticket {} ({}) : {}'.format(id, name,
+                                                               error))
+        self.stdout.write(self.style.SUCCESS(
+            '{} tickets traités, {} en échec.'.format(done, failed)))
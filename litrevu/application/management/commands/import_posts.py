@@ -0,0 +1,61 @@
+import sys
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError
+from application.transfer import TRANSFER_BATCH_SIZE, Progress
+from application.transfer import detect_format, import_records, read_records
+
+
+class Command(BaseCommand):
+    help = ("Importe des tickets et des critiques depuis un fichier JSON "
+            "Lines ou CSV (tel que produit par export_posts), par lots "
+            "insérés avec bulk_create, puis reconstruit les flux et l'index "
+            "de recherche.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('input',
+                            help="Fichier à importer (.jsonl ou .csv), ou - "
+                                 "pour l'entrée standard.")
+        parser.add_argument('--format', choices=('jsonl', 'csv'))
+        parser.add_argument('--batch-size', type=int,
+                            default=TRANSFER_BATCH_SIZE)
+        parser.add_argument('--skip-rebuild', action='store_true',
+                            help="Ne reconstruit ni les flux, ni l'index de "
+                                 "recherche, ni les agrégats des tickets (à "
+                                 "faire ensuite avec rebuild_feed, "
+                                 "rebuild_search_index et "
+                                 "reconcile_ticket_aggregates).")
+
+    def handle(self, *args, **options):
+        path = options['input']
+        try:
+            format = detect_format(path, options['format'])
+        except ValueError as error:
+            raise CommandError(error)
+        progress = Progress(self.stdout, 'Import')
+        try:
+            if path == '-':
+                imported = import_records(
+                    read_records(sys.stdin, format, self.stderr), progress,
+                    self.stderr, batch_size=options['batch_size'])
+            else:
+                with open(path, encoding='utf-8', newline='') as input:
+                    imported = import_records(
+                        read_records(input, format, self.stderr), progress,
+                        self.stderr, batch_size=options['batch_size'])
+        except IntegrityError as error:
+            raise CommandError(
+                "Import interrompu ({}) : un identifiant importé existe "
+                "peut-être déjà. Les lots précédents sont conservés."
+                .format(error))
+        progress.report()
+
+        if not options['skip_rebuild']:
+            # bulk_create n'émet pas post_save : ni le flux matérialisé, ni
+            # l'index de recherche, ni les agrégats des tickets n'ont vu
+            # les lignes importées.
+            call_command('rebuild_feed', stdout=self.stdout)
+            call_command('rebuild_search_index', stdout=self.stdout)
+            call_command('reconcile_ticket_aggregates', stdout=self.stdout)
+        self.stdout.write(self.style.SUCCESS(
+            '{} lignes importées.'.format(imported)))
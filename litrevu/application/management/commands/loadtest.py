@@ -0,0 +1,111 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import AsyncClient, Client, override_settings
+from django.urls import reverse
+from application import benchmark
+from application.benchmark import _percentile
+from authentication.models import User
+
+
+class Command(BaseCommand):
+    help = ("Compare le débit et la latence du flux servi en WSGI (vue "
+            "synchrone, clients en threads) et en ASGI (vue asynchrone, "
+            "requêtes concurrentes dans une boucle asyncio), sur un graphe "
+            "social synthétique généré dans une base de test jetable.")
+
+    def add_arguments(self, parser):
+        for name, default in benchmark.DEFAULT_SCALE.items():
+            parser.add_argument('--' + name, type=int, default=default)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--requests', type=int, default=500,
+                            help="Nombre de requêtes par mode.")
+        parser.add_argument('--concurrency', type=int, default=20,
+                            help="Nombre de requêtes simultanées.")
+        parser.add_argument('--mode', choices=('wsgi', 'asgi', 'both'),
+                            default='both')
+
+    def handle(self, *args, **options):
+        if options['requests'] < 1 or options['concurrency'] < 1:
+            raise CommandError(
+                '--requests et --concurrency doivent être positifs.')
+        scale = {name: options[name] for name in benchmark.DEFAULT_SCALE}
+
+        # Les sessions des clients et les caches du flux sont écrits dans la
+        # base et le cache jetables, pas dans ceux du site. Les clients de
+        # test s'annoncent avec l'hôte « testserver ».
+        with benchmark.throwaway_database(), override_settings(
+                ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+            ids = benchmark.seed(seed=options['seed'], **scale)
+            self.user = User.objects.get(id=ids[0])
+            if options['mode'] in ('wsgi', 'both'):
+                self.report('WSGI', *self.run_wsgi(
+                    options['requests'], options['concurrency']))
+            if options['mode'] in ('asgi', 'both'):
+                self.report('ASGI', *asyncio.run(self.run_asgi(
+                    options['requests'], options['concurrency'])))
+
+    def run_wsgi(self, total, concurrency):
+        url = reverse('flux')
+        per_worker = [total // concurrency + (i < total % concurrency)
+                      for i in range(concurrency)]
+        # Une seule session, ouverte avant les threads : la base de test
+        # SQLite en mémoire verrouille la table des sessions en écriture.
+        session = Client()
+        session.force_login(self.user)
+
+        def worker(count):
+            client = Client()
+            client.cookies = session.cookies
+            durations = []
+            try:
+                for _ in range(count):
+                    start = time.perf_counter()
+                    response = client.get(url)
+                    durations.append(time.perf_counter() - start)
+                    if response.status_code != 200:
+                        raise CommandError('WSGI : réponse {}'.format(
+                            response.status_code))
+            finally:
+                connection.close()
+            return durations
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            results = list(executor.map(worker, per_worker))
+        elapsed = time.perf_counter() - start
+        return [d for durations in results for d in durations], elapsed
+
+    async def run_asgi(self, total, concurrency):
+        url = reverse('fluxasync')
+        client = AsyncClient()
+        await sync_to_async(client.force_login)(self.user)
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def request():
+            async with semaphore:
+                start = time.perf_counter()
+                response = await client.get(url)
+                duration = time.perf_counter() - start
+            if response.status_code != 200:
+                raise CommandError('ASGI : réponse {}'.format(
+                    response.status_code))
+            return duration
+
+        start = time.perf_counter()
+        durations = await asyncio.gather(*(request() for _ in range(total)))
+        elapsed = time.perf_counter() - start
+        return list(durations), elapsed
+
+    def report(self, label, durations, elapsed):
+        self.stdout.write(
+            '{} : {} requêtes en {:.2f} s, {:.1f} req/s, '
+            'p50 {:.1f} ms, p99 {:.1f} ms'.format(
+                label, len(durations), elapsed, len(durations) / elapsed,
+                _percentile(durations, 50) * 1000,
+                _percentile(durations, 99) * 1000))
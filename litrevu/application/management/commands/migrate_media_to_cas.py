@@ -0,0 +1,61 @@
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from application.cache import bump_feed_versions
+from application.feed import ticket_readers
+from application.models import Ticket
+from authentication.models import User
+from litrevu.storage import CAS_PREFIX, content_addressed_storage
+
+
+class Command(BaseCommand):
+    help = ("Déplace les images existantes (Ticket.image et "
+            "User.profile_photo) vers le stockage adressé par contenu et "
+            "met à jour les références des modèles.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--delete-originals', action='store_true',
+                            help="Supprime les fichiers d'origine une fois "
+                                 "migrés.")
+
+    def handle(self, *args, **options):
+        storage = content_addressed_storage()
+        renamed = {}
+        tickets = set()
+        missing = 0
+        for model, field in ((Ticket, 'image'), (User, 'profile_photo')):
+            rows = model.objects.exclude(**{field: ''}).exclude(
+                **{field + '__isnull': True}).exclude(
+                **{field + '__startswith': CAS_PREFIX + '/'})
+            for id, name in rows.values_list('id', field).iterator():
+                if name not in renamed:
+                    if not default_storage.exists(name):
+                        missing += 1
+                        self.stderr.write('Fichier introuvable : ' + name)
+                        continue
+                    with default_storage.open(name) as file:
+                        renamed[name] = storage.save(name, file)
+                model.objects.filter(id=id).update(**{field: renamed[name]})
+                if model is Ticket:
+                    tickets.add(id)
+                self.stdout.write('{} {} : {} -> {}'.format(
+                    model.__name__, id, name, renamed[name]))
+
+        # Les fragments et les pages validées par ETag pointent encore vers
+        # les anciens fichiers : les flux qui affichent ces tickets sont
+        # invalidés avant toute suppression.
+        readers = set()
+        for id in tickets:
+            readers |= ticket_readers(id)
+        bump_feed_versions(readers)
+
+        unique = set(renamed.values())
+        saved = 0
+        if options['delete_originals']:
+            for name in renamed:
+                saved += default_storage.size(name)
+                default_storage.delete(name)
+            saved -= sum(storage.size(name) for name in unique)
+        self.stdout.write(self.style.SUCCESS(
+            '{} fichiers migrés vers {} fichiers uniques, {} introuvables, '
+            '{} octets libérés.'.format(len(renamed), len(unique), missing,
+                                        saved)))
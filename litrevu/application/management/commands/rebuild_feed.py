@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand, CommandError
+from application.feed import rebuild_feed
+from authentication.models import User
+
+
+class Command(BaseCommand):
+    help = ("Reconstruit le flux matérialisé (FeedEntry) de tous les "
+            "utilisateurs, ou de ceux donnés en argument.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('usernames', nargs='*',
+                            help="Utilisateurs dont le flux est reconstruit.")
+
+    def handle(self, *args, **options):
+        users = User.objects.order_by('id')
+        if options['usernames']:
+            users = users.filter(username__in=options['usernames'])
+            missing = set(options['usernames']) - set(
+                users.values_list('username', flat=True))
+            if missing:
+                raise CommandError('Utilisateurs inconnus : {}'.format(
+                    ', '.join(sorted(missing))))
+
+        total = users.count()
+        for index, user in enumerate(users.iterator(), start=1):
+            rebuild_feed(user)
+            self.stdout.write('[{}/{}] {} : {} entrées'.format(
+                index, total, user.username, user.feed_entries.count()))
+        self.stdout.write(self.style.SUCCESS(
+            '{} flux reconstruits.'.format(total)))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from application.search import search_backend
+
+
+class Command(BaseCommand):
+    help = ("Reconstruit l'index de recherche plein texte à partir des "
+            "tickets et des critiques existants.")
+
+    def handle(self, *args, **options):
+        backend = search_backend()
+        with transaction.atomic():
+            total = backend.rebuild()
+        self.stdout.write(self.style.SUCCESS(
+            '{} : {} éléments indexés.'.format(type(backend).__name__,
+                                               total)))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from application.aggregates import RECONCILE_BATCH_SIZE, reconcile
+
+
+class Command(BaseCommand):
+    help = ("Recalcule le nombre de critiques, la somme des notes et la "
+            "date de dernière critique de chaque ticket, et corrige les "
+            "tickets dont les valeurs ont dérivé.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int,
+                            default=RECONCILE_BATCH_SIZE)
+        parser.add_argument('--dry-run', action='store_true',
+                            help="Compte les tickets à corriger sans les "
+                                 "modifier.")
+
+    def handle(self, *args, **options):
+        repaired = reconcile(batch_size=options['batch_size'],
+                             dry_run=options['dry_run'])
+        message = ('{} tickets à corriger.' if options['dry_run']
+                   else '{} tickets corrigés.')
+        self.stdout.write(self.style.SUCCESS(message.format(repaired)))
@@ -0,0 +1,30 @@
+# Generated by Django 4.2.13 on 2026-10-18 16:45
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('application', '0002_userblock'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FeedEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('item_type', models.CharField(choices=[('ticket', 'Ticket'), ('review', 'Critique')], max_length=6)),
+                ('item_id', models.PositiveBigIntegerField()),
+                ('time_created', models.DateTimeField()),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='feed_entries', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['owner', '-time_created', '-item_type', '-item_id'], name='feedentry_owner_timeline'), models.Index(fields=['item_type', 'item_id'], name='feedentry_item')],
+                'unique_together': {('owner', 'item_type', 'item_id')},
+            },
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.13 on 2026-10-18 16:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('application', '0003_feedentry'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='review',
+            index=models.Index(fields=['user', '-time_created'], name='review_user_time'),
+        ),
+        migrations.AddIndex(
+            model_name='review',
+            index=models.Index(fields=['ticket', '-time_created'], name='review_ticket_time'),
+        ),
+        migrations.AddIndex(
+            model_name='ticket',
+            index=models.Index(fields=['user', '-time_created'], name='ticket_user_time'),
+        ),
+        migrations.AddIndex(
+            model_name='userblock',
+            index=models.Index(fields=['blocked_user', 'user'], name='userblock_blocked_user'),
+        ),
+        migrations.AddIndex(
+            model_name='userfollows',
+            index=models.Index(fields=['followed_user', 'user'], name='userfollows_followed_user'),
+        ),
+    ]
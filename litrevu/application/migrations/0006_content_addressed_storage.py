@@ -0,0 +1,19 @@
+# Generated by Django 4.2.13 on 2026-10-18 16:51
+
+from django.db import migrations, models
+import litrevu.storage
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('application', '0005_ticket_thumbnails'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='ticket',
+            name='image',
+            field=models.ImageField(blank=True, null=True, storage=litrevu.storage.content_addressed_storage, upload_to=''),
+        ),
+    ]
@@ -0,0 +1,49 @@
+from django.db import migrations
+
+
+def _fts5_available(connection):
+    if connection.vendor != 'sqlite':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA compile_options')
+        return ('ENABLE_FTS5',) in cursor.fetchall()
+
+
+def create_search_index(apps, schema_editor):
+    """
+    Crée l'index FTS5 des tickets et des critiques (voir application.search)
+    et l'alimente avec les éléments existants. Sans FTS5, la recherche se
+    rabat sur DatabaseSearchBackend et aucune table n'est créée.
+    """
+    if not _fts5_available(schema_editor.connection):
+        return
+    schema_editor.execute(
+        "CREATE VIRTUAL TABLE application_searchindex USING fts5("
+        "title, body, user_id UNINDEXED, time_created UNINDEXED, "
+        "tokenize = 'unicode61 remove_diacritics 2')")
+    schema_editor.execute(
+        "INSERT INTO application_searchindex "
+        "(rowid, title, body, user_id, time_created) "
+        "SELECT id * 2, title, description, user_id, time_created "
+        "FROM application_ticket")
+    schema_editor.execute(
+        "INSERT INTO application_searchindex "
+        "(rowid, title, body, user_id, time_created) "
+        "SELECT id * 2 + 1, headline, body, user_id, time_created "
+        "FROM application_review")
+
+
+def drop_search_index(apps, schema_editor):
+    if _fts5_available(schema_editor.connection):
+        schema_editor.execute('DROP TABLE IF EXISTS application_searchindex')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('application', '0006_content_addressed_storage'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
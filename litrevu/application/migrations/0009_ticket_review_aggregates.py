@@ -0,0 +1,48 @@
+# Generated by Django 4.2.13 on 2026-10-18 17:15
+
+from django.db import migrations, models
+from django.db.models import Count, Max, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def fill_aggregates(apps, schema_editor):
+    Ticket = apps.get_model('application', 'Ticket')
+    Review = apps.get_model('application', 'Review')
+    reviews = Review.objects.filter(ticket=OuterRef('pk')).order_by().values(
+        'ticket')
+
+    def aggregate(function, default):
+        return Coalesce(Subquery(reviews.annotate(value=function).values(
+            'value')), default)
+
+    Ticket.objects.filter(id__in=Review.objects.values('ticket')).update(
+        review_count=aggregate(Count('id'), 0),
+        rating_sum=aggregate(Sum('rating'), 0),
+        last_reviewed_at=Subquery(reviews.annotate(
+            value=Max('time_created')).values('value')))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('application', '0008_follow_suggestions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ticket',
+            name='last_reviewed_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='ticket',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='ticket',
+            name='review_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(fill_aggregates, migrations.RunPython.noop),
+    ]
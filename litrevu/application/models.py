@@ -1,18 +1,48 @@
 from django.db import models
 from django.conf import settings
 from django.core.validators import MinValueValidator, MaxValueValidator
+from litrevu.storage import content_addressed_storage
 
 
 class Ticket(models.Model):
+    # Type d'élément du flux (voir application.feed), lu par les templates.
+    kind = 'ticket'
+
     title = models.CharField(max_length=128)
     description = models.TextField(max_length=2048, blank=True)
     user = models.ForeignKey(settings.AUTH_USER_MODEL,
                              on_delete=models.CASCADE)
-    image = models.ImageField(null=True, blank=True)
+    image = models.ImageField(null=True, blank=True,
+                              storage=content_addressed_storage)
+    thumbnails = models.JSONField(default=dict, blank=True, editable=False)
     time_created = models.DateTimeField(auto_now_add=True)
+    # Agrégats des critiques du ticket, tenus à jour à chaque écriture
+    # (voir application.aggregates).
+    review_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_sum = models.PositiveIntegerField(default=0, editable=False)
+    last_reviewed_at = models.DateTimeField(null=True, blank=True,
+                                            editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-time_created'],
+                         name='ticket_user_time'),
+        ]
+
+    @property
+    def has_review(self):
+        return self.review_count > 0
+
+    @property
+    def average_rating(self):
+        if not self.review_count:
+            return None
+        return self.rating_sum / self.review_count
 
 
 class Review(models.Model):
+    kind = 'review'
+
     ticket = models.ForeignKey(Ticket, on_delete=models.CASCADE)
     rating = models.PositiveSmallIntegerField(
         max_length=1024,
@@ -23,6 +53,23 @@ class Review(models.Model):
     body = models.TextField(max_length=8192, blank=True)
     time_created = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-time_created'],
+                         name='review_user_time'),
+            models.Index(fields=['ticket', '-time_created'],
+                         name='review_ticket_time'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        # Ticket et note lus en base, pour reporter une modification sur
+        # les agrégats du ticket sans relire la critique.
+        instance = super().from_db(db, field_names, values)
+        instance._loaded = (instance.__dict__.get('ticket_id'),
+                            instance.__dict__.get('rating'))
+        return instance
+
 
 class UserFollows(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL,
@@ -34,6 +81,10 @@ class UserFollows(models.Model):
 
     class Meta:
         unique_together = ('user', 'followed_user')
+        indexes = [
+            models.Index(fields=['followed_user', 'user'],
+                         name='userfollows_followed_user'),
+        ]
 
 
 class UserBlock(models.Model):
@@ -45,3 +96,54 @@ class UserBlock(models.Model):
 
     class Meta:
         unique_together = ('user', 'blocked_user')
+        indexes = [
+            models.Index(fields=['blocked_user', 'user'],
+                         name='userblock_blocked_user'),
+        ]
+
+
+class FeedEntry(models.Model):
+    ITEM_TYPES = [('ticket', 'Ticket'), ('review', 'Critique')]
+
+    owner = models.ForeignKey(settings.AUTH_USER_MODEL,
+                              related_name='feed_entries',
+                              on_delete=models.CASCADE)
+    item_type = models.CharField(max_length=6, choices=ITEM_TYPES)
+    item_id = models.PositiveBigIntegerField()
+    time_created = models.DateTimeField()
+
+    class Meta:
+        unique_together = ('owner', 'item_type', 'item_id')
+        indexes = [
+            models.Index(fields=['owner', '-time_created', '-item_type',
+                                 '-item_id'],
+                         name='feedentry_owner_timeline'),
+            models.Index(fields=['item_type', 'item_id'],
+                         name='feedentry_item'),
+        ]
+
+
+class FollowSuggestion(models.Model):
+    user = models.ForeignKey(settings.AUTH_USER_MODEL,
+                             related_name='follow_suggestions',
+                             on_delete=models.CASCADE)
+    suggested_user = models.ForeignKey(settings.AUTH_USER_MODEL,
+                                       related_name='suggested_to',
+                                       on_delete=models.CASCADE)
+    mutual_count = models.PositiveIntegerField()
+    score = models.FloatField()
+    time_computed = models.DateTimeField()
+
+    class Meta:
+        unique_together = ('user', 'suggested_user')
+        indexes = [
+            models.Index(fields=['user', '-score'],
+                         name='followsuggestion_user_score'),
+        ]
+
+
+class StaleFollowSuggestions(models.Model):
+    # Identifiant sans clé étrangère : un utilisateur peut être marqué
+    # pendant sa propre suppression (abonnements supprimés en cascade).
+    user_id = models.PositiveBigIntegerField(primary_key=True)
+    time_marked = models.DateTimeField()
@@ -0,0 +1,218 @@
+import re
+from functools import cache
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+from django.utils.module_loading import import_string
+from application.feed import REVIEW, TICKET, merged_queryset
+from application.models import Review, Ticket, UserBlock
+from authentication.models import User
+
+SEARCH_PAGE_SIZE = 20
+SEARCH_QUERY_MAX_LENGTH = 200
+USERNAME_SUGGESTIONS = 10
+
+FTS5_TABLE = 'application_searchindex'
+FTS5_BACKEND = 'application.search.Fts5SearchBackend'
+DATABASE_BACKEND = 'application.search.DatabaseSearchBackend'
+
+# Le rowid de l'index encode le type et l'identifiant de l'élément, ce qui
+# permet de remplacer ou de supprimer une entrée par une recherche sur la
+# clé primaire de la table FTS5.
+_KIND_BITS = {TICKET: 0, REVIEW: 1}
+_BIT_KINDS = {bit: kind for kind, bit in _KIND_BITS.items()}
+
+
+def terms(query):
+    """
+    Découpe une requête de recherche en mots, en ignorant la ponctuation et
+    la syntaxe propre aux moteurs (guillemets, opérateurs).
+    """
+    return re.findall(r'\w+', query[:SEARCH_QUERY_MAX_LENGTH])
+
+
+def _searchable(item, kind):
+    """
+    Retourne le titre et le corps indexés d'un ticket ou d'une critique.
+    """
+    if kind == TICKET:
+        return item.title, item.description
+    return item.headline, item.body
+
+
+def _hidden_authors(user):
+    """
+    Condition excluant les éléments des utilisateurs bloqués par
+    l'utilisateur et de ceux qui l'ont bloqué.
+    """
+    return (Q(user__in=UserBlock.objects.filter(
+        user=user).values('blocked_user')) |
+        Q(user__in=UserBlock.objects.filter(
+            blocked_user=user).values('user')))
+
+
+@cache
+def fts5_available():
+    """
+    Indique si la base par défaut est SQLite compilée avec FTS5.
+    """
+    if connection.vendor != 'sqlite':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA compile_options')
+        return ('ENABLE_FTS5',) in cursor.fetchall()
+
+
+class DatabaseSearchBackend:
+    """
+    Recherche par sous-chaîne (LIKE) sur les tables des tickets et des
+    critiques, utilisable avec toute base de données. Il n'y a pas d'index
+    à maintenir ; les résultats sont triés du plus récent au plus ancien.
+    """
+
+    def index(self, item, kind):
+        pass
+
+    def remove(self, kind, id):
+        pass
+
+    def rebuild(self):
+        return 0
+
+    def search(self, user, query, limit=SEARCH_PAGE_SIZE, offset=0):
+        words = terms(query)
+        if not words:
+            return []
+        tickets = Ticket.objects.exclude(_hidden_authors(user))
+        reviews = Review.objects.exclude(_hidden_authors(user))
+        for word in words:
+            tickets = tickets.filter(Q(title__icontains=word) |
+                                     Q(description__icontains=word))
+            reviews = reviews.filter(Q(headline__icontains=word) |
+                                     Q(body__icontains=word))
+        return list(merged_queryset(tickets, reviews)[offset:offset + limit])
+
+
+class Fts5SearchBackend:
+    """
+    Index inversé SQLite FTS5 (table application_searchindex, créée par la
+    migration 0007), tenu à jour élément par élément par les signaux.
+
+    Les résultats sont classés par bm25, le titre pesant deux fois plus que
+    le corps, multiplié par un bonus de récence qui va de 1,5 pour un
+    élément du jour à 1 pour un élément ancien : 1 + 0,5 / (1 + âge /
+    SEARCH_RECENCY_DAYS), l'âge étant compté en jours. Le bonus reste
+    inférieur au poids du titre : la pertinence est le critère principal et
+    la récence départage les résultats comparables.
+    """
+
+    def index(self, item, kind):
+        rowid = item.id * 2 + _KIND_BITS[kind]
+        title, body = _searchable(item, kind)
+        time_created = connection.ops.adapt_datetimefield_value(
+            item.time_created)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'DELETE FROM {} WHERE rowid = %s'.format(FTS5_TABLE), [rowid])
+            cursor.execute(
+                'INSERT INTO {} (rowid, title, body, user_id, time_created) '
+                'VALUES (%s, %s, %s, %s, %s)'.format(FTS5_TABLE),
+                [rowid, title, body, item.user_id, time_created])
+
+    def remove(self, kind, id):
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM {} WHERE rowid = %s'.format(
+                FTS5_TABLE), [id * 2 + _KIND_BITS[kind]])
+
+    def rebuild(self):
+        """
+        Vide et remplit à nouveau l'index à partir des tables des tickets et
+        des critiques. Retourne le nombre d'éléments indexés.
+        """
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM {}'.format(FTS5_TABLE))
+            for model, kind, title, body in (
+                    (Ticket, TICKET, 'title', 'description'),
+                    (Review, REVIEW, 'headline', 'body')):
+                cursor.execute(
+                    'INSERT INTO {} (rowid, title, body, user_id, '
+                    'time_created) SELECT id * 2 + {}, {}, {}, user_id, '
+                    'time_created FROM {}'.format(
+                        FTS5_TABLE, _KIND_BITS[kind], title, body,
+                        model._meta.db_table))
+            cursor.execute('SELECT count(*) FROM {}'.format(FTS5_TABLE))
+            return cursor.fetchone()[0]
+
+    def search(self, user, query, limit=SEARCH_PAGE_SIZE, offset=0):
+        words = terms(query)
+        if not words:
+            return []
+        # Chaque mot est cité (aucune syntaxe FTS5 ne passe) et cherché en
+        # préfixe ; les mots sont combinés par un ET implicite.
+        match = ' '.join('"{}"*'.format(word) for word in words)
+        blocks = UserBlock._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT rowid FROM {table} '
+                'WHERE {table} MATCH %s '
+                'AND user_id NOT IN (SELECT blocked_user_id FROM {blocks} '
+                'WHERE user_id = %s) '
+                'AND user_id NOT IN (SELECT user_id FROM {blocks} '
+                'WHERE blocked_user_id = %s) '
+                'ORDER BY bm25({table}, 2.0, 1.0) * (1 + 0.5 / (1 + ('
+                'julianday(\'now\') - julianday(time_created)) / %s)) '
+                'LIMIT %s OFFSET %s'.format(table=FTS5_TABLE, blocks=blocks),
+                [match, user.id, user.id, settings.SEARCH_RECENCY_DAYS,
+                 limit, offset])
+            return [{'kind': _BIT_KINDS[rowid % 2], 'id': rowid // 2}
+                    for rowid, in cursor.fetchall()]
+
+
+def users_with_prefix(prefix):
+    """
+    Queryset des utilisateurs dont le nom commence par le préfixe donné,
+    dans l'ordre alphabétique.
+
+    Le filtre est l'intervalle [préfixe, préfixe + U+10FFFF[, que SQLite
+    parcourt sur l'index unique de username dans l'ordre du tri : lire les
+    premiers noms ne coûte que quelques pages d'index, quel que soit le
+    nombre d'utilisateurs. Un LIKE 'abc%' (username__startswith), lui,
+    n'est pas exécuté sur l'index par SQLite.
+    """
+    return User.objects.filter(
+        username__gte=prefix, username__lt=prefix + chr(0x10FFFF)
+    ).order_by('username')
+
+
+def username_suggestions(prefix, user, limit=USERNAME_SUGGESTIONS):
+    """
+    Retourne au plus `limit` noms d'utilisateurs commençant par le préfixe
+    donné, hors utilisateur lui-même.
+    """
+    if not prefix:
+        return []
+    return list(users_with_prefix(prefix).exclude(pk=user.pk).values_list(
+        'username', flat=True)[:limit])
+
+
+def search_backend():
+    """
+    Retourne le moteur de recherche configuré par SEARCH_BACKEND, ou à
+    défaut FTS5 si la base le permet et la recherche par sous-chaîne sinon.
+    """
+    path = settings.SEARCH_BACKEND
+    if path is None:
+        path = FTS5_BACKEND if fts5_available() else DATABASE_BACKEND
+    return import_string(path)()
+
+
+def search(user, query, limit=SEARCH_PAGE_SIZE, offset=0):
+    """
+    Cherche les tickets et les critiques correspondant à la requête, hors
+    utilisateurs bloqués par l'utilisateur ou l'ayant bloqué.
+
+    Returns:
+        list: Les entrées {'kind', 'id'} des résultats, de la plus
+        pertinente à la moins pertinente, à charger avec feed.hydrate.
+    """
+    return search_backend().search(user, query, limit=limit, offset=offset)
@@ -0,0 +1,146 @@
+from django.db import transaction
+from django.db.models import QuerySet
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from application import aggregates, events, feed, graph, search
+from application import suggestions
+from application.cache import bump_feed_versions
+from application.models import Ticket, Review, UserBlock, UserFollows
+from authentication.models import User
+
+
+def _owner_is_being_deleted(instance, origin):
+    """
+    Indique si la suppression en cours est celle du propriétaire de
+    l'abonnement ou du blocage : son flux disparaît avec lui et ne doit pas
+    être reconstruit.
+    """
+    if isinstance(origin, User):
+        return origin.pk == instance.user_id
+    if isinstance(origin, QuerySet) and origin.model is User:
+        return origin.filter(pk=instance.user_id).exists()
+    return False
+
+
+def _invalidate(user_ids):
+    """
+    Invalide le cache des flux des utilisateurs donnés une fois la
+    transaction validée, pour qu'aucun rendu concurrent ne mette en cache
+    l'état antérieur sous la nouvelle version.
+    """
+    user_ids = set(user_ids)
+    if user_ids:
+        transaction.on_commit(lambda: bump_feed_versions(user_ids))
+
+
+def _notify(kind, instance, owners):
+    """
+    Annonce le nouvel élément aux propriétaires des flux qui le reçoivent,
+    hormis son auteur, une fois la transaction validée (voir
+    application.events).
+    """
+    readers = set(owners) - {instance.user_id}
+    if readers:
+        transaction.on_commit(lambda: events.notify_new_item(
+            kind, instance.id, instance.user_id, readers))
+
+
+@receiver(post_save, sender=Ticket)
+def ticket_saved(sender, instance, created, **kwargs):
+    search.search_backend().index(instance, feed.TICKET)
+    owners = feed.fan_out(instance, feed.TICKET) if created else set()
+    _invalidate(owners | feed.ticket_readers(instance.id))
+    _notify(feed.TICKET, instance, owners)
+
+
+@receiver(post_save, sender=Review)
+def review_saved(sender, instance, created, **kwargs):
+    search.search_backend().index(instance, feed.REVIEW)
+    owners = feed.fan_out(instance, feed.REVIEW) if created else set()
+    _invalidate(owners | feed.ticket_readers(instance.ticket_id))
+    _notify(feed.REVIEW, instance, owners)
+
+
+@receiver(pre_save, sender=Review)
+def review_saving(sender, instance, **kwargs):
+    # Une critique modifiée sans avoir été lue en base (ou lue sans son
+    # ticket ou sa note) : les valeurs enregistrées sont relues.
+    loaded = getattr(instance, '_loaded', (None, None))
+    if instance.pk is not None and None in loaded:
+        instance._loaded = Review.objects.filter(pk=instance.pk).values_list(
+            'ticket_id', 'rating').first() or (None, None)
+
+
+@receiver(post_save, sender=Review)
+def review_aggregates(sender, instance, created, **kwargs):
+    old_ticket, old_rating = getattr(instance, '_loaded', (None, None))
+    if created or old_ticket is None:
+        aggregates.review_added(instance.ticket_id, instance.rating,
+                                instance.time_created)
+    elif old_ticket != instance.ticket_id:
+        aggregates.review_removed(old_ticket, old_rating)
+        aggregates.review_added(instance.ticket_id, instance.rating,
+                                instance.time_created)
+    else:
+        aggregates.review_changed(instance.ticket_id, instance.rating,
+                                  old_rating)
+    instance._loaded = (instance.ticket_id, instance.rating)
+
+
+@receiver(post_delete, sender=Ticket)
+def ticket_deleted(sender, instance, **kwargs):
+    search.search_backend().remove(feed.TICKET, instance.id)
+    _invalidate(feed.remove_item(feed.TICKET, instance.id))
+
+
+@receiver(post_delete, sender=Review)
+def review_deleted(sender, instance, origin=None, **kwargs):
+    search.search_backend().remove(feed.REVIEW, instance.id)
+    if not (isinstance(origin, Ticket) and origin.pk == instance.ticket_id):
+        aggregates.review_removed(instance.ticket_id, instance.rating)
+    owners = feed.remove_item(feed.REVIEW, instance.id)
+    _invalidate(owners | feed.ticket_readers(instance.ticket_id))
+
+
+# Les caches du graphe sont invalidés avant toute autre mise à jour : les
+# récepteurs suivants relisent les relations modifiées.
+@receiver(post_save, sender=UserFollows)
+@receiver(post_delete, sender=UserFollows)
+def follow_changed(sender, instance, **kwargs):
+    graph.invalidate([instance.user_id, instance.followed_user_id])
+
+
+@receiver(post_save, sender=UserBlock)
+@receiver(post_delete, sender=UserBlock)
+def block_changed(sender, instance, **kwargs):
+    graph.invalidate([instance.user_id, instance.blocked_user_id])
+
+
+@receiver(post_save, sender=UserFollows)
+@receiver(post_delete, sender=UserFollows)
+def follow_suggestions_stale(sender, instance, **kwargs):
+    # Les abonnés de l'utilisateur, dont les amis d'amis changent aussi,
+    # sont ajoutés par le calcul (voir suggestions.compute_suggestions) :
+    # l'écriture ne dépend pas de leur nombre.
+    suggestions.mark_stale([instance.user_id, instance.followed_user_id])
+
+
+@receiver(post_save, sender=UserBlock)
+@receiver(post_delete, sender=UserBlock)
+def block_suggestions_stale(sender, instance, **kwargs):
+    suggestions.mark_stale([instance.user_id, instance.blocked_user_id])
+
+
+@receiver(post_save, sender=UserFollows)
+def follow_saved(sender, instance, created, **kwargs):
+    if created:
+        feed.add_followed_items(instance.user, instance.followed_user)
+        _invalidate([instance.user_id])
+
+
+@receiver(post_delete, sender=UserFollows)
+@receiver(post_save, sender=UserBlock)
+@receiver(post_delete, sender=UserBlock)
+def follow_or_block_changed(sender, instance, origin=None, **kwargs):
+    if not _owner_is_being_deleted(instance, origin):
+        feed.rebuild_feed(instance.user)
@@ -0,0 +1,186 @@
+import heapq
+from collections import Counter, defaultdict
+from datetime import timedelta
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
+from application import graph
+from application.models import FollowSuggestion, Review, Ticket
+from application.models import StaleFollowSuggestions, UserBlock
+from application.models import UserFollows
+from authentication.models import User
+
+SUGGESTIONS_PER_USER = 20
+SUGGESTIONS_SHOWN = 5
+SUGGESTION_ACTIVITY_DAYS = 30
+SUGGESTION_BATCH_SIZE = 500
+
+
+def mark_stale(user_ids):
+    """
+    Marque les suggestions des utilisateurs donnés comme à recalculer au
+    prochain passage incrémental de compute_follow_suggestions.
+
+    La date de marquage est mise à jour si l'utilisateur est déjà marqué :
+    un marquage postérieur au début d'un calcul en cours survit ainsi à la
+    fin de ce calcul.
+    """
+    now = timezone.now()
+    StaleFollowSuggestions.objects.bulk_create(
+        [StaleFollowSuggestions(user_id=user_id, time_marked=now)
+         for user_id in set(user_ids)],
+        update_conflicts=True, unique_fields=['user_id'],
+        update_fields=['time_marked'])
+
+
+def _chunks(ids):
+    ids = sorted(ids)
+    for start in range(0, len(ids), SUGGESTION_BATCH_SIZE):
+        yield ids[start:start + SUGGESTION_BATCH_SIZE]
+
+
+def _adjacency(model, source, target, sources=None):
+    """
+    Charge les arêtes d'une relation en un dictionnaire
+    {source: {cibles}}, en un seul parcours de la table ou, si `sources`
+    est donné, par lots d'identifiants sur l'index de la colonne source.
+    """
+    if sources is None:
+        querysets = [model.objects.all()]
+    else:
+        querysets = (model.objects.filter(**{source + '__in': chunk})
+                     for chunk in _chunks(sources))
+    adjacency = defaultdict(set)
+    for queryset in querysets:
+        rows = queryset.values_list(source, target).iterator(
+            chunk_size=SUGGESTION_BATCH_SIZE * 10)
+        for source_id, target_id in rows:
+            adjacency[source_id].add(target_id)
+    return adjacency
+
+
+def _activity(since):
+    """
+    Retourne le nombre de tickets et de critiques publiés depuis `since`
+    par chaque utilisateur actif, en une requête agrégée par table.
+    """
+    activity = Counter()
+    for model in (Ticket, Review):
+        activity.update(dict(model.objects.filter(
+            time_created__gte=since).order_by().values('user').annotate(
+            count=Count('id')).values_list('user', 'count')))
+    return activity
+
+
+def rank(user_id, following, hidden, activity, limit=SUGGESTIONS_PER_USER):
+    """
+    Classe les amis d'amis de l'utilisateur.
+
+    Le score est le nombre d'abonnements en commun (utilisateurs suivis qui
+    suivent le candidat), plus un terme d'activité compris entre 0 et 1
+    qui départage les candidats à égalité.
+
+    Args:
+        following (dict): {utilisateur: {utilisateurs suivis}}, couvrant
+        l'utilisateur et chacun des utilisateurs qu'il suit.
+        hidden (set): Les utilisateurs à ne pas suggérer (bloqués dans un
+        sens ou dans l'autre).
+        activity (Counter): Le nombre de publications récentes par
+        utilisateur.
+
+    Returns:
+        list: Les tuples (score, abonnements en commun, candidat), du
+        meilleur au moins bon.
+    """
+    followed = following.get(user_id, set())
+    mutual = Counter()
+    for followed_id in followed:
+        mutual.update(following.get(followed_id, ()))
+    excluded = followed | hidden | {user_id}
+    return heapq.nlargest(limit, (
+        (count + activity[candidate] / (activity[candidate] + 10), count,
+         candidate)
+        for candidate, count in mutual.items() if candidate not in excluded))
+
+
+def compute_suggestions(user_ids=None):
+    """
+    Recalcule les suggestions d'abonnement des utilisateurs donnés et de
+    leurs abonnés, ou de tous les utilisateurs si `user_ids` vaut None.
+
+    Un abonnement change les amis d'amis de son auteur, mais aussi ceux des
+    abonnés de l'auteur, pour qui il est un intermédiaire : seuls les deux
+    utilisateurs de l'abonnement sont marqués à l'écriture (voir
+    mark_stale), leurs abonnés sont ajoutés ici.
+
+    Le graphe des abonnements est chargé en bloc (la table entière, ou les
+    abonnements des utilisateurs concernés puis ceux de leurs abonnements),
+    les amis d'amis sont comptés en mémoire, puis les suggestions sont
+    réécrites par lots de SUGGESTION_BATCH_SIZE utilisateurs. Les marques
+    StaleFollowSuggestions antérieures au début du calcul sont retirées.
+
+    Returns:
+        int: Le nombre d'utilisateurs traités.
+    """
+    started = timezone.now()
+    if user_ids is None:
+        targets = list(User.objects.order_by('id').values_list(
+            'id', flat=True))
+        following = _adjacency(UserFollows, 'user_id', 'followed_user_id')
+        blocking = _adjacency(UserBlock, 'user_id', 'blocked_user_id')
+        blocked_by = _adjacency(UserBlock, 'blocked_user_id', 'user_id')
+    else:
+        user_ids = set(user_ids)
+        followers = _adjacency(UserFollows, 'followed_user_id', 'user_id',
+                               user_ids)
+        targets = []
+        for chunk in _chunks(user_ids.union(*followers.values())):
+            targets += User.objects.filter(id__in=chunk).values_list(
+                'id', flat=True)
+        following = _adjacency(UserFollows, 'user_id', 'followed_user_id',
+                               targets)
+        second_degree = set().union(*following.values()) - set(following)
+        following.update(_adjacency(UserFollows, 'user_id',
+                                    'followed_user_id', second_degree))
+        blocking = _adjacency(UserBlock, 'user_id', 'blocked_user_id',
+                              targets)
+        blocked_by = _adjacency(UserBlock, 'blocked_user_id', 'user_id',
+                                targets)
+    activity = _activity(started - timedelta(days=SUGGESTION_ACTIVITY_DAYS))
+
+    for chunk in _chunks(targets):
+        suggestions = [
+            FollowSuggestion(user_id=user_id, suggested_user_id=candidate,
+                             mutual_count=count, score=score,
+                             time_computed=started)
+            for user_id in chunk
+            for score, count, candidate in rank(
+                user_id, following,
+                blocking.get(user_id, set()) | blocked_by.get(user_id, set()),
+                activity)]
+        with transaction.atomic():
+            FollowSuggestion.objects.filter(user_id__in=chunk).delete()
+            FollowSuggestion.objects.bulk_create(suggestions)
+
+    stale = StaleFollowSuggestions.objects.filter(time_marked__lte=started)
+    if user_ids is None:
+        stale.delete()
+    else:
+        for chunk in _chunks(user_ids):
+            stale.filter(user_id__in=chunk).delete()
+    return len(targets)
+
+
+def follow_suggestions(user, limit=SUGGESTIONS_SHOWN):
+    """
+    Retourne les meilleures suggestions d'abonnement de l'utilisateur, en
+    une requête sur l'index (user, -score).
+
+    Les utilisateurs suivis ou bloqués depuis le dernier calcul sont
+    écartés à la lecture, d'après le cache du graphe.
+    """
+    followed, blocking, blocked_by = graph.neighbours(
+        user.id, graph.FOLLOWING, graph.BLOCKING, graph.BLOCKED_BY)
+    return list(FollowSuggestion.objects.filter(user=user).exclude(
+        suggested_user__in=[*followed, *blocking, *blocked_by]
+    ).select_related('suggested_user').order_by('-score')[:limit])
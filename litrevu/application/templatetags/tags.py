@@ -1,7 +1,34 @@
+from django.core.files.storage import default_storage
 from django.template import Library
+from application import graph
+from application.cache import feed_cards as _feed_cards
 
 register = Library()
 
+
+@register.simple_tag(takes_context=True)
+def feed_cards(context, items, variant):
+    """
+    Rend les tickets et critiques d'une page de flux, depuis le cache pour
+    ceux qui n'ont pas changé (voir application.cache.feed_cards).
+    """
+    return _feed_cards(items, context['request'].user, variant)
+
+
+@register.filter
+def srcset(thumbnails, extension):
+    """
+    Construit l'attribut srcset d'une image à partir de Ticket.thumbnails
+    pour le format donné ('webp' ou 'jpeg').
+    """
+    return ', '.join('{} {}w'.format(default_storage.url(name), width)
+                     for width, name in thumbnails.get(extension, []))
+
+
 @register.filter
-def model_type(value):
-    return type(value).__name__
\ No newline at end of file
+def is_mutual(user, other):
+    """
+    Indique si les deux utilisateurs se suivent l'un l'autre (voir
+    application.graph).
+    """
+    return graph.is_mutual(user.id, other.id)
@@ -0,0 +1,1480 @@
+import asyncio
+import json
+import re
+import shutil
+import sqlite3
+import tempfile
+import time
+import unittest
+from unittest import mock
+from datetime import datetime, timezone
+from io import BytesIO, StringIO
+from pathlib import Path
+
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection, connections, reset_queries
+from django.db import transaction
+from django.http import HttpResponse
+from django.test import Client, RequestFactory, TestCase
+from django.test import TransactionTestCase
+from django.test import override_settings
+from django.template import engines
+from django.template.loader import get_template
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from application import api, benchmark, events, graph
+from application.cache import FEED_VERSION_KEY, bump_feed_versions
+from application.cache import feed_version
+from application.cache import feed_cards, feed_changed_recently
+from application.feed import feed_page, merged_entries, timeline_entries
+from application.feed import visible_reviews, visible_tickets
+from application.feed import feed_reviews, feed_tickets, merged_queryset
+from application.feed import timeline_queryset
+from application.suggestions import compute_suggestions
+from application.suggestions import follow_suggestions
+from application.search import SEARCH_PAGE_SIZE, search, users_with_prefix
+from application.models import FeedEntry, Ticket, Review, UserBlock
+from application.models import StaleFollowSuggestions
+from application.models import UserFollows
+from authentication.models import User
+from litrevu import database, metrics
+from PIL import Image
+
+
+class FeedTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.alice = User.objects.create_user('alice')
+        self.bob = User.objects.create_user('bob')
+        self.carol = User.objects.create_user('carol')
+        UserFollows.objects.create(user=self.alice, followed_user=self.bob)
+
+    def test_feed_merges_visible_items_newest_first(self):
+        own = Ticket.objects.create(title='own', user=self.alice)
+        followed = Ticket.objects.create(title='followed', user=self.bob)
+        Ticket.objects.create(title='stranger', user=self.carol)
+        answer = Review.objects.create(ticket=own, rating=4, user=self.carol,
+                                       headline='answer')
+
+        self.assertEqual(feed_page(self.alice)['items'],
+                         [answer, followed, own])
+
+    def test_feed_excludes_blocked_users(self):
+        own = Ticket.objects.create(title='own', user=self.alice)
+        Ticket.objects.create(title='followed', user=self.bob)
+        Review.objects.create(ticket=own, rating=1, user=self.bob,
+                              headline='blocked')
+        UserBlock.objects.create(user=self.alice, blocked_user=self.bob)
+
+        self.assertEqual(feed_page(self.alice)['items'], [own])
+
+    def test_feed_is_limited_to_one_page(self):
+        for i in range(5):
+            Ticket.objects.create(title=str(i), user=self.bob)
+
+        page = feed_page(self.alice, limit=3)
+        self.assertEqual([ticket.title for ticket in page['items']],
+                         ['4', '3', '2'])
+        self.assertIsNone(page['newer'])
+
+    def test_cursor_pagination_walks_the_whole_feed(self):
+        ticket = Ticket.objects.create(title='0', user=self.bob)
+        for i in range(1, 7):
+            Review.objects.create(ticket=ticket, rating=3, user=self.bob,
+                                  headline=str(i))
+            Ticket.objects.create(title=str(i), user=self.alice)
+
+        seen = []
+        page = feed_page(self.alice, limit=4)
+        while True:
+            seen.extend(page['items'])
+            if not page['older']:
+                break
+            page = feed_page(self.alice, before=page['older'], limit=4)
+        self.assertEqual(seen, feed_page(self.alice, limit=20)['items'])
+
+        previous = feed_page(self.alice, after=page['newer'], limit=4)
+        self.assertEqual(previous['items'], seen[8:12])
+
+    def test_invalid_cursor_is_a_bad_request(self):
+        self.client.force_login(self.alice)
+
+        response = self.client.get(reverse('flux'), {'before': 'garbage'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_flux_view_renders_feed(self):
+        Ticket.objects.create(title='followed', user=self.bob)
+        self.client.force_login(self.alice)
+
+        response = self.client.get(reverse('flux'))
+        self.assertContains(response, 'followed')
+
+    def test_feed_fragment_is_cached_until_the_feed_changes(self):
+        self.client.force_login(self.alice)
+        self.client.get(reverse('flux'))
+
+        with self.assertNumQueries(2):
+            self.client.get(reverse('flux'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Ticket.objects.create(title='fresh', user=self.bob)
+        response = self.client.get(reverse('flux'))
+        self.assertContains(response, 'fresh')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            UserBlock.objects.create(user=self.alice, blocked_user=self.bob)
+        response = self.client.get(reverse('flux'))
+        self.assertNotContains(response, 'fresh')
+
+    def test_unchanged_feed_answers_conditional_get_with_304(self):
+        self.client.force_login(self.alice)
+        self.client.get(reverse('flux'))  # Pose le cookie CSRF.
+        response = self.client.get(reverse('flux'))
+        etag = response['ETag']
+
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('flux'),
+                                       HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Ticket.objects.create(title='fresh', user=self.bob)
+        response = self.client.get(reverse('flux'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    async def test_async_flux_matches_sync_flux(self):
+        await sync_to_async(Ticket.objects.create)(title='followed',
+                                                   user=self.bob)
+        await sync_to_async(self.client.force_login)(self.alice)
+        await sync_to_async(self.async_client.force_login)(self.alice)
+
+        response = await self.async_client.get(reverse('fluxasync'))
+        self.assertContains(response, 'followed')
+        cache.clear()
+        sync_response = await sync_to_async(self.client.get)(reverse('flux'))
+        csrf_token = re.compile(rb'value="[\w-]{64}"')
+        self.assertEqual(csrf_token.sub(b'', response.content),
+                         csrf_token.sub(b'', sync_response.content))
+
+        # La première réponse pose le cookie CSRF, qui entre dans l'ETag.
+        etag = (await self.async_client.get(reverse('fluxasync')))['ETag']
+        response = await self.async_client.get(
+            reverse('fluxasync'), headers={'if-none-match': etag})
+        self.assertEqual(response.status_code, 304)
+
+    async def test_async_follow_page_follows_user(self):
+        await sync_to_async(self.async_client.force_login)(self.alice)
+
+        response = await self.async_client.post(reverse('followUsersasync'),
+                                                {'username': 'carol'})
+        self.assertRedirects(response, reverse('followUsersasync'),
+                             fetch_redirect_response=False)
+        self.assertTrue(await UserFollows.objects.filter(
+            user=self.alice, followed_user=self.carol).aexists())
+        response = await self.async_client.get(reverse('followUsersasync'))
+        self.assertContains(response, 'carol')
+
+    def test_feed_render_query_count_does_not_grow_with_items(self):
+        self.client.force_login(self.alice)
+
+        def count_queries():
+            cache.clear()
+            with CaptureQueriesContext(connection) as context:
+                self.client.get(reverse('flux'))
+            return len(context.captured_queries)
+
+        ticket = Ticket.objects.create(title='first', user=self.bob)
+        Review.objects.create(ticket=ticket, rating=2, user=self.bob,
+                              headline='first')
+        baseline = count_queries()
+        for i in range(10):
+            ticket = Ticket.objects.create(title=str(i), user=self.bob)
+            Review.objects.create(ticket=ticket, rating=2, user=self.alice,
+                                  headline=str(i))
+        self.assertEqual(count_queries(), baseline)
+
+
+class FeedApiTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.alice = User.objects.create_user('alice')
+        self.bob = User.objects.create_user('bob')
+        UserFollows.objects.create(user=self.alice, followed_user=self.bob)
+        self.client.force_login(self.alice)
+
+    def get(self, **params):
+        return self.client.get(reverse('fluxapi'), params)
+
+    def test_api_lists_feed_items_with_cursor_pagination(self):
+        ticket = Ticket.objects.create(title='Livre', user=self.bob)
+        review = Review.objects.create(ticket=ticket, rating=4,
+                                       headline='Bien', user=self.alice)
+        Ticket.objects.create(title='Autre', user=self.alice)
+
+        response = self.get(limit=2)
+
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertTrue(response.has_header('ETag'))
+        page = json.loads(response.content)
+        self.assertEqual([(item['kind'], item.get('title', item.get(
+                              'headline'))) for item in page['items']],
+                         [('ticket', 'Autre'), ('review', 'Bien')])
+        self.assertEqual(page['items'][1], {
+            'kind': 'review', 'id': review.id,
+            'time_created': review.time_created.isoformat(),
+            'user': 'alice', 'ticket': ticket.id, 'ticket_title': 'Livre',
+            'ticket_user': 'bob', 'rating': 4, 'headline': 'Bien',
+            'body': ''})
+        self.assertIsNone(page['newer'])
+
+        older = json.loads(self.get(before=page['older']).content)
+        self.assertEqual([item['id'] for item in older['items']],
+                         [ticket.id])
+        self.assertTrue(older['items'][0]['has_review'])
+        self.assertIsNone(older['items'][0]['image'])
+        self.assertIsNone(older['older'])
+
+    def test_anonymous_client_gets_401_in_json(self):
+        self.client.logout()
+
+        response = self.get()
+
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertEqual(json.loads(response.content),
+                         {'error': 'Authentification requise.'})
+
+    def test_fields_limit_the_columns_read(self):
+        Ticket.objects.create(title='Livre', description='x' * 100,
+                              user=self.bob)
+
+        self.client.get(reverse('fluxapi'))
+        reset_queries()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.get(fields='title,user')
+        sql = ' '.join(query['sql'] for query in queries)
+
+        self.assertEqual(json.loads(response.content)['items'][0].keys(),
+                         {'kind', 'id', 'title', 'user'})
+        self.assertNotIn('description', sql)
+        self.assertNotIn('EXISTS', sql)
+
+    def test_invalid_parameters_are_rejected(self):
+        self.assertEqual(self.get(fields='title,password').status_code, 400)
+        self.assertEqual(self.get(limit='0').status_code, 400)
+        self.assertEqual(self.get(limit='1000').status_code, 400)
+        self.assertEqual(self.get(before='!!').status_code, 400)
+
+    def test_dumps_is_compact(self):
+        moment = datetime(2024, 5, 1, 12, 30, tzinfo=timezone.utc)
+        self.assertEqual(json.loads(api.dumps({'a': [1, 'é'],
+                                               'at': moment})),
+                         {'a': [1, 'é'], 'at': '2024-05-01T12:30:00+00:00'})
+        self.assertNotIn(b' ', api.dumps({'a': [1, 2]}))
+
+
+class FeedEntryTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.alice = User.objects.create_user('alice')
+        self.bob = User.objects.create_user('bob')
+        self.carol = User.objects.create_user('carol')
+        ticket = Ticket.objects.create(title='bob', user=self.bob)
+        Review.objects.create(ticket=ticket, rating=5, user=self.carol,
+                              headline='carol on bob')
+        Ticket.objects.create(title='carol', user=self.carol)
+
+    def assertTimelineMatchesRules(self, user):
+        expected = merged_entries(visible_tickets(user), visible_reviews(user),
+                                  limit=100)
+        self.assertEqual(timeline_entries(user, limit=100), expected)
+
+    def test_follow_unfollow_and_block_keep_the_timeline_in_sync(self):
+        follow = UserFollows.objects.create(user=self.alice,
+                                            followed_user=self.bob)
+        self.assertEqual(len(timeline_entries(self.alice)), 2)
+        self.assertTimelineMatchesRules(self.alice)
+
+        block = UserBlock.objects.create(user=self.alice,
+                                         blocked_user=self.carol)
+        self.assertTimelineMatchesRules(self.alice)
+        block.delete()
+        self.assertTimelineMatchesRules(self.alice)
+
+        follow.delete()
+        self.assertEqual(timeline_entries(self.alice), [])
+
+    def test_deleted_items_leave_every_timeline(self):
+        UserFollows.objects.create(user=self.alice, followed_user=self.bob)
+        Ticket.objects.filter(user=self.bob).delete()
+
+        self.assertFalse(FeedEntry.objects.filter(owner=self.alice).exists())
+
+    def test_deleting_a_user_with_follows_and_blocks(self):
+        UserFollows.objects.create(user=self.alice, followed_user=self.bob)
+        UserBlock.objects.create(user=self.alice, blocked_user=self.carol)
+        self.alice.delete()
+
+        self.assertFalse(FeedEntry.objects.filter(
+            owner_id=self.alice.id).exists())
+
+    def test_rebuild_feed_command_restores_every_timeline(self):
+        UserFollows.objects.create(user=self.alice, followed_user=self.bob)
+        FeedEntry.objects.all().delete()
+
+        call_command('rebuild_feed', stdout=StringIO())
+        for user in (self.alice, self.bob, self.carol):
+            self.assertTimelineMatchesRules(user)
+
+    def test_feed_version_expires(self):
+        with override_settings(FEED_VERSION_TIMEOUT=60):
+            version = feed_version(self.alice.id)
+        with mock.patch('django.core.cache.backends.locmem.time.time',
+                        return_value=time.time() + 61):
+            self.assertNotEqual(feed_version(self.alice.id), version)
+
+    def test_rebuild_feed_changes_feed_version(self):
+        bump_feed_versions([self.alice.id])
+        version = cache.get(FEED_VERSION_KEY.format(self.alice.id))
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('rebuild_feed', 'alice', stdout=StringIO())
+        self.assertNotEqual(cache.get(FEED_VERSION_KEY.format(self.alice.id)),
+                            version)
+
+
+@unittest.skipUnless(connection.vendor == 'sqlite',
+                     "Les plans d'exécution sont lus au format SQLite.")
+class FeedQueryPlanTestCase(TestCase):
+    """
+    Vérifie avec EXPLAIN QUERY PLAN que chaque requête du flux passe par un
+    index plutôt que par un parcours complet de table (SCAN).
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('alice')
+        self.cursor = (datetime.now(timezone.utc), 'ticket', 1)
+
+    def assertUsesIndexes(self, queryset):
+        plan = queryset.explain()
+        scans = re.findall(r'\bSCAN \w+.*', plan)
+        self.assertFalse(scans, 'Parcours complet dans :\n' + plan)
+
+    def test_timeline_reads_use_indexes(self):
+        self.assertUsesIndexes(timeline_queryset(self.user))
+        self.assertUsesIndexes(timeline_queryset(self.user,
+                                                 before=self.cursor))
+        self.assertUsesIndexes(timeline_queryset(self.user,
+                                                 after=self.cursor))
+
+    def test_posts_union_uses_indexes(self):
+        tickets = Ticket.objects.filter(user=self.user)
+        reviews = Review.objects.filter(user=self.user)
+        self.assertUsesIndexes(merged_queryset(tickets, reviews))
+        self.assertUsesIndexes(merged_queryset(tickets, reviews,
+                                               before=self.cursor))
+
+    def test_visibility_rules_use_indexes(self):
+        self.assertUsesIndexes(visible_tickets(self.user))
+        self.assertUsesIndexes(visible_reviews(self.user))
+        self.assertUsesIndexes(merged_queryset(visible_tickets(self.user),
+                                               visible_reviews(self.user)))
+
+    def test_hydration_uses_indexes(self):
+        self.assertUsesIndexes(feed_tickets().filter(id__in=[1, 2]))
+        self.assertUsesIndexes(feed_reviews().filter(id__in=[1, 2]))
+
+    def test_username_prefix_lookup_uses_index(self):
+        self.assertUsesIndexes(users_with_prefix('al').exclude(
+            pk=self.user.pk)[:10])
+
+    def test_follow_and_block_lookups_use_indexes(self):
+        for queryset in (
+            UserFollows.objects.filter(user=self.user),
+            UserFollows.objects.filter(followed_user=self.user),
+            UserBlock.objects.filter(user=self.user),
+            UserBlock.objects.filter(blocked_user=self.user),
+            FeedEntry.objects.filter(item_type='ticket', item_id=1),
+        ):
+            self.assertUsesIndexes(queryset)
+
+
+def make_jpeg(width, height, orientation=None):
+    image = Image.new('RGB', (width, height), 'orange')
+    exif = Image.Exif()
+    if orientation:
+        exif[0x0112] = orientation
+    buffer = BytesIO()
+    image.save(buffer, 'JPEG', exif=exif)
+    return buffer.getvalue()
+
+
+class TempMediaRootMixin:
+    """
+    Fait écrire les fichiers envoyés dans un MEDIA_ROOT temporaire, supprimé
+    après le test, et génère les vignettes sans attendre.
+    """
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        media_settings = override_settings(MEDIA_ROOT=self.media_root,
+                                           THUMBNAIL_ASYNC=False)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+
+
+class ThumbnailTestCase(TempMediaRootMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('alice')
+        self.client.force_login(self.user)
+
+    def create_ticket(self, content):
+        upload = SimpleUploadedFile('cover.jpg', content, 'image/jpeg')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('ticketcreation'), {
+                'title': 'cover', 'description': '', 'image': upload})
+        return Ticket.objects.get(title='cover')
+
+    def test_upload_produces_webp_and_jpeg_variants(self):
+        ticket = self.create_ticket(make_jpeg(800, 600))
+
+        self.assertEqual([width for width, _ in ticket.thumbnails['webp']],
+                         [150, 300, 600])
+        for extension, format in (('webp', 'WEBP'), ('jpeg', 'JPEG')):
+            for width, name in ticket.thumbnails[extension]:
+                with Image.open(default_storage.path(name)) as thumbnail:
+                    self.assertEqual(thumbnail.format, format)
+                    self.assertEqual(thumbnail.width, width)
+
+        cache.clear()
+        response = self.client.get(reverse('flux'))
+        self.assertContains(response, '-300.webp 300w')
+
+    def test_exif_orientation_is_applied(self):
+        ticket = self.create_ticket(make_jpeg(400, 200, orientation=6))
+
+        width, name = ticket.thumbnails['jpeg'][0]
+        with Image.open(default_storage.path(name)) as thumbnail:
+            self.assertEqual(thumbnail.size, (150, 300))
+
+
+class TicketImageUploadTestCase(TempMediaRootMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(User.objects.create_user('alice'))
+
+    def post_image(self, content, name='cover.jpg'):
+        upload = SimpleUploadedFile(name, content, 'image/jpeg')
+        return self.client.post(reverse('ticketcreation'), {
+            'title': 'cover', 'description': '', 'image': upload})
+
+    def test_valid_image_is_accepted(self):
+        response = self.post_image(make_jpeg(64, 64))
+
+        self.assertRedirects(response, reverse('flux'))
+        self.assertTrue(Ticket.objects.get().image)
+
+    @override_settings(TICKET_IMAGE_MAX_SIZE=1024)
+    def test_oversized_file_is_rejected(self):
+        response = self.post_image(b'\xff' * 4096)
+
+        self.assertContains(response, 'Le fichier dépasse')
+        self.assertFalse(Ticket.objects.exists())
+
+    @override_settings(TICKET_IMAGE_MAX_SIZE=1024,
+                       DATA_UPLOAD_MAX_MEMORY_SIZE=1024)
+    def test_oversized_request_is_rejected_before_csrf_check(self):
+        self.client = Client(enforce_csrf_checks=True)
+        self.client.force_login(User.objects.get(username='alice'))
+        self.client.get(reverse('ticketcreation'))
+        token = self.client.cookies[settings.CSRF_COOKIE_NAME].value
+
+        def post(content):
+            return self.client.post(reverse('ticketcreation'), {
+                'csrfmiddlewaretoken': token, 'title': 'cover',
+                'description': '', 'image': SimpleUploadedFile(
+                    'cover.jpg', content, 'image/jpeg')})
+
+        response = post(b'\xff' * 4096)
+        self.assertEqual(response.status_code, 413)
+        self.assertContains(response, 'trop volumineuse', status_code=413)
+        self.assertRedirects(post(make_jpeg(16, 16)), reverse('flux'))
+        self.assertEqual(Ticket.objects.count(), 1)
+
+    @override_settings(TICKET_IMAGE_MAX_PIXELS=100 * 100)
+    def test_too_many_pixels_is_rejected_from_the_header(self):
+        response = self.post_image(make_jpeg(200, 200))
+
+        self.assertContains(response, "trop grande (200 x 200 pixels)")
+        self.assertFalse(Ticket.objects.exists())
+
+    def test_non_image_is_rejected(self):
+        response = self.post_image(b'not an image', name='cover.txt')
+
+        self.assertContains(response, "pas une image valide")
+        self.assertFalse(Ticket.objects.exists())
+
+
+class ContentAddressedStorageTestCase(TempMediaRootMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.alice = User.objects.create_user('alice')
+        self.bob = User.objects.create_user('bob')
+
+    def test_same_cover_is_stored_once(self):
+        content = make_jpeg(64, 64)
+        for user, name in ((self.alice, 'cover.jpg'), (self.bob, 'x.JPG')):
+            Ticket.objects.create(
+                title=name, user=user,
+                image=SimpleUploadedFile(name, content, 'image/jpeg'))
+
+        names = set(Ticket.objects.values_list('image', flat=True))
+        self.assertEqual(len(names), 1)
+        self.assertRegex(names.pop(), r'^cas/\w\w/\w\w/\w{64}\.jpg$')
+
+    def test_migrate_media_to_cas_rewrites_references(self):
+        original = default_storage.save('cover.jpg',
+                                        BytesIO(make_jpeg(64, 64)))
+        for user in (self.alice, self.bob):
+            Ticket.objects.create(title='cover', user=user)
+        Ticket.objects.update(image=original)
+        User.objects.filter(id=self.alice.id).update(profile_photo=original)
+        bump_feed_versions([self.alice.id, self.bob.id])
+        versions = cache.get_many([FEED_VERSION_KEY.format(user.id)
+                                   for user in (self.alice, self.bob)])
+
+        call_command('migrate_media_to_cas', '--delete-originals',
+                     stdout=StringIO())
+
+        for key, version in versions.items():
+            self.assertNotEqual(cache.get(key), version)
+
+        ticket_names = set(Ticket.objects.values_list('image', flat=True))
+        self.assertEqual(len(ticket_names), 1)
+        self.assertTrue(ticket_names.pop().startswith('cas/'))
+        self.alice.refresh_from_db()
+        self.assertTrue(self.alice.profile_photo.name.startswith('cas/'))
+        self.assertFalse(default_storage.exists(original))
+
+
+class SearchTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.alice = User.objects.create_user('alice')
+        self.bob = User.objects.create_user('bob')
+        self.carol = User.objects.create_user('carol')
+
+    def results(self, query, user=None):
+        return [(entry['kind'], entry['id'])
+                for entry in search(user or self.alice, query)]
+
+    def test_index_follows_writes(self):
+        ticket = Ticket.objects.create(title='Les Misérables', user=self.bob)
+        review = Review.objects.create(ticket=ticket, user=self.carol,
+                                       rating=4, headline='Un classique',
+                                       body='Hugo au sommet.')
+
+        self.assertEqual(self.results('miserables'), [('ticket', ticket.id)])
+        self.assertEqual(self.results('hugo'), [('review', review.id)])
+        ticket.title = 'Notre-Dame de Paris'
+        ticket.save()
+        self.assertEqual(self.results('misérables'), [])
+        self.assertEqual(self.results('notre dam'), [('ticket', ticket.id)])
+        ticket.delete()
+        self.assertEqual(self.results('hugo'), [])
+
+    def test_ranking_prefers_title_matches_then_recent_items(self):
+        body_match = Ticket.objects.create(title='Roman',
+                                           description='Dune', user=self.bob)
+        old = Ticket.objects.create(title='Dune', user=self.bob)
+        old.time_created = datetime(2020, 1, 1, tzinfo=timezone.utc)
+        old.save()
+        recent = Ticket.objects.create(title='Dune', user=self.bob)
+
+        self.assertEqual(self.results('dune'), [
+            ('ticket', recent.id), ('ticket', old.id),
+            ('ticket', body_match.id)])
+
+    def test_blocked_users_are_excluded_both_ways(self):
+        own = Ticket.objects.create(title='Dune', user=self.alice)
+        Ticket.objects.create(title='Dune', user=self.bob)
+        Ticket.objects.create(title='Dune', user=self.carol)
+        UserBlock.objects.create(user=self.alice, blocked_user=self.bob)
+        UserBlock.objects.create(user=self.carol, blocked_user=self.alice)
+
+        self.assertEqual(self.results('dune'), [('ticket', own.id)])
+        for user in (self.bob, self.carol):
+            self.assertNotIn(('ticket', own.id),
+                             self.results('dune', user=user))
+
+    def test_query_syntax_is_not_interpreted(self):
+        Ticket.objects.create(title='Dune', user=self.bob)
+
+        self.assertEqual(self.results('"dune" OR NEAR(*'), [])
+        self.assertEqual(len(self.results('dune*"')), 1)
+        self.assertEqual(self.results('  '), [])
+
+    @override_settings(SEARCH_BACKEND='application.search.'
+                       'DatabaseSearchBackend')
+    def test_database_backend(self):
+        ticket = Ticket.objects.create(title='Dune', user=self.bob)
+        Ticket.objects.create(title='Dune', user=self.carol)
+        UserBlock.objects.create(user=self.alice, blocked_user=self.carol)
+
+        self.assertEqual(self.results('dun'), [('ticket', ticket.id)])
+
+    def test_search_view(self):
+        for index in range(SEARCH_PAGE_SIZE + 1):
+            Ticket.objects.create(title='Dune {}'.format(index),
+                                  user=self.bob)
+        self.client.force_login(self.alice)
+
+        response = self.client.get(reverse('search'), {'q': 'dune'})
+        self.assertContains(response, 'Dune', count=SEARCH_PAGE_SIZE)
+        self.assertContains(response, 'page=2')
+        response = self.client.get(reverse('search'),
+                                   {'q': 'dune', 'page': 2})
+        self.assertContains(response, 'Dune', count=1)
+        response = self.client.get(reverse('search'),
+                                   {'q': 'dune', 'page': 'x'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_rebuild_search_index(self):
+        ticket = Ticket.objects.create(title='Dune', user=self.bob)
+        Ticket.objects.filter(id=ticket.id).update(title='Hyperion')
+
+        call_command('rebuild_search_index', stdout=StringIO())
+
+        self.assertEqual(self.results('hyperion'), [('ticket', ticket.id)])
+
+
+class FollowTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.alice = User.objects.create_user('alice')
+        for username in ('albert', 'alfred', 'bob', 'Alain'):
+            User.objects.create_user(username)
+        self.client.force_login(self.alice)
+
+    def test_typeahead_suggests_usernames_by_prefix(self):
+        response = self.client.get(reverse('userTypeahead'), {'q': 'al'})
+        self.assertEqual(response.json(), {'usernames': ['albert', 'alfred']})
+        response = self.client.get(reverse('userTypeahead'), {'q': ''})
+        self.assertEqual(response.json(), {'usernames': []})
+
+    def test_follow_resolves_user_once(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('followUsers'),
+                                        {'username': 'bob'})
+        lookups = [query['sql'] for query in queries.captured_queries
+                   if '"username" = ' in query['sql']]
+        self.assertEqual(len(lookups), 1)
+        self.assertRedirects(response, reverse('followUsers'))
+        self.assertTrue(UserFollows.objects.filter(
+            user=self.alice, followed_user__username='bob').exists())
+
+    def test_follow_unknown_or_followed_user(self):
+        response = self.client.post(reverse('followUsers'),
+                                    {'username': 'nobody'})
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(UserFollows.objects.exists())
+        self.client.post(reverse('followUsers'), {'username': 'bob'})
+        response = self.client.post(reverse('followUsers'),
+                                    {'username': 'bob'})
+        self.assertContains(response, 'Vous êtes déjà abonné')
+
+
+class GraphTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.alice = User.objects.create_user('alice')
+        self.bob = User.objects.create_user('bob')
+        self.carol = User.objects.create_user('carol')
+        UserFollows.objects.create(user=self.alice, followed_user=self.bob)
+        UserFollows.objects.create(user=self.carol, followed_user=self.bob)
+
+    def test_relations_are_cached_sorted_arrays(self):
+        with self.assertNumQueries(2):
+            self.assertEqual(graph.degree(self.bob.id),
+                             {'following': 0, 'followers': 2})
+        with self.assertNumQueries(0):
+            self.assertEqual(list(graph.followers(self.bob.id)),
+                             [self.alice.id, self.carol.id])
+            self.assertEqual(graph.degree(self.bob.id)['followers'], 2)
+
+    def test_writes_invalidate_both_users(self):
+        self.assertFalse(graph.is_mutual(self.alice.id, self.bob.id))
+        self.assertFalse(graph.is_blocked(self.alice.id, self.bob.id))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            UserFollows.objects.create(user=self.bob, followed_user=self.alice)
+        self.assertTrue(graph.is_mutual(self.alice.id, self.bob.id))
+        self.assertTrue(graph.is_mutual(self.bob.id, self.alice.id))
+        with self.captureOnCommitCallbacks(execute=True):
+            UserBlock.objects.create(user=self.bob, blocked_user=self.alice)
+        self.assertTrue(graph.is_blocked(self.alice.id, self.bob.id))
+        self.assertTrue(graph.is_blocked(self.bob.id, self.alice.id))
+        with self.captureOnCommitCallbacks(execute=True):
+            UserFollows.objects.filter(user=self.alice).delete()
+        self.assertEqual(len(graph.following(self.alice.id)), 0)
+
+    def test_rolled_back_writes_leave_cache_untouched(self):
+        self.assertEqual(len(graph.followers(self.alice.id)), 0)
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            with self.assertRaises(RuntimeError), transaction.atomic():
+                UserFollows.objects.create(user=self.bob,
+                                           followed_user=self.alice)
+                self.assertEqual(len(graph.followers(self.alice.id)), 0)
+                raise RuntimeError
+        self.assertEqual(callbacks, [])
+        self.assertEqual(len(graph.followers(self.alice.id)), 0)
+
+    def test_fan_out_ignores_stale_cache(self):
+        # Cache d'un autre processus, antérieur à l'abonnement de bob.
+        graph.followers(self.alice.id)
+        UserFollows.objects.bulk_create(
+            [UserFollows(user=self.bob, followed_user=self.alice)])
+        ticket = Ticket.objects.create(title='Livre', user=self.alice)
+        self.assertTrue(FeedEntry.objects.filter(
+            owner=self.bob, item_type='ticket', item_id=ticket.id).exists())
+
+    def test_follow_page_marks_mutual_follows(self):
+        UserFollows.objects.create(user=self.bob, followed_user=self.carol)
+        self.client.force_login(self.bob)
+
+        response = self.client.get(reverse('followUsers'))
+        self.assertContains(response, 'abonnement mutuel', count=1)
+
+
+class FollowSuggestionTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.alice, self.bob, self.carol, self.dave, self.erin = [
+            User.objects.create_user(name)
+            for name in ('alice', 'bob', 'carol', 'dave', 'erin')]
+        for user, followed in ((self.alice, self.bob), (self.alice, self.erin),
+                               (self.bob, self.carol), (self.bob, self.dave),
+                               (self.bob, self.erin), (self.erin, self.carol)):
+            UserFollows.objects.create(user=user, followed_user=followed)
+        Ticket.objects.create(title='Dune', user=self.dave)
+        UserBlock.objects.create(user=self.erin, blocked_user=self.alice)
+
+    def suggested(self, user):
+        return [(suggestion.suggested_user.username, suggestion.mutual_count)
+                for suggestion in follow_suggestions(user)]
+
+    def test_friends_of_friends_ranked_by_overlap_then_activity(self):
+        self.assertEqual(compute_suggestions(), 5)
+
+        # erin est suivie mais bloque alice ; carol est suivie par bob et
+        # erin, dave seulement par bob mais a publié récemment.
+        self.assertEqual(self.suggested(self.alice),
+                         [('carol', 2), ('dave', 1)])
+        self.assertEqual(self.suggested(self.erin), [])
+        self.assertFalse(StaleFollowSuggestions.objects.exists())
+
+    def test_incremental_run_only_recomputes_stale_users(self):
+        compute_suggestions()
+        UserFollows.objects.create(user=self.carol, followed_user=self.dave)
+        self.assertEqual(set(StaleFollowSuggestions.objects.values_list(
+            'user_id', flat=True)), {self.carol.id, self.dave.id})
+
+        call_command('compute_follow_suggestions', stdout=StringIO())
+
+        self.assertFalse(StaleFollowSuggestions.objects.exists())
+        self.assertEqual(self.suggested(self.erin), [('dave', 1)])
+
+    def test_follow_page_reads_suggestions_in_one_query(self):
+        compute_suggestions()
+        UserFollows.objects.create(user=self.alice, followed_user=self.dave)
+        self.client.force_login(self.alice)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('followUsers'))
+        reads = [query for query in queries.captured_queries
+                 if 'application_followsuggestion' in query['sql']]
+        self.assertEqual(len(reads), 1)
+        self.assertContains(response, '2 abonnements en commun')
+        self.assertNotContains(response, '1 abonnement en commun')
+
+
+class TransferTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.alice = User.objects.create_user('alice')
+        self.bob = User.objects.create_user('bob')
+        UserFollows.objects.create(user=self.bob, followed_user=self.alice)
+        self.ticket = Ticket.objects.create(title='Dune', user=self.alice,
+                                            description='Frank Herbert')
+        self.review = Review.objects.create(ticket=self.ticket, user=self.bob,
+                                            rating=5, headline='Épique')
+        self.old = datetime(2020, 5, 1, 12, 30, tzinfo=timezone.utc)
+        Ticket.objects.update(time_created=self.old)
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def round_trip(self, extension):
+        path = '{}/posts.{}'.format(self.directory, extension)
+        call_command('export_posts', path, stderr=StringIO())
+        Ticket.objects.all().delete()
+        self.assertFalse(FeedEntry.objects.exists())
+
+        call_command('import_posts', path, stdout=StringIO(),
+                     stderr=StringIO())
+
+        ticket = Ticket.objects.get()
+        self.assertEqual((ticket.id, ticket.title, ticket.description,
+                          ticket.time_created),
+                         (self.ticket.id, 'Dune', 'Frank Herbert', self.old))
+        review = Review.objects.get()
+        self.assertEqual((review.id, review.ticket_id, review.rating,
+                          review.headline, review.time_created),
+                         (self.review.id, ticket.id, 5, 'Épique',
+                          self.review.time_created))
+        self.assertEqual(FeedEntry.objects.filter(owner=self.bob).count(), 2)
+        self.assertEqual(len(search(self.bob, 'herbert')), 1)
+
+    def test_jsonl_round_trip(self):
+        self.round_trip('jsonl')
+
+    def test_csv_round_trip(self):
+        self.round_trip('csv')
+
+    def test_invalid_lines_are_reported_and_skipped(self):
+        path = '{}/posts.jsonl'.format(self.directory)
+        with open(path, 'w') as file:
+            file.write('{"type": "ticket", "user": "alice", "title": "Ok", '
+                       '"time_created": "2021-01-01T00:00:00+00:00"}\n'
+                       'pas du json\n'
+                       '{"type": "ticket", "user": "nobody", "title": "X", '
+                       '"time_created": "2021-01-01T00:00:00+00:00"}\n'
+                       '{"type": "review", "ticket": 999, "user": "bob", '
+                       '"rating": 3, "headline": "X", '
+                       '"time_created": "2021-01-01T00:00:00+00:00"}\n')
+        errors = StringIO()
+
+        call_command('import_posts', path, '--skip-rebuild',
+                     stdout=StringIO(), stderr=errors)
+
+        self.assertTrue(Ticket.objects.filter(title='Ok').exists())
+        self.assertEqual(Ticket.objects.count(), 2)
+        self.assertEqual(Review.objects.count(), 1)
+        self.assertIn('Ligne 2 ignorée', errors.getvalue())
+        self.assertIn('utilisateur inconnu : nobody', errors.getvalue())
+        self.assertIn('ticket 999 inconnu', errors.getvalue())
+
+    def test_invalid_fields_are_reported_with_line_number(self):
+        path = '{}/posts.jsonl'.format(self.directory)
+        date = '"time_created": "2021-01-01T00:00:00+00:00"'
+        with open(path, 'w') as file:
+            file.write(
+                '{"type": "ticket", "user": "alice", "title": "%s", %s}\n'
+                '{"type": "ticket", "user": "alice", "title": "", %s}\n'
+                '{"type": "ticket", "user": "alice", "title": "Ok", '
+                '"description": "%s", %s}\n'
+                '{"type": "review", "ticket": %d, "user": "bob", '
+                '"rating": 7, "headline": "X", %s}\n'
+                % ('x' * 129, date, date, 'x' * 2049, date, self.ticket.id,
+                   date))
+        errors = StringIO()
+
+        call_command('import_posts', path, '--skip-rebuild',
+                     stdout=StringIO(), stderr=errors)
+
+        self.assertEqual(Ticket.objects.count(), 1)
+        self.assertEqual(Review.objects.count(), 1)
+        for number, field in enumerate(
+                ['title', 'title', 'description', 'rating'], start=1):
+            self.assertRegex(errors.getvalue(),
+                             'Ligne {} ignorée : {} :'.format(number, field))
+
+    def test_import_changes_feed_versions(self):
+        path = '{}/posts.jsonl'.format(self.directory)
+        call_command('export_posts', path, stderr=StringIO())
+        Ticket.objects.all().delete()
+        bump_feed_versions([self.alice.id, self.bob.id])
+        keys = [FEED_VERSION_KEY.format(user.id)
+                for user in (self.alice, self.bob)]
+        versions = cache.get_many(keys)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('import_posts', path, stdout=StringIO(),
+                         stderr=StringIO())
+
+        for key in keys:
+            self.assertNotEqual(cache.get(key), versions[key])
+
+
+class BenchmarkTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_seed_and_measure_every_scenario(self):
+        ids = benchmark.seed(users=6, follows=2, blocks=1, tickets=2,
+                             reviews=1)
+        self.assertEqual(len(ids), 6)
+        self.assertEqual(Ticket.objects.count(), 12)
+        self.assertTrue(FeedEntry.objects.exists())
+
+        results = benchmark.measure(User.objects.get(id=ids[0]), requests=2)
+
+        self.assertEqual(set(results), {
+            'flux', 'flux_page_2', 'flux_api', 'fluxperso', 'follow_page',
+            'follow_user', 'ticket_creation', 'ticket_review_creation',
+            'review_creation'})
+        for result in results.values():
+            self.assertGreater(result['queries'], 0)
+            self.assertGreater(result['peak_kib'], 0)
+            self.assertLessEqual(result['p50_ms'], result['p99_ms'])
+
+    def test_regressions_against_baseline(self):
+        reference = {'queries': 5, 'p50_ms': 10.0, 'p95_ms': 20.0,
+                     'p99_ms': 30.0, 'peak_kib': 100.0}
+        baseline = {'flux': reference}
+
+        self.assertEqual(benchmark.regressions(
+            {'flux': dict(reference, p50_ms=12.0), 'new': reference},
+            baseline), [])
+        problems = benchmark.regressions(
+            {'flux': dict(reference, queries=6, p50_ms=13.0)}, baseline)
+        self.assertEqual(len(problems), 2)
+        self.assertIn('6 requêtes SQL au lieu de 5', problems[0])
+
+
+@override_settings(MIDDLEWARE=['litrevu.metrics.MetricsMiddleware',
+                               *settings.MIDDLEWARE],
+                   METRICS_TOKEN='secret')
+class MetricsTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        metrics.registry.reset()
+        self.alice = User.objects.create_user('alice')
+        self.client.force_login(self.alice)
+
+    def test_request_is_measured(self):
+        Ticket.objects.create(title='Livre', user=self.alice)
+
+        response = self.client.get(reverse('flux'))
+
+        self.assertRegex(response['Server-Timing'],
+                         r'^db;dur=[\d.]+;desc="\d+ requêtes SQL, \d+ '
+                         r'répétées", tpl;dur=[\d.]+, total;dur=[\d.]+$')
+        text = metrics.registry.render()
+        self.assertIn('litrevu_request_duration_seconds_count{view="flux"} 1',
+                      text)
+        self.assertRegex(text, r'litrevu_sql_queries_total\{view="flux"\} '
+                               r'[1-9]')
+        self.assertRegex(text, r'litrevu_template_render_seconds_total'
+                               r'\{view="flux"\} 0\.\d*[1-9]')
+
+    def test_repeated_queries_are_counted_and_logged(self):
+        stats = metrics.RequestStats()
+        for ids in ([1], [1, 2], [3, 4, 5]):
+            stats.record_query(lambda *args: None,
+                               'SELECT 1 WHERE id IN ({})'.format(
+                                   ', '.join(['%s'] * len(ids))),
+                               ids, False, {})
+        stats.record_query(lambda *args: None, 'SELECT 2', [], False, {})
+        self.assertEqual(stats.queries, 4)
+        self.assertEqual(stats.duplicates(), 2)
+
+        def view(request):
+            for user_id in range(3):
+                User.objects.filter(id=user_id).exists()
+            return HttpResponse()
+
+        request = RequestFactory().get('/n-plus-un/')
+        request.resolver_match = None
+        with override_settings(METRICS_DUPLICATE_THRESHOLD=2), \
+                self.assertLogs('litrevu.metrics', 'WARNING') as logs:
+            response = metrics.MetricsMiddleware(view)(request)
+        self.assertIn('2 requêtes SQL répétées sur 3', logs.output[0])
+        self.assertIn('3 requêtes SQL, 2 répétées',
+                      response['Server-Timing'])
+
+    def test_metrics_endpoint_requires_staff_or_token(self):
+        self.client.get(reverse('flux'))
+        self.client.logout()
+
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+        self.assertEqual(self.client.get(
+            reverse('metrics'), HTTP_AUTHORIZATION='Bearer wrong'
+        ).status_code, 403)
+        response = self.client.get(reverse('metrics'),
+                                   HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'litrevu_request_sql_queries_bucket', response.content)
+
+        self.alice.is_staff = True
+        self.alice.save()
+        self.client.force_login(self.alice)
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 200)
+
+
+class SqliteProductionTestCase(TestCase):
+
+    PRAGMAS = {'journal_mode': 'wal', 'synchronous': 'normal',
+               'busy_timeout': 5000, 'cache_size': -2048}
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.path = Path(self.directory, 'db.sqlite3')
+        sqlite3.connect(self.path).close()
+
+    def open(self, name):
+        wrapper = connections['default'].__class__(
+            {**connections['default'].settings_dict, 'NAME': name}, 'tmp')
+        wrapper.ensure_connection()
+        self.addCleanup(wrapper.close)
+        return wrapper.connection
+
+    def pragma(self, raw, name):
+        return raw.execute('PRAGMA {}'.format(name)).fetchone()[0]
+
+    @override_settings(SQLITE_PRAGMAS=PRAGMAS)
+    def test_pragmas_applied_on_connect(self):
+        raw = self.open(str(self.path))
+        self.assertEqual(self.pragma(raw, 'journal_mode'), 'wal')
+        self.assertEqual(self.pragma(raw, 'synchronous'), 1)
+        self.assertEqual(self.pragma(raw, 'busy_timeout'), 5000)
+        self.assertEqual(self.pragma(raw, 'cache_size'), -2048)
+        self.assertEqual(self.pragma(raw, 'query_only'), 0)
+
+        replica = self.open(self.path.as_uri() + '?mode=ro')
+        self.assertEqual(self.pragma(replica, 'query_only'), 1)
+        self.assertEqual(self.pragma(replica, 'busy_timeout'), 5000)
+        with self.assertRaises(sqlite3.OperationalError):
+            replica.execute('CREATE TABLE t (id INTEGER)')
+
+    @override_settings(SQLITE_PRAGMAS={})
+    def test_no_pragmas_without_production_mode(self):
+        raw = self.open(str(self.path))
+        self.assertEqual(self.pragma(raw, 'journal_mode'), 'delete')
+
+
+@override_settings(DATABASE_ROUTERS=['litrevu.database.ReplicaRouter'])
+class ReplicaRouterTestCase(TransactionTestCase):
+    # TestCase exécute chaque test dans une transaction, où le routeur
+    # garde toutes les lectures sur 'default'. Aucune requête n'est
+    # exécutée : QuerySet.db donne la base choisie par le routeur.
+
+    def read_database(self, request, unless=None):
+        @database.replica_reads(unless=unless)
+        def view(request):
+            return HttpResponse(Ticket.objects.all().db)
+
+        return view(request).content.decode()
+
+    def test_replica_reads_routes_safe_requests_to_replica(self):
+        factory = RequestFactory()
+        self.assertEqual(self.read_database(factory.get('/')),
+                         database.REPLICA)
+        self.assertEqual(Ticket.objects.all().db, 'default')
+        self.assertEqual(self.read_database(factory.post('/')), 'default')
+        self.assertEqual(self.read_database(
+            factory.get('/'), unless=lambda request: True), 'default')
+
+        sticky = factory.get('/')
+        sticky.COOKIES[database.STICKY_COOKIE] = '1'
+        self.assertEqual(self.read_database(sticky), 'default')
+
+        @database.replica_reads
+        def view(request):
+            with transaction.atomic():
+                return HttpResponse(Ticket.objects.all().db)
+        self.assertEqual(view(factory.get('/')).content, b'default')
+
+    def test_replica_reads_async_view(self):
+        @database.replica_reads
+        async def view(request):
+            return HttpResponse(await sync_to_async(
+                lambda: Ticket.objects.all().db)())
+
+        response = async_to_sync(view)(RequestFactory().get('/'))
+        self.assertEqual(response.content.decode(), database.REPLICA)
+
+    @override_settings(REPLICA_STICKY_SECONDS=10)
+    def test_writes_make_reads_sticky(self):
+        middleware = database.ReplicaStickinessMiddleware(
+            lambda request: HttpResponse())
+        factory = RequestFactory()
+
+        response = middleware(factory.post('/'))
+        self.assertEqual(response.cookies[database.STICKY_COOKIE]['max-age'],
+                         10)
+        self.assertNotIn(database.STICKY_COOKIE,
+                         middleware(factory.get('/')).cookies)
+        failed = database.ReplicaStickinessMiddleware(
+            lambda request: HttpResponse(status=400))
+        self.assertNotIn(database.STICKY_COOKIE,
+                         failed(factory.post('/')).cookies)
+
+    @override_settings(REPLICA_STICKY_SECONDS=10)
+    def test_recent_feed_changes_stay_on_primary(self):
+        cache.clear()
+        request = RequestFactory().get('/')
+        request.user = User(id=1)
+        bump_feed_versions([1])
+        self.assertTrue(feed_changed_recently(request))
+
+        cache.set(FEED_VERSION_KEY.format(1), time.time_ns() - 11 * 10**9)
+        self.assertFalse(feed_changed_recently(request))
+
+    def test_router_keeps_writes_and_migrations_on_default(self):
+        router = database.ReplicaRouter()
+        self.assertEqual(router.db_for_write(Ticket), 'default')
+        self.assertFalse(router.allow_migrate(database.REPLICA,
+                                              'application'))
+        self.assertTrue(router.allow_migrate('default', 'application'))
+
+
+class RecordingBroker:
+    # Courtier de remplacement : garde les messages publiés.
+
+    def __init__(self):
+        self.published = []
+
+    def publish(self, channel, message):
+        self.published.append((channel, message))
+
+
+@override_settings(EVENTS_BROKER='application.tests.RecordingBroker')
+class FeedEventsTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.alice = User.objects.create_user('alice')
+        self.bob = User.objects.create_user('bob')
+        self.carol = User.objects.create_user('carol')
+        UserFollows.objects.create(user=self.alice, followed_user=self.bob)
+        UserFollows.objects.create(user=self.carol, followed_user=self.bob)
+        UserBlock.objects.create(user=self.carol, blocked_user=self.bob)
+        events.broker().published.clear()
+
+    def test_new_items_are_announced_to_followers_on_commit(self):
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            ticket = Ticket.objects.create(title='Livre', user=self.bob)
+        self.assertEqual(events.broker().published, [])
+        for callback in callbacks:
+            callback()
+        self.assertEqual(events.broker().published, [
+            ('feed:{}'.format(self.alice.id),
+             {'kind': 'ticket', 'id': ticket.id, 'user': self.bob.id})])
+
+        events.broker().published.clear()
+        with self.captureOnCommitCallbacks(execute=True):
+            review = Review.objects.create(ticket=ticket, rating=3,
+                                           headline='Bof', user=self.alice)
+            ticket.title = 'Livre modifié'
+            ticket.save()
+        self.assertEqual(events.broker().published, [
+            ('feed:{}'.format(self.bob.id),
+             {'kind': 'review', 'id': review.id, 'user': self.alice.id})])
+
+    @override_settings(EVENTS_BROKER='application.events.LocalBroker',
+                       EVENTS_HEARTBEAT_SECONDS=0.05, EVENTS_MAX_SECONDS=1)
+    async def test_event_stream(self):
+        response = await self.async_client.get(reverse('fluxevents'))
+        self.assertEqual(response.status_code, 401)
+
+        await sync_to_async(self.async_client.force_login)(self.alice)
+        response = await self.async_client.get(reverse('fluxevents'))
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        chunks = aiter(response.streaming_content)
+        self.assertEqual(await anext(chunks), b'retry: 3000\n\n')
+
+        # Publication depuis un autre thread, comme depuis une vue.
+        await sync_to_async(events.notify_new_item, thread_sensitive=False)(
+            'ticket', 1, self.bob.id, [self.alice.id])
+        self.assertEqual(await anext(chunks),
+                         b'event: item\ndata: {"kind":"ticket","id":1,'
+                         b'"user":%d}\n\n' % self.bob.id)
+        self.assertEqual(await anext(chunks), b': keepalive\n\n')
+        rest = [chunk async for chunk in chunks]
+        self.assertTrue(all(chunk == b': keepalive\n\n' for chunk in rest))
+        self.assertEqual(events.broker()._subscribers, {})
+
+    def test_event_stream_is_refused_under_wsgi(self):
+        self.client.force_login(self.alice)
+        self.assertEqual(self.client.get(reverse('fluxevents')).status_code,
+                         204)
+
+    def test_local_broker_drops_messages_when_queue_is_full(self):
+        broker = events.LocalBroker()
+
+        async def receive():
+            async with broker.subscribe('feed:1') as queue:
+                for index in range(3):
+                    await sync_to_async(broker.publish)('feed:1', index)
+                broker.publish('feed:2', 'autre')
+                await asyncio.sleep(0)
+                return [queue.get_nowait() for _ in range(queue.qsize())]
+
+        with override_settings(EVENTS_QUEUE_SIZE=2):
+            self.assertEqual(async_to_sync(receive)(), [0, 1])
+        self.assertEqual(broker._subscribers, {})
+
+
+class TicketAggregatesTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.alice = User.objects.create_user('alice')
+        self.bob = User.objects.create_user('bob')
+        self.ticket = Ticket.objects.create(title='Livre', user=self.alice)
+
+    def aggregates(self, ticket=None):
+        ticket = ticket or self.ticket
+        return Ticket.objects.filter(id=ticket.id).values_list(
+            'review_count', 'rating_sum', 'last_reviewed_at').get()
+
+    def test_reviews_update_ticket_aggregates(self):
+        self.assertEqual(self.aggregates(), (0, 0, None))
+        first = Review.objects.create(ticket=self.ticket, rating=2,
+                                      headline='Bof', user=self.bob)
+        second = Review.objects.create(ticket=self.ticket, rating=5,
+                                       headline='Bien', user=self.alice)
+        self.assertEqual(self.aggregates(), (2, 7, second.time_created))
+
+        review = Review.objects.get(id=first.id)
+        review.rating = 4
+        review.save()
+        Review.objects.filter(id=first.id).get().save()
+        self.assertEqual(self.aggregates(), (2, 9, second.time_created))
+
+        Review(id=second.id, ticket=self.ticket, rating=1, headline='Bof',
+               user=self.alice, time_created=second.time_created).save()
+        self.assertEqual(self.aggregates()[:2], (2, 5))
+
+        Review.objects.get(id=second.id).delete()
+        self.assertEqual(self.aggregates(), (1, 4, first.time_created))
+        ticket = Ticket.objects.get(id=self.ticket.id)
+        self.assertTrue(ticket.has_review)
+        self.assertEqual(ticket.average_rating, 4)
+
+        other = Ticket.objects.create(title='Autre', user=self.bob)
+        review = Review.objects.get(id=first.id)
+        review.ticket = other
+        review.save()
+        self.assertEqual(self.aggregates(), (0, 0, None))
+        self.assertEqual(self.aggregates(other), (1, 4, first.time_created))
+
+    def test_deleting_a_ticket_with_reviews(self):
+        Review.objects.create(ticket=self.ticket, rating=3, headline='Bof',
+                              user=self.bob)
+        self.ticket.delete()
+        self.assertFalse(Review.objects.exists())
+
+    def test_reconcile_repairs_drift(self):
+        review = Review.objects.create(ticket=self.ticket, rating=3,
+                                       headline='Bof', user=self.bob)
+        Review.objects.bulk_create([Review(ticket=self.ticket, rating=5,
+                                           headline='Bien', user=self.alice)])
+        untouched = Ticket.objects.create(title='Autre', user=self.bob)
+        Ticket.objects.filter(id=untouched.id).update(review_count=0)
+        self.assertEqual(self.aggregates()[:2], (1, 3))
+
+        output = StringIO()
+        call_command('reconcile_ticket_aggregates', '--dry-run',
+                     stdout=output)
+        self.assertIn('1 tickets à corriger', output.getvalue())
+        self.assertEqual(self.aggregates()[:2], (1, 3))
+
+        UserFollows.objects.create(user=self.bob, followed_user=self.alice)
+        bump_feed_versions([self.alice.id, self.bob.id])
+        versions = cache.get_many([FEED_VERSION_KEY.format(user.id)
+                                   for user in (self.alice, self.bob)])
+        call_command('reconcile_ticket_aggregates', '--batch-size', '1',
+                     stdout=StringIO())
+        for key, version in versions.items():
+            self.assertNotEqual(cache.get(key), version)
+        latest = Review.objects.order_by('-time_created').first()
+        self.assertEqual(self.aggregates(), (2, 8, latest.time_created))
+        self.assertEqual(self.aggregates(untouched), (0, 0, None))
+        self.assertGreaterEqual(latest.time_created, review.time_created)
+
+    def test_feed_reads_review_count_from_ticket(self):
+        UserFollows.objects.create(user=self.bob, followed_user=self.alice)
+        Review.objects.create(ticket=self.ticket, rating=4, headline='Bien',
+                              user=self.alice)
+        Review.objects.create(ticket=self.ticket, rating=3, headline='Bof',
+                              user=self.alice)
+        self.client.force_login(self.bob)
+
+        response = self.client.get(reverse('flux'))
+
+        self.assertContains(response, '2 critiques, note moyenne 3,5/5')
+        page = json.loads(self.client.get(reverse('fluxapi'), {
+            'fields': 'has_review,review_count,average_rating'}).content)
+        ticket = [item for item in page['items']
+                  if item['kind'] == 'ticket'][0]
+        self.assertEqual(ticket, {'kind': 'ticket', 'id': self.ticket.id,
+                                  'has_review': True, 'review_count': 2,
+                                  'average_rating': 3.5})
+
+
+class FeedCardsTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.alice = User.objects.create_user('alice')
+        self.bob = User.objects.create_user('bob')
+        self.carol = User.objects.create_user('carol')
+        for user in (self.alice, self.carol):
+            UserFollows.objects.create(user=user, followed_user=self.bob)
+        self.ticket = Ticket.objects.create(title='Livre', user=self.bob)
+        self.review = Review.objects.create(ticket=self.ticket, rating=3,
+                                            headline='Bof', user=self.bob)
+
+    def test_templates_are_compiled_once(self):
+        loader = engines['django'].engine.template_loaders[0]
+        self.assertEqual(type(loader).__module__,
+                         'django.template.loaders.cached')
+
+    def test_items_carry_their_kind(self):
+        items = feed_page(self.alice)['items']
+        self.assertEqual([item.kind for item in items], ['review', 'ticket'])
+
+    def test_cards_are_shared_between_readers(self):
+        with mock.patch('application.cache.get_template',
+                        wraps=get_template) as rendered:
+            first = feed_cards(feed_page(self.alice)['items'], self.alice,
+                               'flux')
+            self.assertEqual(rendered.call_count, 2)
+            cards = feed_cards(feed_page(self.carol)['items'], self.carol,
+                               'flux')
+            self.assertEqual(rendered.call_count, 2)
+            self.assertEqual(cards, first)
+
+            # L'auteur voit une autre carte (« Vous avez publié... »).
+            cards = feed_cards(feed_page(self.bob)['items'], self.bob, 'flux')
+            self.assertEqual(rendered.call_count, 4)
+        self.assertIn('Vous avez publié une critique', cards[0])
+
+    def test_card_follows_item_changes(self):
+        self.client.force_login(self.alice)
+        response = self.client.get(reverse('flux'))
+        self.assertContains(response, 'Livre', count=2)
+        self.assertContains(response, 'img/star.png', count=3)
+        self.assertContains(response, 'img/star1.png', count=2)
+        self.assertContains(response, reverse('block_user',
+                                              args=[self.bob.id]))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.ticket.title = 'Roman'
+            self.ticket.save()
+            self.review.rating = 5
+            self.review.save()
+        response = self.client.get(reverse('flux'))
+        self.assertContains(response, 'Roman', count=2)
+        self.assertContains(response, 'img/star.png', count=5)
+        self.assertNotContains(response, 'img/star1.png')
+
+    def test_posts_cards_offer_edition(self):
+        self.client.force_login(self.bob)
+        response = self.client.get(reverse('fluxperso'))
+        self.assertContains(response, reverse('ticketmodify',
+                                              args=[self.ticket.id]))
+        self.assertContains(response, reverse('reviewdelete',
+                                              args=[self.review.id]))
+        self.assertNotContains(response, reverse('block_user',
+                                                 args=[self.bob.id]))
+
+
+@override_settings(RATE_LIMITS={'relations': ((2, 6), (3, 6))})
+class RateLimitTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        metrics.registry.reset()
+        self.alice = User.objects.create_user('alice')
+        self.bob = User.objects.create_user('bob')
+        self.carol = User.objects.create_user('carol')
+        self.client.force_login(self.alice)
+
+    def follow(self, username):
+        return self.client.post(reverse('followUsers'),
+                                {'username': username})
+
+    def test_user_budget_returns_429(self):
+        self.assertEqual(self.follow('bob').status_code, 302)
+        self.assertEqual(self.follow('carol').status_code, 302)
+        response = self.follow('bob')
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '10')
+        # Les lectures ne sont pas limitées.
+        self.assertEqual(self.client.get(reverse('followUsers')).status_code,
+                         200)
+        self.assertIn('litrevu_throttled_requests_total{scope="relations",'
+                      'bucket="user"} 1', metrics.registry.render())
+
+        later = time.time() + 10
+        with mock.patch('litrevu.ratelimit.time.time', return_value=later):
+            self.assertNotEqual(self.follow('bob').status_code, 429)
+            self.assertEqual(self.follow('bob').status_code, 429)
+
+    def test_ip_budget_is_shared_between_users(self):
+        self.follow('bob')
+        self.follow('carol')
+        self.client.force_login(self.bob)
+        self.assertEqual(self.follow('carol').status_code, 302)
+        self.assertEqual(self.follow('alice').status_code, 429)
+        self.assertIn('bucket="ip"', metrics.registry.render())
+
+    def test_refused_request_costs_nothing(self):
+        with override_settings(RATE_LIMITS={'relations': ((2, 6), (1, 6))}):
+            self.follow('bob')
+            self.client.force_login(self.bob)
+            self.assertEqual(self.follow('carol').status_code, 429)
+        # Refusée par le budget de l'adresse IP, la requête n'a pas entamé
+        # celui de l'utilisateur.
+        self.client.defaults['REMOTE_ADDR'] = '192.0.2.1'
+        self.assertEqual(self.follow('carol').status_code, 302)
+        self.assertEqual(self.follow('alice').status_code, 302)
+
+    def test_block_views_require_login_and_are_limited(self):
+        self.client.logout()
+        response = self.client.get(reverse('block_user', args=[self.bob.id]))
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(UserBlock.objects.exists())
+
+        self.client.force_login(self.alice)
+        for user in (self.bob, self.carol):
+            self.client.get(reverse('block_user', args=[user.id]))
+        response = self.client.get(reverse('unblock_user',
+                                           args=[self.bob.id]))
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(UserBlock.objects.count(), 2)
+
+    async def test_async_follow_is_limited(self):
+        await sync_to_async(self.async_client.force_login)(self.alice)
+        url = reverse('followUsersasync')
+        for username in ('bob', 'carol'):
+            await self.async_client.post(url, {'username': username})
+        response = await self.async_client.post(url, {'username': 'bob'})
+        self.assertEqual(response.status_code, 429)
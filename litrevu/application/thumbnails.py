@@ -0,0 +1,103 @@
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from PIL import Image, ImageOps
+from application.cache import bump_feed_versions
+from application.feed import ticket_readers
+from application.models import Ticket
+from litrevu.storage import CAS_PREFIX
+
+logger = logging.getLogger(__name__)
+
+FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+_executor = ThreadPoolExecutor(max_workers=settings.THUMBNAIL_WORKERS,
+                               thread_name_prefix='thumbnails')
+
+
+def schedule_thumbnails(ticket):
+    """
+    Planifie la génération des vignettes de l'image du ticket une fois la
+    transaction validée. Avec THUMBNAIL_ASYNC, le travail est confié au pool
+    de workers et la requête n'attend pas le redimensionnement.
+    """
+    if not ticket.image:
+        return
+    ticket_id, name = ticket.id, ticket.image.name
+    if settings.THUMBNAIL_ASYNC:
+        transaction.on_commit(
+            lambda: _executor.submit(_run_in_worker, ticket_id, name))
+    else:
+        transaction.on_commit(lambda: generate_thumbnails(ticket_id, name))
+
+
+def _run_in_worker(ticket_id, name):
+    try:
+        generate_thumbnails(ticket_id, name)
+    except Exception:
+        logger.exception('Échec des vignettes du ticket %s', ticket_id)
+    finally:
+        connection.close()
+
+
+def _decode(file, max_width):
+    """
+    Décode l'image une seule fois, à la plus petite échelle suffisante pour
+    la plus grande vignette (draft JPEG), en appliquant l'orientation EXIF.
+    """
+    image = Image.open(file)
+    image.draft('RGB', (max_width, max_width))
+    image = ImageOps.exif_transpose(image)
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'transparency' in image.info
+                              else 'RGB')
+    return image
+
+
+def generate_thumbnails(ticket_id, name):
+    """
+    Génère les variantes WebP et JPEG de l'image `name` aux largeurs
+    THUMBNAIL_WIDTHS et les enregistre dans Ticket.thumbnails.
+
+    Les largeurs sont produites de la plus grande à la plus petite, chacune
+    à partir de la précédente. Pour une image adressée par contenu, les
+    vignettes déjà produites pour le même contenu sont réutilisées. Le
+    ticket n'est mis à jour que si son image est toujours `name`, et les
+    lecteurs du ticket voient leur flux invalidé pour que le prochain rendu
+    utilise le srcset.
+
+    Returns:
+        dict: Les vignettes, {format: [[largeur, nom], ...]}.
+    """
+    widths = sorted(settings.THUMBNAIL_WIDTHS, reverse=True)
+    stem = os.path.splitext(name)[0]
+    content_addressed = name.startswith(CAS_PREFIX + '/')
+    thumbnails = {extension: [] for extension in FORMATS}
+    with Ticket.image.field.storage.open(name) as file:
+        image = _decode(file, widths[0])
+    widths = [width for width in widths if width < image.width]
+    for width in widths or [image.width]:
+        height = max(1, round(image.height * width / image.width))
+        image = image.resize((width, height), Image.LANCZOS)
+        for extension, (format, options) in FORMATS.items():
+            thumbnail = 'thumbnails/{}-{}.{}'.format(stem, width, extension)
+            if not (content_addressed and default_storage.exists(thumbnail)):
+                output = image.convert('RGB') if format == 'JPEG' else image
+                buffer = BytesIO()
+                output.save(buffer, format, **options)
+                thumbnail = default_storage.save(
+                    thumbnail, ContentFile(buffer.getvalue()))
+            thumbnails[extension].insert(0, [image.width, thumbnail])
+    updated = Ticket.objects.filter(id=ticket_id, image=name).update(
+        thumbnails=thumbnails)
+    if updated:
+        bump_feed_versions(ticket_readers(ticket_id))
+    return thumbnails
@@ -0,0 +1,278 @@
+import csv
+import json
+import time
+from datetime import datetime
+from django.core.exceptions import ValidationError
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import TextField
+from application.feed import REVIEW, TICKET
+from application.models import Review, Ticket
+from authentication.models import User
+
+TRANSFER_BATCH_SIZE = 1000
+PROGRESS_EVERY = 10000
+
+FIELDS = ['type', 'id', 'ticket', 'user', 'title', 'description', 'image',
+          'rating', 'headline', 'body', 'time_created']
+
+
+class Progress:
+    """
+    Compte les lignes traitées et affiche régulièrement leur nombre et le
+    débit (lignes par seconde) sur le flux donné.
+    """
+
+    def __init__(self, stream, label, every=PROGRESS_EVERY):
+        self.stream = stream
+        self.label = label
+        self.every = every
+        self.count = 0
+        self.start = time.perf_counter()
+
+    def rate(self):
+        return self.count / max(time.perf_counter() - self.start, 1e-9)
+
+    def add(self, count=1):
+        before = self.count // self.every
+        self.count += count
+        if self.count // self.every > before:
+            self.report()
+
+    def report(self):
+        self.stream.write('{} : {} lignes, {:.0f} lignes/s\n'.format(
+            self.label, self.count, self.rate()))
+
+
+def detect_format(path, format):
+    if format:
+        return format
+    if path.endswith('.csv'):
+        return 'csv'
+    if path.endswith(('.jsonl', '.ndjson')):
+        return 'jsonl'
+    raise ValueError("Format inconnu pour {} : précisez --format.".format(
+        path))
+
+
+def _records():
+    """
+    Parcourt les tickets puis les critiques, par lots de
+    TRANSFER_BATCH_SIZE lignes lues au fil de l'eau (iterator), sous la
+    forme de dictionnaires aux clés FIELDS.
+    """
+    tickets = Ticket.objects.order_by('id').values_list(
+        'id', 'user__username', 'title', 'description', 'image',
+        'time_created')
+    for id, user, title, description, image, time_created in \
+            tickets.iterator(chunk_size=TRANSFER_BATCH_SIZE):
+        yield {'type': TICKET, 'id': id, 'user': user, 'title': title,
+               'description': description, 'image': image or '',
+               'time_created': time_created.isoformat()}
+    reviews = Review.objects.order_by('id').values_list(
+        'id', 'ticket_id', 'user__username', 'rating', 'headline', 'body',
+        'time_created')
+    for id, ticket, user, rating, headline, body, time_created in \
+            reviews.iterator(chunk_size=TRANSFER_BATCH_SIZE):
+        yield {'type': REVIEW, 'id': id, 'ticket': ticket, 'user': user,
+               'rating': rating, 'headline': headline, 'body': body,
+               'time_created': time_created.isoformat()}
+
+
+def export_records(output, format, progress):
+    """
+    Écrit tous les tickets puis toutes les critiques dans `output` au
+    format JSON Lines ('jsonl') ou CSV ('csv'). La mémoire utilisée ne
+    dépend pas du nombre de lignes.
+    """
+    if format == 'csv':
+        writer = csv.DictWriter(output, FIELDS, restval='')
+        writer.writeheader()
+        write = writer.writerow
+    else:
+        def write(record):
+            output.write(json.dumps(record, ensure_ascii=False) + '\n')
+    for record in _records():
+        write(record)
+        progress.add()
+
+
+def read_records(input, format, errors):
+    """
+    Lit les enregistrements d'un flux JSON Lines ou CSV, un par un. Les
+    lignes illisibles sont signalées sur `errors` et ignorées.
+
+    Yields:
+        tuple: (numéro de ligne, dictionnaire de l'enregistrement).
+    """
+    if format == 'csv':
+        reader = csv.DictReader(input)
+        for record in reader:
+            yield reader.line_num, {key: value for key, value
+                                    in record.items() if value != ''}
+    else:
+        for number, line in enumerate(input, start=1):
+            if not line.strip():
+                continue
+            try:
+                yield number, json.loads(line)
+            except ValueError as error:
+                errors.write('Ligne {} ignorée : {}\n'.format(number, error))
+
+
+def _validate(instance):
+    """
+    Vérifie les champs d'une instance comme le ferait un formulaire :
+    longueurs, champs obligatoires et bornes de la note. L'auteur et le
+    ticket sont vérifiés par lot (voir _flush), l'image n'est pas relue.
+
+    Raises:
+        ValueError: Si un champ est invalide.
+    """
+    try:
+        instance.clean_fields(exclude=['id', 'user', 'ticket', 'image'])
+        errors = {}
+    except ValidationError as error:
+        errors = error.message_dict
+    # La longueur d'un TextField n'est vérifiée que par les formulaires.
+    for field in instance._meta.fields:
+        value = getattr(instance, field.attname)
+        if (isinstance(field, TextField) and field.max_length and value
+                and len(value) > field.max_length):
+            errors.setdefault(field.name, []).append(
+                '{} caractères au lieu de {} au plus'.format(
+                    len(value), field.max_length))
+    if errors:
+        raise ValueError('; '.join(
+            '{} : {}'.format(field, ' '.join(messages))
+            for field, messages in errors.items()))
+
+
+def _parse(record, users):
+    """
+    Construit l'instance de Ticket ou de Review décrite par un
+    enregistrement, après en avoir vérifié les champs (voir _validate).
+
+    Raises:
+        ValueError: Si l'enregistrement est incomplet ou invalide.
+    """
+    try:
+        user_id = users[record['user']]
+    except KeyError:
+        raise ValueError('utilisateur inconnu : {}'.format(
+            record.get('user')))
+    id = int(record['id']) if record.get('id') is not None else None
+    time_created = datetime.fromisoformat(record['time_created'])
+    if record.get('type') == TICKET:
+        instance = Ticket(id=id, user_id=user_id, title=record['title'],
+                          description=record.get('description', ''),
+                          image=record.get('image') or None)
+    elif record.get('type') == REVIEW:
+        instance = Review(id=id, ticket_id=int(record['ticket']),
+                          user_id=user_id, rating=int(record['rating']),
+                          headline=record['headline'],
+                          body=record.get('body', ''))
+    else:
+        raise ValueError('type inconnu : {}'.format(record.get('type')))
+    _validate(instance)
+    # auto_now_add remplace time_created à l'insertion : la date d'origine
+    # est gardée à part et rétablie après bulk_create.
+    instance.imported_time_created = time_created
+    return instance
+
+
+def _save_batch(model, instances):
+    """
+    Insère un lot d'instances d'un même modèle puis rétablit leurs dates
+    de création d'origine.
+    """
+    with transaction.atomic():
+        created = model.objects.bulk_create(instances)
+        for instance in created:
+            instance.time_created = instance.imported_time_created
+        model.objects.bulk_update(created, ['time_created'],
+                                  batch_size=TRANSFER_BATCH_SIZE)
+
+
+def _flush(batch, errors):
+    """
+    Résout les utilisateurs d'un lot d'enregistrements en une requête,
+    écarte les critiques dont le ticket n'existe pas, puis insère le lot.
+
+    Returns:
+        int: Le nombre de lignes importées.
+    """
+    users = dict(User.objects.filter(
+        username__in={record.get('user') for _, record in batch}
+    ).values_list('username', 'id'))
+    instances = {Ticket: [], Review: []}
+    for number, record in batch:
+        try:
+            instance = _parse(record, users)
+        except KeyError as error:
+            errors.write('Ligne {} ignorée : champ {} manquant\n'.format(
+                number, error))
+            continue
+        except (TypeError, ValueError) as error:
+            errors.write('Ligne {} ignorée : {}\n'.format(number, error))
+            continue
+        instances[type(instance)].append(instance)
+    ticket_ids = set(Ticket.objects.filter(
+        id__in={review.ticket_id for review in instances[Review]}
+    ).values_list('id', flat=True))
+    ticket_ids |= {ticket.id for ticket in instances[Ticket]}
+    reviews = []
+    for review in instances[Review]:
+        if review.ticket_id in ticket_ids:
+            reviews.append(review)
+        else:
+            errors.write('Critique ignorée (ticket {} inconnu)\n'.format(
+                review.ticket_id))
+    # Les tickets du lot passent en premier : une critique peut répondre à
+    # un ticket du même lot.
+    for model, objects in ((Ticket, instances[Ticket]), (Review, reviews)):
+        if objects:
+            _save_batch(model, objects)
+    return len(instances[Ticket]) + len(reviews)
+
+
+def import_records(records, progress, errors,
+                   batch_size=TRANSFER_BATCH_SIZE):
+    """
+    Importe des tickets et des critiques par lots de `batch_size`
+    enregistrements, sans garder plus d'un lot en mémoire.
+
+    Les identifiants présents dans les enregistrements sont conservés, ce
+    qui permet aux critiques de désigner leur ticket sans table de
+    correspondance ; les enregistrements sans identifiant en reçoivent un
+    nouveau. Les utilisateurs doivent exister (par nom d'utilisateur).
+
+    Les signaux post_save ne sont pas émis par bulk_create : le flux
+    matérialisé, l'index de recherche, les agrégats des tickets et les
+    vignettes sont à reconstruire ensuite (voir la commande import_posts).
+
+    Returns:
+        int: Le nombre de lignes importées.
+    """
+    imported = 0
+    batch = []
+    for number, record in records:
+        batch.append((number, record))
+        if len(batch) >= batch_size:
+            count = _flush(batch, errors)
+            imported += count
+            progress.add(count)
+            batch = []
+    if batch:
+        count = _flush(batch, errors)
+        imported += count
+        progress.add(count)
+    # Les séquences des clés primaires doivent suivre les identifiants
+    # importés (PostgreSQL ; SQLite s'en charge seul).
+    sequence_sql = connection.ops.sequence_reset_sql(no_style(),
+                                                     [Ticket, Review])
+    if sequence_sql:
+        with connection.cursor() as cursor:
+            for sql in sequence_sql:
+                cursor.execute(sql)
+    return imported
@@ -0,0 +1,143 @@
+from functools import wraps
+from io import BytesIO
+from django.conf import settings
+from django.core.files.uploadhandler import SkipFile
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+from django.http import HttpResponse, QueryDict
+from django.utils.datastructures import MultiValueDict
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
+from PIL import Image, UnidentifiedImageError
+
+HEADER_PROBE_LIMIT = 256 * 1024
+
+
+def request_size_limit():
+    """
+    Taille maximale du corps d'une requête portant une image de ticket :
+    l'image et les autres champs du formulaire.
+    """
+    return (settings.TICKET_IMAGE_MAX_SIZE +
+            settings.DATA_UPLOAD_MAX_MEMORY_SIZE)
+
+
+class TicketImageUploadHandler(TemporaryFileUploadHandler):
+    """
+    Gestionnaire d'upload des images de tickets.
+
+    Le fichier est écrit par morceaux sur disque (jamais entièrement en
+    mémoire) et refusé dès que possible :
+        - corps de requête annoncé trop grand : refusé par
+          ticket_image_upload avant toute lecture (réponse 413) ;
+        - fichier dépassant TICKET_IMAGE_MAX_SIZE : la suite est ignorée ;
+        - en-tête d'image illisible, format non autorisé ou dimensions
+          supérieures à TICKET_IMAGE_MAX_PIXELS : la suite est ignorée.
+    L'en-tête est lu par Pillow sans décoder les pixels. Les messages
+    d'erreur sont conservés dans `errors`, par nom de champ.
+    """
+
+    def __init__(self, request=None):
+        super().__init__(request)
+        self.errors = {}
+
+    def handle_raw_input(self, input_data, META, content_length, boundary,
+                         encoding=None):
+        # Filet de sécurité si le gestionnaire est installé sans
+        # ticket_image_upload.
+        if content_length > request_size_limit():
+            self.errors[None] = 'La requête est trop volumineuse.'
+            return QueryDict(encoding=encoding), MultiValueDict()
+        return None
+
+    def new_file(self, field_name, *args, **kwargs):
+        self.size = 0
+        self.header = b''
+        self.identified = False
+        super().new_file(field_name, *args, **kwargs)
+
+    def _check_header(self, complete=False):
+        """
+        Tente d'identifier l'image à partir des octets reçus.
+
+        Returns:
+            str ou None: Le motif de refus, ou None si l'image est acceptée
+            ou si l'en-tête est encore incomplet.
+        """
+        try:
+            with Image.open(BytesIO(self.header)) as image:
+                format, (width, height) = image.format, image.size
+        except (UnidentifiedImageError, OSError, SyntaxError, ValueError):
+            if complete or len(self.header) >= HEADER_PROBE_LIMIT:
+                return "Le fichier n'est pas une image valide."
+            return None
+        self.identified = True
+        self.header = b''
+        if format not in settings.TICKET_IMAGE_FORMATS:
+            return "Format d'image non autorisé ({}).".format(format)
+        if width * height > settings.TICKET_IMAGE_MAX_PIXELS:
+            return "L'image est trop grande ({} x {} pixels).".format(
+                width, height)
+        return None
+
+    def receive_data_chunk(self, raw_data, start):
+        self.size += len(raw_data)
+        error = None
+        if self.size > settings.TICKET_IMAGE_MAX_SIZE:
+            error = 'Le fichier dépasse {} Mo.'.format(
+                settings.TICKET_IMAGE_MAX_SIZE // (1024 * 1024))
+        elif not self.identified:
+            self.header += raw_data
+            error = self._check_header()
+        if error:
+            self.errors[self.field_name] = error
+            raise SkipFile()
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        if not self.identified:
+            error = self._check_header(complete=True)
+            if error:
+                self.errors[self.field_name] = error
+                self.file.close()
+                return None
+        return super().file_complete(file_size)
+
+
+def ticket_image_upload(view):
+    """
+    Installe TicketImageUploadHandler sur les requêtes de la vue.
+
+    Les gestionnaires d'upload doivent être remplacés avant toute lecture de
+    request.POST, or CsrfViewMiddleware lit request.POST avant la vue : la
+    vue est donc exemptée au niveau du middleware et protégée à l'intérieur,
+    une fois le gestionnaire installé.
+
+    Un corps de requête annoncé plus grand que request_size_limit() est
+    refusé d'emblée par une réponse 413 : il ne serait pas lu, et la
+    vérification CSRF, faute de trouver le jeton dans le formulaire,
+    répondrait 403 sans expliquer le refus.
+    """
+    protected_view = csrf_protect(view)
+
+    @csrf_exempt
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        try:
+            content_length = int(request.META.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            content_length = 0
+        if content_length > request_size_limit():
+            return HttpResponse('La requête est trop volumineuse.',
+                                status=413,
+                                content_type='text/plain; charset=utf-8')
+        request.upload_handlers = [TicketImageUploadHandler(request)]
+        return protected_view(request, *args, **kwargs)
+    return wrapper
+
+
+def add_upload_errors(request, form):
+    """
+    Reporte sur le formulaire les erreurs relevées pendant l'upload.
+    """
+    for handler in request.upload_handlers:
+        for field, message in getattr(handler, 'errors', {}).items():
+            form.add_error(field if field in form.fields else None, message)
@@ -1,25 +1,57 @@
-from itertools import chain
+from calendar import timegm
+from functools import wraps
+from asgiref.sync import sync_to_async
+from django.core.exceptions import BadRequest
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
+from django.contrib.auth.views import redirect_to_login
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
+from application import api, events
 from application.models import Ticket, Review, UserBlock, UserFollows
 from application.forms import TicketForm, NewReview
 from application.forms import ReviewFormfromticket, FollowUserForm
 from application.forms import TicketAndReviewForm
+from application.cache import acached_feed_fragment, cached_feed_fragment
+from application.cache import feed_changed_recently, feed_etag
+from application.cache import afeed_validators, feed_last_modified
+from application.feed import afeed_page, feed_page, hydrate, posts_page
+from application.search import SEARCH_PAGE_SIZE, search
+from application.search import username_suggestions
+from application.suggestions import follow_suggestions
+from application.uploadhandlers import add_upload_errors
+from application.uploadhandlers import ticket_image_upload
 from authentication.models import User
-from django.db.models import Q
+from litrevu.database import replica_reads
+from litrevu.ratelimit import rate_limit
 
 
 @login_required
+@cache_control(private=True, no_cache=True)
+@replica_reads(unless=feed_changed_recently)
+@condition(etag_func=feed_etag, last_modified_func=feed_last_modified)
 def flux(request):
     """
     Affiche le flux des tickets et des critiques pour l'utilisateur connecté.
 
-    Cette vue récupère tous les tickets créés par l'utilisateur connecté ainsi
-    que ceux créés par les utilisateurs suivis par l'utilisateur connecté.
-    Ensuite, elle récupère toutes les critiques associées à ces tickets ainsi
-    que celles créées par l'utilisateur connecté et les utilisateurs suivis.
-    Les tickets et les critiques sont triés par date de création dans l'ordre
-    décroissant et passés au template 'flux.html' pour l'affichage.
+    Cette vue affiche les tickets créés par l'utilisateur connecté ainsi
+    que ceux créés par les utilisateurs suivis par l'utilisateur connecté,
+    et les critiques associées à ces tickets ainsi que celles créées par
+    l'utilisateur connecté et les utilisateurs suivis. Le flux est lu dans
+    la table matérialisée FeedEntry, remplie à l'écriture (voir
+    application.feed et application.signals) : une page est une simple
+    plage d'index, chargée en mémoire puis passée au template 'flux.html'.
+    La pagination par curseur utilise les paramètres GET 'before' (entrées
+    plus anciennes) et 'after' (entrées plus récentes).
+
+    Les réponses portent un ETag et un Last-Modified dérivés de la version
+    du flux (voir application.cache) : une requête conditionnelle
+    (If-None-Match / If-Modified-Since) sur un flux inchangé reçoit une
+    réponse 304 sans requête SQL ni rendu de template.
 
     Args:
         request (HttpRequest): L'objet de requête HTTP contenant les
@@ -30,34 +62,77 @@ def flux(request):
         'flux.html' avec le contexte des tickets et des critiques triés par
         date de création.
 
-    Template:
-        - flux.html: Affiche les tickets et les critiques de l'utilisateur et
-        des utilisateurs suivis.
+    Templates:
+        - flux.html: La page du flux.
+        - fluxitems.html: Les éléments de la page et la pagination, rendus
+        avec le contexte 'page' (dict) contenant la liste 'items' triée par
+        date de création décroissante et les jetons 'older' et 'newer' des
+        pages voisines. Ce fragment est mis en cache par utilisateur et par
+        version de son flux (voir application.cache).
 
     Contexte:
-        reviewAndTicket (list): Une liste triée par date de création
-        décroissante contenant des instances de Ticket et de Review.
+        feed_html (str): Le rendu HTML de fluxitems.html.
+    """
+    feed_html = cached_feed_fragment(request, 'flux', 'fluxitems.html',
+                                     feed_page)
+    return render(request, 'flux.html', {'feed_html': feed_html})
+
+
+def _api_login_required(view):
+    """
+    Équivalent de login_required pour l'API : un client non connecté reçoit
+    une réponse 401 en JSON, et non une redirection vers la page de
+    connexion qu'il ne saurait pas suivre.
     """
-    user_follows = UserFollows.objects.filter(user=request.user)
-    blocked_users = UserBlock.objects.filter(
-        user=request.user).values_list('blocked_user', flat=True)
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return JsonResponse({'error': 'Authentification requise.'},
+                                status=401)
+        return view(request, *args, **kwargs)
+    return wrapper
+
+
+@_api_login_required
+@cache_control(private=True, no_cache=True)
+@replica_reads(unless=feed_changed_recently)
+@condition(etag_func=feed_etag, last_modified_func=feed_last_modified)
+def flux_api(request):
+    """
+    Renvoie une page du flux de l'utilisateur connecté en JSON, pour les
+    clients autres que le navigateur (application mobile).
 
-    tickets = Ticket.objects.filter(
-        Q(user__in=user_follows.values('followed_user')) | Q(user=request.user)
-    ).exclude(user__in=blocked_users)
+    Les éléments sont ceux de la vue flux, dans le même ordre et avec la
+    même pagination par curseur ('before', 'after'). Seuls les champs
+    demandés par 'fields' sont lus, par des requêtes values() sans
+    construire d'instances de modèle (voir application.api), et aucun
+    template n'est rendu. ETag et Last-Modified sont ceux de la vue flux.
 
-    reviews = Review.objects.filter(
-        Q(ticket__in=tickets) | Q(user__in=user_follows.values(
-            'followed_user')) | Q(user=request.user)
-    ).exclude(user__in=blocked_users)
+    Args:
+        request (HttpRequest): L'objet de requête HTTP ; paramètres GET
+        facultatifs 'before', 'after', 'limit' (taille de page, au plus
+        API_MAX_PAGE_SIZE) et 'fields' (champs séparés par des virgules,
+        voir application.api.TICKET_FIELDS et REVIEW_FIELDS).
 
-    reviewAndTicket = sorted(chain(reviews, tickets),
-                             key=lambda instance: instance.time_created,
-                             reverse=True)
-    return render(request, 'flux.html', {'reviewAndTicket': reviewAndTicket})
+    Returns:
+        HttpResponse: Un document JSON {'items': [...], 'older': jeton ou
+        null, 'newer': jeton ou null}, chaque élément portant 'kind'
+        ('ticket' ou 'review'), 'id' et les champs demandés ; une réponse
+        401 {'error': ...} si l'utilisateur n'est pas connecté.
+
+    Raises:
+        BadRequest: Si un paramètre est invalide (réponse 400).
+    """
+    page = api.feed_items_page(
+        request.user, api.parse_fields(request.GET.get('fields')),
+        before=request.GET.get('before'), after=request.GET.get('after'),
+        limit=api.parse_limit(request.GET.get('limit')))
+    return HttpResponse(api.dumps(page), content_type='application/json')
 
 
 @login_required
+@rate_limit('posts')
+@ticket_image_upload
 def ticket_creation(request):
     """
     Gère la création d'un nouveau ticket par l'utilisateur connecté.
@@ -68,6 +143,10 @@ def ticket_creation(request):
     est sauvegardé et l'utilisateur est redirigé vers la vue 'flux'. Si la
     méthode de requête est GET, un formulaire vide est affiché.
 
+    L'image est reçue par TicketImageUploadHandler, qui la refuse dès que sa
+    taille, son format ou ses dimensions dépassent les limites ; le motif
+    est affiché comme erreur du formulaire.
+
     Args:
         request (HttpRequest): L'objet de requête HTTP contenant les
         informations sur la demande de l'utilisateur.
@@ -86,6 +165,7 @@ def ticket_creation(request):
     """
     if request.method == 'POST':
         form = TicketForm(request.POST, request.FILES, user=request.user)
+        add_upload_errors(request, form)
         if form.is_valid():
             form.save()
             return redirect('flux')
@@ -95,6 +175,7 @@ def ticket_creation(request):
 
 
 @login_required
+@ticket_image_upload
 def ticket_modify(request, id):
     """
     Gère la modification d'un ticket existant par l'utilisateur connecté.
@@ -128,6 +209,7 @@ def ticket_modify(request, id):
     ticket = get_object_or_404(Ticket, id=id)
     if request.method == 'POST':
         form = TicketForm(request.POST, request.FILES, instance=ticket)
+        add_upload_errors(request, form)
         if form.is_valid():
             form.save()
             return redirect('fluxperso')
@@ -147,6 +229,7 @@ def ticket_delete(request, id):
 
 
 @login_required
+@rate_limit('posts')
 def review_creation(request):
     """
     Gère la suppression d'un ticket existant par l'utilisateur connecté.
@@ -213,7 +296,8 @@ def review_modify(request, id):
         les données soumises en cas de validation échouée.
         ticket (Ticket): L'instance du ticket associé à la critique à modifier.
     """
-    review = get_object_or_404(Review, id=id)
+    review = get_object_or_404(Review.objects.select_related('ticket__user'),
+                               id=id)
     ticket = review.ticket
     if request.method == 'POST':
         form = ReviewFormfromticket(request.POST, instance=review)
@@ -261,17 +345,20 @@ def review_delete(request, id):
 
 
 @login_required
+@rate_limit('relations')
+@replica_reads
 def add_user_follow(request):
     """
     Gère l'ajout d'un utilisateur suivi par l'utilisateur connecté.
 
     Cette vue affiche un formulaire permettant à l'utilisateur de suivre un
     autre utilisateur. Si la méthode de requête est POST, elle tente de
-    valider et de sauvegarder le formulaire. Si le formulaire est valide,
-    elle vérifie que l'utilisateur à suivre existe et qu'il n'est pas déjà
-    suivi par l'utilisateur connecté, puis l'ajoute à la liste des
-    utilisateurs suivis. Si la méthode de requête est GET, un formulaire
-    vide est affiché.
+    valider et de sauvegarder le formulaire. La validation résout le nom
+    saisi en utilisateur, en une seule requête ; si l'utilisateur n'est pas
+    déjà suivi par l'utilisateur connecté, l'abonnement est créé. Si la
+    méthode de requête est GET, un formulaire vide est affiché. Le champ du
+    formulaire propose les noms existants au fil de la saisie (voir
+    user_typeahead).
 
     Args:
         request (HttpRequest): L'objet de requête HTTP contenant les
@@ -294,47 +381,62 @@ def add_user_follow(request):
         l'utilisateur connecté.
         followed_by (QuerySet): La liste des utilisateurs abonnés à
         l'utilisateur connecté.
-        message (str, optionnel): Un message indiquant que l'utilisateur
-        est déjà suivi.
+        suggestions (list): Les suggestions d'abonnement (FollowSuggestion)
+        calculées par la commande compute_follow_suggestions.
+        message (str): Un message indiquant que l'utilisateur est déjà
+        suivi, ou une chaîne vide.
     """
+    message = ''
     if request.method == 'POST':
         form = FollowUserForm(request.POST)
         if form.is_valid():
-            followed_username = form.cleaned_data['username']
-            followed_user = User.objects.get(username=followed_username)
-            current_user = request.user
-            if (current_user != followed_user and
-                not UserFollows.objects.filter(
-                    user=request.user,
-                    followed_user=followed_user).exists()):
-                UserFollows.objects.get_or_create(user=current_user,
-                                                  followed_user=followed_user)
-                return redirect('followUsers')
-            else:
-                form = FollowUserForm()
-                user_follows = UserFollows.objects.filter(user=request.user)
-                folloded_by = UserFollows.objects.filter(
-                    followed_user=request.user
-                    )
-                return render(request, 'follow.html', {
-                    'user_follows': user_follows,
-                    'folloded_by': folloded_by,
-                    'message': "Vous êtes déjà abonné à cet utilisateur.",
-                    'form': form
-                    })
+            followed_user = form.cleaned_data['username']
+            if followed_user != request.user:
+                _, created = UserFollows.objects.get_or_create(
+                    user=request.user, followed_user=followed_user)
+                if created:
+                    return redirect('followUsers')
+            message = "Vous êtes déjà abonné à cet utilisateur."
+            form = FollowUserForm()
     else:
         form = FollowUserForm()
 
-    user_follows = UserFollows.objects.filter(user=request.user)
-    folloded_by = UserFollows.objects.filter(followed_user=request.user)
+    user_follows = UserFollows.objects.filter(
+        user=request.user).select_related('followed_user')
+    folloded_by = UserFollows.objects.filter(
+        followed_user=request.user).select_related('user')
     return render(request, 'follow.html', {
         'form': form,
         'folloded_by': folloded_by,
-        'user_follows': user_follows
+        'user_follows': user_follows,
+        'suggestions': follow_suggestions(request.user),
+        'message': message,
         })
 
 
 @login_required
+@cache_control(private=True, max_age=60)
+def user_typeahead(request):
+    """
+    Suggère les noms d'utilisateurs commençant par le paramètre GET 'q',
+    pour l'autocomplétion du formulaire d'abonnement (static/js/
+    typeahead.js).
+
+    Args:
+        request (HttpRequest): L'objet de requête HTTP ; 'q' contient le
+        début du nom d'utilisateur.
+
+    Returns:
+        JsonResponse: {'usernames': [...]}, au plus USERNAME_SUGGESTIONS
+        noms triés par ordre alphabétique.
+    """
+    prefix = request.GET.get('q', '').strip()[:150]
+    return JsonResponse(
+        {'usernames': username_suggestions(prefix, request.user)})
+
+
+@login_required
+@rate_limit('relations')
 def delete_user_follow(request, id):
     """
     Gère la suppression d'un abonnement utilisateur existant par l'utilisateur
@@ -371,6 +473,8 @@ def delete_user_follow(request, id):
 
 
 @login_required
+@rate_limit('posts')
+@ticket_image_upload
 def ticket_Review_creation(request):
     """
     Gère la création simultanée d'un ticket et d'une critique par
@@ -404,6 +508,7 @@ def ticket_Review_creation(request):
     if request.method == 'POST':
         form = TicketAndReviewForm(request.POST, request.FILES,
                                    user=request.user)
+        add_upload_errors(request, form)
         if form.is_valid():
             form.save()
             return redirect('flux')
@@ -415,6 +520,7 @@ def ticket_Review_creation(request):
 
 
 @login_required
+@rate_limit('posts')
 def create_review_from_ticket(request, ticket_id):
     """
     Gère la création d'une critique pour un ticket existant par
@@ -464,15 +570,19 @@ def create_review_from_ticket(request, ticket_id):
 
 
 @login_required
+@cache_control(private=True, no_cache=True)
+@replica_reads(unless=feed_changed_recently)
+@condition(etag_func=feed_etag, last_modified_func=feed_last_modified)
 def fluxperso(request):
     """
     Affiche le flux personnel des tickets et des critiques de
     l'utilisateur connecté.
 
-    Cette vue récupère tous les tickets et critiques créés par l'utilisateur
-    connecté. Les tickets et les critiques sont ensuite triés par date de
-    création dans l'ordre décroissant et passés au template 'fluxperso.html'
-    pour l'affichage.
+    Cette vue récupère une page des tickets et critiques créés par
+    l'utilisateur connecté, triés par date de création dans l'ordre
+    décroissant, et la passe au template 'fluxperso.html' pour l'affichage.
+    La pagination par curseur utilise les paramètres GET 'before' et 'after'
+    et les requêtes conditionnelles sont gérées comme pour la vue flux.
 
     Args:
         request (HttpRequest): L'objet de requête HTTP contenant les
@@ -483,25 +593,65 @@ def fluxperso(request):
         'fluxperso.html' avec le contexte des tickets et des critiques
         triés par date de création.
 
-    Template:
-        - fluxperso.html: Affiche les tickets et les critiques de
-        l'utilisateur connecté.
+    Templates:
+        - fluxperso.html: La page des publications de l'utilisateur.
+        - fluxpersoitems.html: Les tickets et critiques de la page et la
+        pagination, rendus avec le contexte 'page' comme pour la vue flux
+        et mis en cache de la même façon.
 
     Contexte:
-        reviewAndTicket2 (list): Une liste triée par date de création
-        décroissante contenant des instances de Ticket et de Review
-        créées par l'utilisateur connecté.
+        feed_html (str): Le rendu HTML de fluxpersoitems.html.
+    """
+    feed_html = cached_feed_fragment(request, 'fluxperso',
+                                     'fluxpersoitems.html', posts_page)
+    return render(request, 'fluxperso.html', {'feed_html': feed_html})
+
+
+@login_required
+def search_view(request):
     """
-    tickets2 = Ticket.objects.filter(user=request.user)
-    reviews2 = Review.objects.filter(user=request.user)
-    reviewAndTicket2 = sorted(chain(reviews2, tickets2),
-                              key=lambda instance: instance.time_created,
-                              reverse=True)
+    Recherche plein texte dans les titres et descriptions des tickets et
+    dans les titres et corps des critiques.
 
-    return render(request, 'fluxperso.html',
-                  {'reviewAndTicket2': reviewAndTicket2})
+    Les résultats, classés par pertinence et par récence, excluent les
+    utilisateurs bloqués par l'utilisateur connecté et ceux qui l'ont
+    bloqué (voir application.search). La page de résultats est choisie par
+    le paramètre GET 'page' (à partir de 1).
 
+    Args:
+        request (HttpRequest): L'objet de requête HTTP ; le paramètre GET
+        'q' contient la recherche.
 
+    Returns:
+        HttpResponse: Une réponse HTTP contenant le rendu du template
+        'search.html'.
+
+    Raises:
+        BadRequest: Si le numéro de page est invalide.
+
+    Contexte:
+        query (str): La recherche saisie.
+        page (dict): 'items' (list) les tickets et critiques trouvés,
+        'number' (int) le numéro de la page et 'has_next' (bool).
+    """
+    query = request.GET.get('q', '').strip()
+    try:
+        number = int(request.GET.get('page', 1))
+    except ValueError:
+        number = 0
+    if number < 1:
+        raise BadRequest('Numéro de page invalide.')
+    entries = search(request.user, query, limit=SEARCH_PAGE_SIZE + 1,
+                     offset=(number - 1) * SEARCH_PAGE_SIZE)
+    page = {'items': hydrate(entries[:SEARCH_PAGE_SIZE]), 'number': number,
+            'has_next': len(entries) > SEARCH_PAGE_SIZE}
+    return render(request, 'search.html', {'query': query, 'page': page})
+
+
+# Le lien de blocage du flux est un simple lien : les requêtes GET
+# écrivent aussi, et sont limitées.
+@login_required
+@rate_limit('relations', methods=('GET', 'POST'))
 def block_user(request, user_id):
     user_to_block = get_object_or_404(User, id=user_id)
     if request.user != user_to_block:
@@ -510,8 +660,145 @@ def block_user(request, user_id):
     return redirect('flux')
 
 
+@login_required
+@rate_limit('relations', methods=('GET', 'POST'))
 def unblock_user(request, user_id):
     user_to_unblock = get_object_or_404(User, id=user_id)
     UserBlock.objects.filter(user=request.user,
                              blocked_user=user_to_unblock).delete()
     return redirect('flux')
+
+
+async def _ais_authenticated(request):
+    """
+    Résout request.user dans un thread : l'ORM synchrone ne peut pas être
+    appelé depuis la boucle d'événements. L'utilisateur reste ensuite en
+    mémoire pour la vue et les templates.
+    """
+    return await sync_to_async(lambda: request.user.is_authenticated)()
+
+
+@replica_reads(unless=feed_changed_recently)
+async def flux_async(request):
+    """
+    Version asynchrone de la vue flux, destinée à être servie par un serveur
+    ASGI (litrevu.asgi).
+
+    Le contenu, le cache de fragments et les requêtes conditionnelles sont
+    ceux de la vue flux. La page est lue avec l'ORM asynchrone (voir
+    application.feed.afeed_page) : sous Django 4.2, ses requêtes s'exécutent
+    l'une après l'autre dans le thread de l'ORM, et la boucle d'événements
+    reste libre pendant l'attente. Une connexion lente n'occupe ainsi aucun
+    thread du serveur.
+
+    Args:
+        request (HttpRequest): L'objet de requête HTTP contenant les
+        informations sur la demande de l'utilisateur.
+
+    Returns:
+        HttpResponse: Le rendu de 'flux.html', une réponse 304 si le flux
+        n'a pas changé, ou une redirection vers la page de connexion.
+    """
+    if not await _ais_authenticated(request):
+        return redirect_to_login(request.get_full_path())
+    etag, last_modified = await afeed_validators(request)
+    etag = quote_etag(etag)
+    last_modified = timegm(last_modified.utctimetuple())
+    response = get_conditional_response(request, etag=etag,
+                                        last_modified=last_modified)
+    if response is None:
+        feed_html = await acached_feed_fragment(request, 'flux',
+                                                'fluxitems.html', afeed_page)
+        response = await sync_to_async(render)(
+            request, 'flux.html', {'feed_html': feed_html})
+    response.headers.setdefault('ETag', etag)
+    response.headers.setdefault('Last-Modified', http_date(last_modified))
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+@rate_limit('relations')
+@replica_reads
+async def add_user_follow_async(request):
+    """
+    Version asynchrone de la vue add_user_follow, destinée à être servie par
+    un serveur ASGI (litrevu.asgi).
+
+    Le formulaire et les messages sont ceux de add_user_follow. Les listes
+    des abonnements et des abonnés sont lues l'une après l'autre avec
+    l'ORM asynchrone, auteurs joints, avant le rendu du template.
+
+    Args:
+        request (HttpRequest): L'objet de requête HTTP contenant les
+        informations sur la demande de l'utilisateur.
+
+    Returns:
+        HttpResponse: Le rendu de 'follow.html', une redirection après un
+        nouvel abonnement, ou une redirection vers la page de connexion.
+    """
+    if not await _ais_authenticated(request):
+        return redirect_to_login(request.get_full_path())
+    message = ''
+    if request.method == 'POST':
+        form = FollowUserForm(request.POST)
+        if await sync_to_async(form.is_valid)():
+            followed_user = form.cleaned_data['username']
+            if followed_user != request.user:
+                _, created = await UserFollows.objects.aget_or_create(
+                    user=request.user, followed_user=followed_user)
+                if created:
+                    return redirect('followUsersasync')
+            message = "Vous êtes déjà abonné à cet utilisateur."
+            form = FollowUserForm()
+    else:
+        form = FollowUserForm()
+
+    async def as_list(queryset):
+        return [follow async for follow in queryset]
+
+    user_follows = await as_list(UserFollows.objects.filter(
+        user=request.user).select_related('followed_user'))
+    followed_by = await as_list(UserFollows.objects.filter(
+        followed_user=request.user).select_related('user'))
+    suggestions = await sync_to_async(follow_suggestions)(request.user)
+    return await sync_to_async(render)(request, 'follow.html', {
+        'form': form,
+        'folloded_by': followed_by,
+        'user_follows': user_follows,
+        'suggestions': suggestions,
+        'message': message,
+        })
+
+
+async def feed_events(request):
+    """
+    Flux Server-Sent Events des nouveaux éléments du flux de l'utilisateur
+    connecté, à servir par l'application ASGI (litrevu.asgi) : la
+    connexion reste ouverte sans occuper de thread. Chaque ticket ou
+    critique ajouté à son flux par un autre utilisateur produit un
+    événement 'item' ({'kind', 'id', 'user'}) ; la page du flux propose
+    alors de la recharger (static/js/events.js) au lieu de l'interroger à
+    intervalles réguliers.
+
+    Args:
+        request (HttpRequest): L'objet de requête HTTP.
+
+    Returns:
+        StreamingHttpResponse: Le flux text/event-stream (voir
+        application.events.feed_event_stream), une réponse 401 si
+        l'utilisateur n'est pas connecté ou 204 hors ASGI.
+    """
+    if not await _ais_authenticated(request):
+        return HttpResponse(status=401)
+    if not isinstance(request, ASGIRequest):
+        # Sous WSGI, la connexion occuperait un thread du serveur pendant
+        # toute sa durée : la réponse 204 demande au navigateur de ne pas
+        # se reconnecter.
+        return HttpResponse(status=204)
+    response = StreamingHttpResponse(
+        events.feed_event_stream(request.user.id),
+        content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Désactive la mise en tampon des proxys (nginx).
+    response['X-Accel-Buffering'] = 'no'
+    return response
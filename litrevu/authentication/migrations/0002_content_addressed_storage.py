@@ -0,0 +1,19 @@
+# Generated by Django 4.2.13 on 2026-10-18 16:51
+
+from django.db import migrations, models
+import litrevu.storage
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authentication', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='user',
+            name='profile_photo',
+            field=models.ImageField(storage=litrevu.storage.content_addressed_storage, upload_to='', verbose_name='Photo de profil'),
+        ),
+    ]
@@ -1,6 +1,8 @@
 from django.db import models
 from django.contrib.auth.models import AbstractUser
+from litrevu.storage import content_addressed_storage
 
 
 class User(AbstractUser):
-    profile_photo = models.ImageField(verbose_name='Photo de profil')
+    profile_photo = models.ImageField(verbose_name='Photo de profil',
+                                      storage=content_addressed_storage)
@@ -2,6 +2,8 @@
 ASGI config for litrevu project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+Les vues asynchrones (flux_async, feed_events et son flux Server-Sent
+Events) doivent être servies par cette application.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.0/howto/deployment/asgi/
@@ -0,0 +1,130 @@
+from contextvars import ContextVar
+from functools import wraps
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.utils.deprecation import MiddlewareMixin
+
+REPLICA = 'replica'
+STICKY_COOKIE = 'litrevu_primary'
+
+_replica_reads = ContextVar('litrevu_replica_reads', default=False)
+
+# Pragmas qui modifient le fichier de la base : ignorés sur une connexion
+# en lecture seule.
+WRITE_PRAGMAS = {'journal_mode', 'synchronous'}
+
+
+def is_read_only(connection):
+    return 'mode=ro' in str(connection.settings_dict['NAME'])
+
+
+@receiver(connection_created)
+def configure_sqlite(sender, connection, **kwargs):
+    """
+    Applique SQLITE_PRAGMAS à chaque nouvelle connexion SQLite. Les
+    connexions ouvertes en lecture seule (URI « mode=ro ») reçoivent en
+    plus « query_only », mais pas les pragmas d'écriture.
+    """
+    if connection.vendor != 'sqlite' or not settings.SQLITE_PRAGMAS:
+        return
+    read_only = is_read_only(connection)
+    # Connexion brute : les pragmas n'apparaissent ni dans le journal des
+    # requêtes ni dans les mesures.
+    for name, value in settings.SQLITE_PRAGMAS.items():
+        if not (read_only and name in WRITE_PRAGMAS):
+            connection.connection.execute('PRAGMA {} = {}'.format(name, value))
+    if read_only:
+        connection.connection.execute('PRAGMA query_only = ON')
+
+
+class ReplicaRouter:
+    """
+    Envoie vers la base REPLICA les lectures faites pendant une vue
+    décorée par replica_reads, et tout le reste, écritures et migrations
+    comprises, vers 'default'.
+
+    Une lecture faite dans une transaction de 'default' y reste : la
+    réplique ne verrait pas les écritures non encore validées.
+    """
+
+    def db_for_read(self, model, **hints):
+        if (_replica_reads.get() and
+                not connections['default'].in_atomic_block):
+            return REPLICA
+        return None
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # La réplique est une copie de 'default' : les objets des deux
+        # bases peuvent être liés.
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db != REPLICA
+
+
+def replica_reads(view=None, *, unless=None):
+    """
+    Décorateur de vue : les lectures d'une requête GET ou HEAD sont
+    envoyées à la réplique (si ReplicaRouter est installé).
+
+    La requête reste sur 'default' si le navigateur porte le cookie
+    STICKY_COOKIE, posé par ReplicaStickinessMiddleware après une
+    écriture, ou si `unless(request)` est vrai : l'utilisateur voit ainsi
+    ses propres écritures, et les données récentes, même si la réplique
+    est en retard.
+
+    À placer sous login_required, pour que la session et l'utilisateur
+    soient lus sur 'default'.
+    """
+    if view is None:
+        return lambda view: replica_reads(view, unless=unless)
+
+    def use_replica(request):
+        return (request.method in ('GET', 'HEAD') and
+                STICKY_COOKIE not in request.COOKIES and
+                not (unless and unless(request)))
+
+    if iscoroutinefunction(view):
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            # `unless` peut lire la session ou l'utilisateur : dans un
+            # thread, hors de la boucle d'événements.
+            replica = (await sync_to_async(use_replica)(request) if unless
+                       else use_replica(request))
+            token = _replica_reads.set(replica)
+            try:
+                return await view(request, *args, **kwargs)
+            finally:
+                _replica_reads.reset(token)
+    else:
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            token = _replica_reads.set(use_replica(request))
+            try:
+                return view(request, *args, **kwargs)
+            finally:
+                _replica_reads.reset(token)
+    return wrapper
+
+
+class ReplicaStickinessMiddleware(MiddlewareMixin):
+    """
+    Après une requête d'écriture réussie (POST, PUT, PATCH, DELETE), pose
+    pour REPLICA_STICKY_SECONDS secondes le cookie STICKY_COOKIE, qui garde
+    les vues replica_reads de ce navigateur sur 'default' le temps que la
+    réplique rattrape l'écriture.
+    """
+
+    def process_response(self, request, response):
+        if (request.method not in ('GET', 'HEAD', 'OPTIONS', 'TRACE') and
+                response.status_code < 400):
+            response.set_cookie(STICKY_COOKIE, '1',
+                                max_age=settings.REPLICA_STICKY_SECONDS,
+                                httponly=True, samesite='Lax')
+        return response
@@ -0,0 +1,281 @@
+import hmac
+import logging
+import re
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+from contextlib import ExitStack
+from contextvars import ContextVar
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse, HttpResponseForbidden
+from django.template.base import Template
+
+logger = logging.getLogger(__name__)
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5,
+                    5.0, 10.0)
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200)
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+_IN_LIST = re.compile(r'IN \((?:%s, )*%s\)')
+
+
+def fingerprint(sql):
+    """
+    Réduit une requête SQL à sa forme, sans paramètres : deux requêtes de
+    même empreinte ne diffèrent que par leurs valeurs (motif N+1). Les
+    listes IN sont ramenées à une seule forme quelle que soit leur taille.
+    """
+    return _IN_LIST.sub('IN (...)', sql)
+
+
+class RequestStats:
+    """
+    Mesures d'une requête HTTP en cours : requêtes SQL (nombre, durée,
+    empreintes) et temps de rendu des templates.
+    """
+
+    def __init__(self):
+        self.queries = 0
+        self.sql_time = 0.0
+        self.fingerprints = Counter()
+        self.template_time = 0.0
+        self.template_depth = 0
+
+    def record_query(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql_time += time.perf_counter() - start
+            self.queries += 1
+            self.fingerprints[fingerprint(sql)] += 1
+
+    def duplicates(self):
+        """
+        Nombre de requêtes SQL répétant une empreinte déjà vue.
+        """
+        return sum(count - 1 for count in self.fingerprints.values())
+
+
+_current = ContextVar('litrevu_metrics_request', default=None)
+
+
+class Histogram:
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        total = 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            total += count
+            yield bound, total
+
+
+def _labels(labels):
+    return ','.join('{}="{}"'.format(name, str(value).replace(
+        '\\', '\\\\').replace('"', '\\"')) for name, value in labels)
+
+
+class Registry:
+    """
+    Agrégats des mesures du processus, par vue : histogrammes de durée et
+    de nombre de requêtes SQL, et totaux. D'autres modules peuvent y
+    ajouter des compteurs (increment). Chaque processus serveur a son
+    propre registre ; Prometheus additionne les processus.
+    """
+
+    TOTALS = (
+        ('sql_queries_total', 'Requêtes SQL exécutées.'),
+        ('sql_duplicate_queries_total',
+         'Requêtes SQL répétant une empreinte déjà vue dans la requête.'),
+        ('sql_duration_seconds_total', 'Temps passé dans les requêtes SQL.'),
+        ('template_render_seconds_total',
+         'Temps passé à rendre les templates.'),
+        ('response_bytes_total', 'Taille des réponses.'),
+    )
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._durations = {}
+            self._query_counts = {}
+            self._totals = Counter()
+            self._counters = {}
+
+    def observe(self, view, duration, stats, size):
+        with self._lock:
+            if view not in self._durations:
+                self._durations[view] = Histogram(DURATION_BUCKETS)
+                self._query_counts[view] = Histogram(QUERY_COUNT_BUCKETS)
+            self._durations[view].observe(duration)
+            self._query_counts[view].observe(stats.queries)
+            self._totals['sql_queries_total', view] += stats.queries
+            self._totals['sql_duplicate_queries_total', view] += (
+                stats.duplicates())
+            self._totals['sql_duration_seconds_total', view] += (
+                stats.sql_time)
+            self._totals['template_render_seconds_total', view] += (
+                stats.template_time)
+            self._totals['response_bytes_total', view] += size
+
+    def increment(self, name, help, labels=(), amount=1):
+        """
+        Incrémente le compteur `name` (exposé sous litrevu_<name>) pour les
+        étiquettes données, une suite de paires (nom, valeur).
+        """
+        with self._lock:
+            counter = self._counters.setdefault(name, (help, Counter()))[1]
+            counter[tuple(labels)] += amount
+
+    def render(self):
+        """
+        Retourne les mesures au format texte de Prometheus.
+        """
+        lines = []
+
+        def histograms(name, help, histograms):
+            lines.extend(['# HELP litrevu_{} {}'.format(name, help),
+                          '# TYPE litrevu_{} histogram'.format(name)])
+            for view, histogram in sorted(histograms.items()):
+                for bound, total in histogram.cumulative():
+                    lines.append('litrevu_{}_bucket{{{}}} {}'.format(
+                        name, _labels([('view', view), ('le', bound)]),
+                        total))
+                lines.append('litrevu_{}_sum{{{}}} {}'.format(
+                    name, _labels([('view', view)]), histogram.sum))
+                lines.append('litrevu_{}_count{{{}}} {}'.format(
+                    name, _labels([('view', view)]), histogram.count))
+
+        def counter(name, help, values):
+            lines.extend(['# HELP litrevu_{} {}'.format(name, help),
+                          '# TYPE litrevu_{} counter'.format(name)])
+            for labels, value in sorted(values.items()):
+                lines.append('litrevu_{}{{{}}} {}'.format(
+                    name, _labels(labels), value))
+
+        with self._lock:
+            histograms('request_duration_seconds',
+                       'Durée des requêtes HTTP.', self._durations)
+            histograms('request_sql_queries',
+                       'Nombre de requêtes SQL par requête HTTP.',
+                       self._query_counts)
+            for name, help in self.TOTALS:
+                counter(name, help, {
+                    (('view', view),): value
+                    for (total, view), value in self._totals.items()
+                    if total == name})
+            for name, (help, values) in sorted(self._counters.items()):
+                counter(name, help, values)
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+_original_render = Template.render
+
+
+def _timed_render(self, context):
+    # Seul le rendu le plus externe est chronométré : il inclut les
+    # templates inclus ou hérités.
+    stats = _current.get()
+    if stats is None or stats.template_depth:
+        return _original_render(self, context)
+    stats.template_depth += 1
+    start = time.perf_counter()
+    try:
+        return _original_render(self, context)
+    finally:
+        stats.template_time += time.perf_counter() - start
+        stats.template_depth -= 1
+
+
+def _server_timing(duration, stats):
+    return ', '.join([
+        'db;dur={:.1f};desc="{} requêtes SQL, {} répétées"'.format(
+            stats.sql_time * 1000, stats.queries, stats.duplicates()),
+        'tpl;dur={:.1f}'.format(stats.template_time * 1000),
+        'total;dur={:.1f}'.format(duration * 1000),
+    ])
+
+
+class MetricsMiddleware:
+    """
+    Mesure chaque requête : vue, nombre et durée des requêtes SQL,
+    requêtes répétées (même empreinte, signe d'un N+1), temps de rendu des
+    templates et taille de la réponse.
+
+    Les mesures sont ajoutées au registre du processus (exposé par
+    metrics_view) et, si METRICS_SERVER_TIMING est vrai, renvoyées dans
+    l'en-tête Server-Timing, lisible dans les outils de développement du
+    navigateur. Une requête comptant au moins METRICS_DUPLICATE_THRESHOLD
+    requêtes SQL répétées est signalée dans le journal litrevu.metrics.
+
+    Middleware facultatif, activé par LITREVU_METRICS=1 (voir settings) ;
+    il doit être placé en tête de MIDDLEWARE pour tout mesurer. Il est
+    synchrone : sous ASGI, Django exécute alors les vues asynchrones dans
+    un thread.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        Template.render = _timed_render
+
+    def __call__(self, request):
+        stats = RequestStats()
+        token = _current.set(stats)
+        start = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(
+                        connection.execute_wrapper(stats.record_query))
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        duration = time.perf_counter() - start
+
+        match = request.resolver_match
+        view = match.view_name if match else 'unresolved'
+        size = 0 if response.streaming else len(response.content)
+        registry.observe(view, duration, stats, size)
+        if stats.duplicates() >= settings.METRICS_DUPLICATE_THRESHOLD:
+            sql, count = stats.fingerprints.most_common(1)[0]
+            logger.warning(
+                '%s : %d requêtes SQL répétées sur %d ; la plus fréquente '
+                '(%d fois) : %s', request.path, stats.duplicates(),
+                stats.queries, count, sql)
+        if settings.METRICS_SERVER_TIMING:
+            response['Server-Timing'] = _server_timing(duration, stats)
+        return response
+
+
+def metrics_view(request):
+    """
+    Expose les mesures du processus au format texte de Prometheus.
+
+    Accès réservé aux membres de l'équipe (is_staff) connectés, ou à un
+    client présentant l'en-tête « Authorization: Bearer <METRICS_TOKEN> »
+    lorsque METRICS_TOKEN est défini.
+    """
+    token = settings.METRICS_TOKEN
+    authorization = request.headers.get('Authorization', '')
+    if not (request.user.is_staff or token and hmac.compare_digest(
+            authorization.encode(), ('Bearer ' + token).encode())):
+        return HttpResponseForbidden()
+    return HttpResponse(registry.render(),
+                        content_type=PROMETHEUS_CONTENT_TYPE)
@@ -0,0 +1,132 @@
+import math
+import threading
+import time
+from functools import wraps
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from litrevu.metrics import registry
+
+BUCKET_KEY = 'ratelimit:{}:{}:{}'
+UNSAFE_METHODS = ('POST', 'PUT', 'PATCH', 'DELETE')
+
+_lock = threading.Lock()
+
+
+def _refill(state, capacity, per_minute, now):
+    """
+    Retourne le nombre de jetons d'un seau à l'instant `now` : le seau se
+    remplit de `per_minute` jetons par minute, sans dépasser `capacity`.
+    Un seau absent du cache est plein.
+    """
+    if state is None:
+        return capacity
+    tokens, updated = state
+    return min(capacity, tokens + (now - updated) * per_minute / 60)
+
+
+def _buckets(request, scope):
+    """
+    Retourne les seaux à débiter pour la requête : celui de l'utilisateur
+    connecté et celui de son adresse IP, avec leur budget.
+    """
+    user_budget, ip_budget = settings.RATE_LIMITS[scope]
+    buckets = []
+    if request.user.is_authenticated:
+        buckets.append(('user', BUCKET_KEY.format(
+            scope, 'user', request.user.id), user_budget))
+    address = request.META.get('REMOTE_ADDR')
+    if address:
+        buckets.append(('ip', BUCKET_KEY.format(scope, 'ip', address),
+                        ip_budget))
+    return buckets
+
+
+def consume(request, scope):
+    """
+    Prend un jeton dans chacun des seaux de la requête (seau à jetons, dans
+    le cache de Django).
+
+    Les jetons ne sont pris que si tous les seaux en ont : une requête
+    refusée ne coûte rien. Les seaux sont lus et écrits en une opération de
+    cache chacun, sous un verrou qui rend l'opération atomique dans le
+    processus ; entre processus partageant un cache, deux requêtes
+    simultanées peuvent prendre le même jeton : la limite est alors
+    approximative, ce qui suffit à arrêter un client qui martèle.
+
+    Returns:
+        tuple: None si la requête est acceptée, sinon le seau vide ('user'
+        ou 'ip') et le délai en secondes avant le prochain jeton.
+    """
+    buckets = _buckets(request, scope)
+    with _lock:
+        now = time.time()
+        states = cache.get_many([key for _, key, _ in buckets])
+        updates = {}
+        for name, key, (capacity, per_minute) in buckets:
+            tokens = _refill(states.get(key), capacity, per_minute, now)
+            if tokens < 1:
+                return name, math.ceil((1 - tokens) * 60 / per_minute)
+            # Au-delà du temps de remplissage complet, un seau absent
+            # équivaut à un seau plein : l'entrée peut expirer.
+            updates[key] = ((tokens - 1, now),
+                            math.ceil(capacity * 60 / per_minute))
+        for key, (state, timeout) in updates.items():
+            cache.set(key, state, timeout)
+    return None
+
+
+def _too_many_requests(scope, bucket, retry_after):
+    registry.increment(
+        'throttled_requests_total',
+        'Requêtes refusées par la limitation de débit.',
+        [('scope', scope), ('bucket', bucket)])
+    response = HttpResponse(
+        'Trop de requêtes : réessayez dans {} seconde{}.'.format(
+            retry_after, 's' if retry_after > 1 else ''),
+        status=429, content_type='text/plain; charset=utf-8')
+    response['Retry-After'] = str(retry_after)
+    return response
+
+
+def rate_limit(scope, methods=UNSAFE_METHODS):
+    """
+    Décorateur de vue : limite le débit des requêtes `methods` de la vue
+    par utilisateur et par adresse IP, selon le budget
+    RATE_LIMITS[scope] (voir settings). Les vues d'une même portée
+    partagent leurs seaux. Au-delà du budget, la vue n'est pas appelée et
+    la réponse est 429, avec l'en-tête Retry-After ; chaque refus est
+    compté dans la mesure litrevu_throttled_requests_total (voir
+    litrevu.metrics).
+
+    À placer sous login_required, pour que l'utilisateur soit connu, et
+    au-dessus des décorateurs qui lisent le corps de la requête : une
+    requête refusée n'est pas analysée.
+    """
+    def check(request):
+        if request.method not in methods or scope not in settings.RATE_LIMITS:
+            return None
+        throttled = consume(request, scope)
+        if throttled:
+            return _too_many_requests(scope, *throttled)
+        return None
+
+    def decorator(view):
+        if iscoroutinefunction(view):
+            @wraps(view)
+            async def wrapper(request, *args, **kwargs):
+                # Le cache et request.user sont synchrones : dans un thread.
+                response = await sync_to_async(check)(request)
+                if response is not None:
+                    return response
+                return await view(request, *args, **kwargs)
+        else:
+            @wraps(view)
+            def wrapper(request, *args, **kwargs):
+                response = check(request)
+                if response is not None:
+                    return response
+                return view(request, *args, **kwargs)
+        return wrapper
+    return decorator
@@ -54,6 +54,15 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# Instrumentation des requêtes (voir litrevu.metrics), activée par
+# LITREVU_METRICS=1. Les mesures sont exposées au format Prometheus sur
+# /metrics/, pour l'équipe ou avec « Authorization: Bearer METRICS_TOKEN ».
+if os.environ.get('LITREVU_METRICS') == '1':
+    MIDDLEWARE.insert(0, 'litrevu.metrics.MetricsMiddleware')
+METRICS_TOKEN = os.environ.get('LITREVU_METRICS_TOKEN', '')
+METRICS_SERVER_TIMING = True
+METRICS_DUPLICATE_THRESHOLD = 5
+
 ROOT_URLCONF = 'litrevu.urls'
 
 TEMPLATES = [
@@ -62,7 +71,6 @@ TEMPLATES = [
         'DIRS': [
             BASE_DIR.joinpath('templates')
             ],
-        'APP_DIRS': True,
         'OPTIONS': {
             'context_processors': [
                 'django.template.context_processors.debug',
@@ -70,6 +78,17 @@ TEMPLATES = [
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
             ],
+            # Chaque template est lu et compilé une seule fois par
+            # processus, puis servi depuis la mémoire (c'est le défaut de
+            # Django depuis la version 4.1, explicité ici). En
+            # développement, runserver vide ce cache à chaque modification
+            # d'un template.
+            'loaders': [
+                ('django.template.loaders.cached.Loader', [
+                    'django.template.loaders.filesystem.Loader',
+                    'django.template.loaders.app_directories.Loader',
+                ]),
+            ],
         },
     },
 ]
@@ -87,6 +106,95 @@ DATABASES = {
     }
 }
 
+# Les vues de lecture (flux, publications, abonnements) lisent la réplique,
+# sauf pendant REPLICA_STICKY_SECONDS secondes après une écriture de
+# l'utilisateur ou un changement de son flux : à régler au-delà du retard
+# maximal de la réplication (voir litrevu.database.replica_reads).
+REPLICA_STICKY_SECONDS = 10
+
+# Mode « SQLite de production », activé par LITREVU_SQLITE_PRODUCTION=1 :
+# journal WAL (les lectures ne bloquent plus l'écriture), attente de
+# busy_timeout millisecondes au lieu de « database is locked », connexions
+# réutilisées et vérifiées, et lectures des vues replica_reads envoyées par
+# litrevu.database.ReplicaRouter vers l'alias 'replica', ouvert en lecture
+# seule. La réplique est le même fichier, ou LITREVU_SQLITE_REPLICA (copie
+# tenue à jour par un outil de réplication). Les pragmas sont appliqués à
+# chaque connexion par litrevu.database.configure_sqlite.
+SQLITE_PRAGMAS = {}
+if os.environ.get('LITREVU_SQLITE_PRODUCTION') == '1':
+    DATABASES['default'].update(CONN_MAX_AGE=600, CONN_HEALTH_CHECKS=True)
+    DATABASES['replica'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': Path(os.environ.get(
+            'LITREVU_SQLITE_REPLICA', DATABASES['default']['NAME']
+        )).resolve().as_uri() + '?mode=ro',
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_ROUTERS = ['litrevu.database.ReplicaRouter']
+    MIDDLEWARE.append('litrevu.database.ReplicaStickinessMiddleware')
+    SQLITE_PRAGMAS = {
+        'journal_mode': 'wal',
+        'synchronous': 'normal',
+        'busy_timeout': 5000,
+        'cache_size': -64 * 1024,
+        'mmap_size': 256 * 1024 * 1024,
+        'temp_store': 'memory',
+    }
+
+
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+#
+# Les fragments de flux sont mis en cache par utilisateur (voir
+# application.cache). Les deux caches sont bornés par MAX_ENTRIES : une fois
+# la borne atteinte, le cache mémoire local évince d'abord les entrées les
+# moins récemment lues (une approximation de LRU), le cache fichier des
+# fichiers pris au hasard. Le cache mémoire local est propre à chaque
+# processus : avec plusieurs workers, LITREVU_CACHE_DIR permet d'utiliser un
+# cache fichier partagé afin que les invalidations soient vues par tous.
+
+if os.environ.get('LITREVU_CACHE_DIR'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.environ['LITREVU_CACHE_DIR'],
+            'OPTIONS': {'MAX_ENTRIES': 10000, 'CULL_FREQUENCY': 10},
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'litrevu',
+            'OPTIONS': {'MAX_ENTRIES': 10000, 'CULL_FREQUENCY': 10},
+        }
+    }
+
+FEED_CACHE_TIMEOUT = 15 * 60
+
+# Durée de vie de la version du flux de chaque utilisateur, qui sert de clé
+# aux fragments et d'ETag (voir application.cache.feed_version). Elle
+# change à chaque écriture ; son expiration borne la durée pendant laquelle
+# une écriture qui l'aurait omise laisse servir un état périmé. Avec le
+# cache mémoire local, une écriture ne change la version que dans le
+# processus qui l'a traitée : les autres workers servent leur version
+# jusqu'à son expiration, d'où une durée courte sans cache partagé.
+if os.environ.get('LITREVU_CACHE_DIR'):
+    FEED_VERSION_TIMEOUT = 24 * 60 * 60
+else:
+    FEED_VERSION_TIMEOUT = 5 * 60
+
+# Durée de vie en cache du rendu HTML de chaque ticket et critique du flux
+# (voir application.cache.feed_cards). La clé dépend du contenu affiché :
+# une modification produit une nouvelle clé, l'ancienne expire.
+FEED_CARD_CACHE_TIMEOUT = 60 * 60
+
+# Durée de vie en cache des relations d'abonnement et de blocage de chaque
+# utilisateur (voir application.graph), invalidées à chaque écriture.
+GRAPH_CACHE_TIMEOUT = 60 * 60
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
@@ -140,4 +248,45 @@ AUTH_USER_MODEL = 'authentication.User'
 LOGIN_URL = 'login'
 
 MEDIA_URL = '/media/'
-MEDIA_ROOT = BASE_DIR.joinpath('media/')
\ No newline at end of file
+MEDIA_ROOT = BASE_DIR.joinpath('media/')
+
+# Limites des images de tickets, vérifiées pendant l'upload par
+# application.uploadhandlers.TicketImageUploadHandler.
+TICKET_IMAGE_MAX_SIZE = 10 * 1024 * 1024
+TICKET_IMAGE_MAX_PIXELS = 40_000_000
+TICKET_IMAGE_FORMATS = ('JPEG', 'PNG', 'WEBP', 'GIF')
+
+# Vignettes des images de tickets (voir application.thumbnails), générées
+# hors du thread de la requête par un pool de THUMBNAIL_WORKERS threads.
+THUMBNAIL_WIDTHS = (150, 300, 600)
+THUMBNAIL_WORKERS = 2
+THUMBNAIL_ASYNC = True
+
+# Recherche plein texte (voir application.search). SEARCH_BACKEND est le
+# chemin d'une classe de moteur ; None choisit FTS5 si la base SQLite le
+# permet, la recherche par sous-chaîne sinon. Le score bm25 est multiplié
+# par 1 + 0,5 / (1 + âge / SEARCH_RECENCY_DAYS), l'âge étant en jours.
+SEARCH_BACKEND = None
+SEARCH_RECENCY_DAYS = 30
+
+# Limitation du débit des écritures (voir litrevu.ratelimit) : par portée,
+# le budget de chaque utilisateur puis celui de chaque adresse IP, sous la
+# forme (rafale, jetons regagnés par minute). Chaque publication,
+# abonnement ou blocage écrit dans les flux matérialisés de nombreux
+# utilisateurs ; sous SQLite, tous attendent le même verrou d'écriture.
+# Derrière un proxy, REMOTE_ADDR doit contenir l'adresse du client.
+RATE_LIMITS = {
+    'posts': ((10, 10), (30, 30)),
+    'relations': ((20, 20), (60, 60)),
+}
+
+# Notifications du flux en temps réel (voir application.events), servies
+# en Server-Sent Events par l'application ASGI. EVENTS_BROKER est le chemin
+# du courtier de messages ; LocalBroker ne relie que les requêtes d'un même
+# processus. Une connexion est fermée au bout de EVENTS_MAX_SECONDS
+# secondes et le navigateur se reconnecte après EVENTS_RETRY_SECONDS.
+EVENTS_BROKER = 'application.events.LocalBroker'
+EVENTS_QUEUE_SIZE = 100
+EVENTS_HEARTBEAT_SECONDS = 15
+EVENTS_MAX_SECONDS = 5 * 60
+EVENTS_RETRY_SECONDS = 3
@@ -0,0 +1,66 @@
+import hashlib
+import os
+import posixpath
+from django.core.files.storage import FileSystemStorage
+from django.views.static import serve
+
+CAS_PREFIX = 'cas'
+IMMUTABLE_PREFIXES = (CAS_PREFIX + '/', 'thumbnails/' + CAS_PREFIX + '/')
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Stockage des médias adressé par contenu, sous MEDIA_ROOT.
+
+    Chaque fichier est enregistré sous cas/<aa>/<bb>/<sha256><extension> :
+    un même fichier envoyé plusieurs fois (la couverture d'un livre
+    populaire, par exemple) n'est écrit qu'une fois, et son URL ne change
+    jamais de contenu, ce qui permet de la servir avec un cache immuable.
+    """
+
+    def content_name(self, name, content):
+        """
+        Calcule le nom adressé par contenu du fichier, en lisant son
+        contenu par morceaux.
+        """
+        digest = hashlib.sha256()
+        content.seek(0)
+        for chunk in content.chunks():
+            digest.update(chunk)
+        content.seek(0)
+        hexdigest = digest.hexdigest()
+        extension = os.path.splitext(name)[1].lower()
+        return posixpath.join(CAS_PREFIX, hexdigest[:2], hexdigest[2:4],
+                              hexdigest + extension)
+
+    def _save(self, name, content):
+        name = self.content_name(name, content)
+        if self.exists(name):
+            return name
+        return super()._save(name, content)
+
+
+_content_addressed_storage = ContentAddressedStorage()
+
+
+def content_addressed_storage():
+    """
+    Retourne le stockage adressé par contenu partagé par Ticket.image et
+    User.profile_photo (callable, pour que les migrations n'en figent pas
+    la configuration).
+    """
+    return _content_addressed_storage
+
+
+def serve_media(request, path, document_root=None):
+    """
+    Sert un fichier de MEDIA_ROOT en développement, avec un cache immuable
+    d'un an pour les fichiers adressés par contenu et leurs vignettes. En
+    production, le serveur web doit appliquer le même en-tête
+    Cache-Control aux mêmes préfixes.
+    """
+    response = serve(request, path, document_root=document_root)
+    if path.startswith(IMMUTABLE_PREFIXES):
+        response['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+    return response
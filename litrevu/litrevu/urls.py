@@ -18,6 +18,8 @@ from django.contrib import admin
 from django.urls import path
 import authentication.views
 import application.views
+import litrevu.metrics
+import litrevu.storage
 from django.conf.urls.static import static
 from django.conf import settings
 
@@ -27,6 +29,7 @@ urlpatterns = [
     path('', authentication.views.first_page, name='login'),
     path('logout/', authentication.views.logout_user, name='logout'),
     path('flux/', application.views.flux, name='flux'),
+    path('api/flux/', application.views.flux_api, name='fluxapi'),
     path('signup/', authentication.views.singup_page, name='signup'),
     path('ticket/creation/', application.views.ticket_creation,
          name='ticketcreation'),
@@ -55,8 +58,17 @@ urlpatterns = [
          application.views.block_user, name='block_user'),
     path('unblock_user/<int:user_id>/',
          application.views.unblock_user, name='unblock_user'),
+    path('review/follow/typeahead/', application.views.user_typeahead,
+         name='userTypeahead'),
+    path('metrics/', litrevu.metrics.metrics_view, name='metrics'),
+    path('search/', application.views.search_view, name='search'),
+    path('async/flux/', application.views.flux_async, name='fluxasync'),
+    path('events/flux/', application.views.feed_events, name='fluxevents'),
+    path('async/review/follow/', application.views.add_user_follow_async,
+         name='followUsersasync'),
 ]
 
 if settings.DEBUG:
     urlpatterns += static(
-        settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+        settings.MEDIA_URL, view=litrevu.storage.serve_media,
+        document_root=settings.MEDIA_ROOT)
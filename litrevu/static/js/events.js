@@ -0,0 +1,16 @@
+// Nouveaux éléments du flux : à chaque événement 'item' reçu du flux
+// Server-Sent Events, affiche le bandeau invitant à recharger la page au
+// lieu d'interroger le serveur à intervalles réguliers.
+(function () {
+    var banner = document.getElementById('feed-events');
+    if (!banner || !window.EventSource) {
+        return;
+    }
+    var count = 0;
+    var source = new EventSource(banner.dataset.url);
+    source.addEventListener('item', function () {
+        count += 1;
+        banner.querySelector('[data-count]').textContent = count;
+        banner.classList.remove('d-none');
+    });
+})();
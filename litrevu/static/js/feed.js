@@ -0,0 +1,32 @@
+// « Charger plus » : ajoute la page suivante du flux à la suite de la page
+// courante au lieu de recharger la page. Sans JavaScript, le lien mène
+// simplement à la page suivante.
+document.addEventListener('click', function (event) {
+    var link = event.target.closest('[data-load-more]');
+    if (!link) {
+        return;
+    }
+    event.preventDefault();
+    link.classList.add('disabled');
+    fetch(link.href, {credentials: 'same-origin'})
+        .then(function (response) { return response.text(); })
+        .then(function (html) {
+            var next = new DOMParser().parseFromString(html, 'text/html');
+            var items = document.getElementById('feed-items');
+            next.getElementById('feed-items').childNodes.forEach(function (node) {
+                items.appendChild(document.importNode(node, true));
+            });
+            var pagination = document.getElementById('feed-pagination');
+            var nextPagination = next.getElementById('feed-pagination');
+            var nextLink = nextPagination.querySelector('[data-load-more]');
+            pagination.querySelectorAll('[data-load-more]').forEach(function (old) {
+                old.remove();
+            });
+            if (nextLink) {
+                pagination.appendChild(document.importNode(nextLink, true));
+            }
+        })
+        .catch(function () {
+            window.location = link.href;
+        });
+});
@@ -0,0 +1,48 @@
+// Autocomplétion des noms d'utilisateurs du formulaire d'abonnement : les
+// suggestions sont demandées après une pause de saisie, et une requête
+// encore en cours est annulée dès que la saisie change.
+(function () {
+    var DELAY = 200;
+    var input = document.querySelector('[data-typeahead]');
+    if (!input) {
+        return;
+    }
+    var list = document.getElementById(input.getAttribute('list'));
+    var timer = null;
+    var controller = null;
+    var lastPrefix = null;
+
+    function show(usernames) {
+        list.replaceChildren.apply(list, usernames.map(function (username) {
+            var option = document.createElement('option');
+            option.value = username;
+            return option;
+        }));
+    }
+
+    function suggest() {
+        var prefix = input.value.trim();
+        if (prefix === lastPrefix) {
+            return;
+        }
+        lastPrefix = prefix;
+        if (controller) {
+            controller.abort();
+        }
+        if (!prefix) {
+            show([]);
+            return;
+        }
+        controller = new AbortController();
+        var url = input.dataset.typeahead + '?q=' + encodeURIComponent(prefix);
+        fetch(url, {credentials: 'same-origin', signal: controller.signal})
+            .then(function (response) { return response.json(); })
+            .then(function (data) { show(data.usernames); })
+            .catch(function () {});
+    }
+
+    input.addEventListener('input', function () {
+        clearTimeout(timer);
+        timer = setTimeout(suggest, DELAY);
+    });
+})();